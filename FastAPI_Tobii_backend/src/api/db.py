@@ -14,7 +14,8 @@ SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_FILE}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
+    # Job workers write from their own processes, wait for the lock instead of failing
+    connect_args={"check_same_thread": False, "timeout": 30},
 )
 
 SessionLocal = sessionmaker(
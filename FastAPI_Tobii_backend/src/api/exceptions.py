@@ -91,3 +91,23 @@ class TrackingJobAlreadyRunningError(BaseError):
 
     def __init__(self) -> None:
         super().__init__(self.message, self.code)
+
+
+# Job errors
+class JobCancelledError(BaseError):
+    """Exception raised inside a job when its cancellation was requested."""
+
+    message: str = "Job cancelled"
+    code: int = 409
+
+    def __init__(self) -> None:
+        super().__init__(self.message, self.code)
+
+
+class JobStateError(BaseError):
+    """Exception raised when a job cannot be cancelled or resumed in its current state."""
+
+    def __init__(self, message: str, code: int = 409):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List
 
 
 class AnalysisRequest(BaseModel):
@@ -23,4 +23,6 @@ class AnalysisResponse(BaseModel):
     recording_id: str
     fps: float
     total_frames: int 
-    classes: List[ClassAnalysisResult]
\ No newline at end of file
+    classes: List[ClassAnalysisResult]
+    stage_timings: Dict[str, float] = {}  # Seconds spent in every analysis stage
+    pipeline_metrics: Dict[str, Dict[str, float]] = {}  # Utilization of the keyframe pipeline
\ No newline at end of file
@@ -1,10 +1,21 @@
+import json
 from pathlib import Path
 
-from sqlalchemy import ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import (
+    Boolean,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.api.db import Base
-from src.config import RECORDINGS_PATH, TRACKING_RESULTS_PATH
+from src.api.models.gaze import frame_timestamps_path, gaze_columns_path, heatmaps_path
+from src.api.models.jobs import JobPriority, JobStatus
+from src.config import CLASSIFIER_HEADS_PATH, RECORDINGS_PATH, TRACKING_RESULTS_PATH
 from src.utils import generate_pleasant_color
 
 
@@ -31,6 +42,18 @@ class Recording(Base):
     def gaze_data_path(self) -> Path:
         return RECORDINGS_PATH / f"{self.id}.tsv"
 
+    @property
+    def gaze_columns_path(self) -> Path:
+        return gaze_columns_path(self.gaze_data_path)
+
+    @property
+    def heatmaps_path(self) -> Path:
+        return heatmaps_path(self.gaze_data_path)
+
+    @property
+    def frame_timestamps_path(self) -> Path:
+        return frame_timestamps_path(self.video_path)
+
 
 class SimRoomClass(Base):
     __tablename__ = "classes"
@@ -45,6 +68,12 @@ class SimRoomClass(Base):
         cascade="all, delete-orphan",
     )
 
+    prototypes: Mapped[list["ClassPrototype"]] = relationship(
+        "ClassPrototype",
+        back_populates="simroom_class",
+        cascade="all, delete-orphan",
+    )
+
 
 class CalibrationRecording(Base):
     __tablename__ = "calibration_recordings"
@@ -125,6 +154,12 @@ class Annotation(Base):
         cascade="all, delete-orphan",
     )
 
+    embeddings: Mapped[list["AnnotationEmbedding"]] = relationship(
+        "AnnotationEmbedding",
+        back_populates="annotation",
+        cascade="all, delete-orphan",
+    )
+
 
 class PointLabel(Base):
     __tablename__ = "point_labels"
@@ -141,4 +176,116 @@ class PointLabel(Base):
     annotation: Mapped["Annotation"] = relationship(
         "Annotation",
         back_populates="point_labels",
-    )
\ No newline at end of file
+    )
+
+
+class AnnotationEmbedding(Base):
+    """The DINOv2 embedding of an annotation's crop, computed once when it is created."""
+
+    __tablename__ = "annotation_embeddings"
+    __table_args__ = (
+        UniqueConstraint(
+            "annotation_id",
+            "model_version",
+            "embedding_mode",
+            name="_annotation_model_mode_uc",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    annotation_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("annotations.id"),
+        index=True,
+    )
+    simroom_class_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("classes.id"),
+        index=True,
+    )
+    model_version: Mapped[str] = mapped_column(String)
+    embedding_mode: Mapped[str] = mapped_column(String)
+    embedding: Mapped[bytes] = mapped_column(LargeBinary)  # normalized float32 vector
+
+    annotation: Mapped["Annotation"] = relationship(
+        "Annotation",
+        back_populates="embeddings",
+    )
+
+
+class ClassPrototype(Base):
+    """
+    The running sum of a class's annotation embeddings. Annotations that are
+    created add to it, deleting one drops the row so it is rebuilt from the
+    stored embeddings on the next lookup.
+    """
+
+    __tablename__ = "class_prototypes"
+    __table_args__ = (
+        UniqueConstraint(
+            "simroom_class_id",
+            "model_version",
+            "embedding_mode",
+            name="_class_model_mode_uc",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    simroom_class_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("classes.id"),
+    )
+    model_version: Mapped[str] = mapped_column(String)
+    embedding_mode: Mapped[str] = mapped_column(String)
+    embedding_sum: Mapped[bytes] = mapped_column(LargeBinary)  # float32 vector
+    annotation_count: Mapped[int] = mapped_column(Integer, default=0)
+
+    simroom_class: Mapped["SimRoomClass"] = relationship(
+        "SimRoomClass",
+        back_populates="prototypes",
+    )
+
+
+class ClassifierHead(Base):
+    """A classification head trained on the stored embeddings of a set of classes."""
+
+    __tablename__ = "classifier_heads"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    class_ids_json: Mapped[str] = mapped_column(String)  # sorted
+    model_version: Mapped[str] = mapped_column(String)
+    embedding_mode: Mapped[str] = mapped_column(String)
+    version: Mapped[int] = mapped_column(Integer)  # counts up per class set
+    hidden: Mapped[int] = mapped_column(Integer)
+    embedding_count: Mapped[int] = mapped_column(Integer)
+    embeddings_digest: Mapped[str] = mapped_column(String)  # of the annotations trained on
+    accuracy: Mapped[float] = mapped_column(Float, nullable=True)  # on held out embeddings
+    created: Mapped[str] = mapped_column(String)
+
+    @property
+    def class_ids(self) -> list[int]:
+        return json.loads(self.class_ids_json)
+
+    @property
+    def weights_path(self) -> Path:
+        return CLASSIFIER_HEADS_PATH / f"{self.id}.pt"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    kind: Mapped[str] = mapped_column(String)
+    resource_class: Mapped[str] = mapped_column(String)
+    priority: Mapped[int] = mapped_column(Integer, default=JobPriority.BULK)
+    status: Mapped[str] = mapped_column(String, default=JobStatus.QUEUED, index=True)
+    payload_json: Mapped[str] = mapped_column(String)
+    result_json: Mapped[str] = mapped_column(String, nullable=True)
+    error: Mapped[str] = mapped_column(String, nullable=True)
+    progress: Mapped[float] = mapped_column(Float, default=0.0)
+    eta_seconds: Mapped[float] = mapped_column(Float, nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    worker_id: Mapped[str] = mapped_column(String, nullable=True)
+    created: Mapped[str] = mapped_column(String)
+    started: Mapped[str] = mapped_column(String, nullable=True)
+    finished: Mapped[str] = mapped_column(String, nullable=True)
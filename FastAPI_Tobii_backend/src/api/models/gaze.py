@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from pathlib import Path
 
 import numpy as np
 import numpy.typing as npt
@@ -76,3 +77,187 @@ class GazeData:
             if right_eye
             else None,
         )
+
+
+# Bump when the column layout changes, older sidecars are then parsed again
+GAZE_COLUMNS_VERSION = 1
+
+
+def gaze_columns_path(gaze_data_path: Path) -> Path:
+    """The binary sidecar with the parsed columns of a gaze data file."""
+    return gaze_data_path.with_name(f"{gaze_data_path.stem}.gaze-v{GAZE_COLUMNS_VERSION}.npy")
+
+
+def frame_timestamps_path(video_path: Path) -> Path:
+    """The cached presentation timestamps of a video's frames."""
+    return video_path.with_name(f"{video_path.stem}.frames.npy")
+
+
+def fixations_path(gaze_data_path: Path, algorithm: str, threshold: float) -> Path:
+    """The cached fixations of a gaze data file for one detector and threshold."""
+    return gaze_data_path.with_name(f"{gaze_data_path.stem}.fixations-{algorithm}-{threshold:g}.npy")
+
+
+# Bump when the heatmap layout changes, older heatmaps are then built again
+HEATMAPS_VERSION = 1
+
+
+def heatmaps_path(gaze_data_path: Path) -> Path:
+    """The directory with the precomputed heatmap levels of a gaze data file."""
+    return gaze_data_path.with_name(f"{gaze_data_path.stem}.heatmaps-v{HEATMAPS_VERSION}")
+
+
+class GazeColumn:
+    """Column offsets in a row of parsed gaze data, missing values are NaN."""
+
+    TIMESTAMP = 0
+    GAZE2D = slice(1, 3)
+    GAZE3D = slice(3, 6)
+    ORIGIN_LEFT = slice(6, 9)
+    DIRECTION_LEFT = slice(9, 12)
+    PUPIL_LEFT = 12
+    ORIGIN_RIGHT = slice(13, 16)
+    DIRECTION_RIGHT = slice(16, 19)
+    PUPIL_RIGHT = 19
+    COUNT = 20
+
+
+@dataclass
+class GazeColumns:
+    """
+    A whole gaze data file as one (samples, GazeColumn.COUNT) float64 array,
+    usually memory-mapped from its sidecar. The properties are views on it.
+    """
+
+    data: npt.NDArray[np.float64]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def timestamp(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.TIMESTAMP]
+
+    @property
+    def gaze2d(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.GAZE2D]
+
+    @property
+    def gaze3d(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.GAZE3D]
+
+    @property
+    def origin_left(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.ORIGIN_LEFT]
+
+    @property
+    def direction_left(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.DIRECTION_LEFT]
+
+    @property
+    def pupil_left(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.PUPIL_LEFT]
+
+    @property
+    def origin_right(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.ORIGIN_RIGHT]
+
+    @property
+    def direction_right(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.DIRECTION_RIGHT]
+
+    @property
+    def pupil_right(self) -> npt.NDArray[np.float64]:
+        return self.data[:, GazeColumn.PUPIL_RIGHT]
+
+    @property
+    def has_gaze(self) -> npt.NDArray[np.bool_]:
+        """Samples with a gaze point, the others are GazeDataType.MISSING."""
+        return ~np.isnan(self.data[:, GazeColumn.GAZE2D.start])
+
+
+@dataclass
+class GazeSamples:
+    """Gaze samples with a gaze point, denormalized to the video resolution."""
+
+    x: npt.NDArray[np.int64]
+    y: npt.NDArray[np.int64]
+    depth: npt.NDArray[np.float64]  # NaN when either eye is missing
+    timestamp: npt.NDArray[np.float64]
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, index: npt.ArrayLike) -> "GazeSamples":
+        return GazeSamples(
+            x=self.x[index],
+            y=self.y[index],
+            depth=self.depth[index],
+            timestamp=self.timestamp[index],
+        )
+
+    def point(self, i: int) -> GazePoint:
+        depth = float(self.depth[i])
+        return GazePoint(
+            int(self.x[i]), int(self.y[i]), None if np.isnan(depth) else depth, float(self.timestamp[i])
+        )
+
+
+@dataclass
+class FrameGazeAlignment:
+    """
+    Gaze samples grouped by the frame they were recorded during. The samples
+    of frame i are samples[offsets[i]:offsets[i + 1]], in time order.
+    """
+
+    samples: GazeSamples
+    frame_idx: npt.NDArray[np.int64]  # frame of every sample
+    offsets: npt.NDArray[np.int64]  # (frame_count + 1,)
+    frame_timestamps: npt.NDArray[np.float64]  # (frame_count + 1,), the last is the end of the video
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def counts(self) -> npt.NDArray[np.int64]:
+        return np.diff(self.offsets)
+
+    def frame_samples(self, frame_idx: int) -> GazeSamples:
+        return self.samples[slice(self.offsets[frame_idx], self.offsets[frame_idx + 1])]
+
+
+@dataclass
+class Fixations:
+    """Fixation intervals of a recording as columns, in time order."""
+
+    start: npt.NDArray[np.float64]  # timestamp of the first sample
+    end: npt.NDArray[np.float64]  # timestamp of the last sample
+    x: npt.NDArray[np.float64]  # centroid in video pixels
+    y: npt.NDArray[np.float64]
+    sample_count: npt.NDArray[np.int64]
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @property
+    def duration(self) -> npt.NDArray[np.float64]:
+        return self.end - self.start
+
+    @property
+    def midpoint(self) -> npt.NDArray[np.float64]:
+        return (self.start + self.end) / 2
+
+    def to_array(self) -> npt.NDArray[np.float64]:
+        return np.stack([self.start, self.end, self.x, self.y, self.sample_count], axis=1)
+
+    @classmethod
+    def from_array(cls, data: npt.NDArray[np.float64]) -> "Fixations":
+        data = data.reshape(-1, 5)
+        return cls(
+            start=data[:, 0],
+            end=data[:, 1],
+            x=data[:, 2],
+            y=data[:, 3],
+            sample_count=data[:, 4].astype(np.int64),
+        )
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class JobKind:
+    ANALYSIS: str = "analysis"
+    TRACKING: str = "tracking"
+    HEAD_TRAINING: str = "head_training"
+
+
+@dataclass(frozen=True)
+class JobStatus:
+    QUEUED: str = "queued"
+    RUNNING: str = "running"
+    FINISHED: str = "finished"
+    FAILED: str = "failed"
+    CANCELLED: str = "cancelled"
+
+
+@dataclass(frozen=True)
+class JobEventType:
+    """Events pushed to the event stream of a job."""
+
+    STATUS: str = "status"
+    PROGRESS: str = "progress"
+    STAGE: str = "stage"  # a pipeline stage finished, with its duration
+    SEGMENTS: str = "segments"  # newly completed tracks of a tracking span
+    FINISHED: str = "finished"
+    FAILED: str = "failed"
+    CANCELLED: str = "cancelled"
+
+
+@dataclass(frozen=True)
+class ResourceClass:
+    """The worker pool a job runs in, each pool has its own worker count."""
+
+    GPU: str = "gpu"
+    CPU: str = "cpu"
+
+
+@dataclass(frozen=True)
+class JobPriority:
+    """Higher priorities are claimed first, interactive work goes before bulk work."""
+
+    BULK: int = 0
+    INTERACTIVE: int = 10
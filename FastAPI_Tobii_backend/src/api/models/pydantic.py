@@ -9,6 +9,7 @@ from pydantic import BaseModel, computed_field
 from src.api.models.db import (
     Annotation as DBAnnotation,
     CalibrationRecording as DBCalibrationRecording,
+    Job as DBJob,
     PointLabel as DBPointLabel,
     Recording as DBRecording,
     SimRoomClass as DBSimRoomClass,
@@ -195,4 +196,29 @@ class CalibrationRecordingDTO(BaseDTO):
             video_path=calibration_recording.video_path,
             tracking_results_path=calibration_recording.tracking_results_path,
             tracking_result_paths=calibration_recording.tracking_result_paths,
-        )
\ No newline at end of file
+        )
+
+# ============================================================
+# Job
+# ============================================================
+
+class JobDTO(BaseDTO):
+    id: str
+    kind: str
+    status: str
+    priority: int
+    progress: float
+    eta_seconds: float | None
+    error: str | None
+
+    @classmethod
+    def from_orm(cls, job: DBJob) -> "JobDTO":
+        return cls(
+            id=job.id,
+            kind=job.kind,
+            status=job.status,
+            priority=job.priority,
+            progress=job.progress or 0.0,
+            eta_seconds=job.eta_seconds,
+            error=job.error,
+        )
@@ -0,0 +1,85 @@
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass(frozen=True)
+class TrackingSpan:
+    """
+    A range of frames bounded by two prompts, or by a prompt and
+    the start/end of the video. Propagation runs outward from the
+    anchored boundaries and never crosses into a neighbouring span.
+    """
+
+    start_frame_idx: int  # inclusive
+    end_frame_idx: int  # inclusive
+    forward_anchor: bool  # a prompt sits at start_frame_idx
+    backward_anchor: bool  # a prompt sits at end_frame_idx
+
+    @property
+    def frame_count(self) -> int:
+        return self.end_frame_idx - self.start_frame_idx + 1
+
+    @property
+    def owned_frames(self) -> tuple[int, int]:
+        """
+        The inclusive frame range whose results belong to this span. A prompted
+        frame belongs to the span that starts at it, so spans never share frames.
+        """
+        last_frame_idx = self.end_frame_idx - int(self.backward_anchor)
+        return self.start_frame_idx, last_frame_idx
+
+    def overlaps(self, other: "TrackingSpan") -> bool:
+        first, last = self.owned_frames
+        other_first, other_last = other.owned_frames
+        return first <= other_last and other_first <= last
+
+
+@dataclass
+class MaskObservation:
+    """A single object's mask in a propagated frame, cropped to its box."""
+
+    class_id: int
+    frame_idx: int
+    frame_area: int
+    object_score: float | None
+    mask: npt.NDArray[np.uint8] | None = None
+    box: tuple[int, int, int, int] | None = None
+
+    @property
+    def area(self) -> int:
+        return 0 if self.mask is None else int(self.mask.sum())
+
+
+@dataclass
+class ClassTerminationStats:
+    """Per-class counters collected by a termination policy, used for tuning."""
+
+    frames_observed: int = 0
+    frames_accepted: int = 0
+    area_ratio_sum: float = 0.0
+    object_score_sum: float = 0.0
+    object_score_count: int = 0
+    rejections: dict[str, int] = field(default_factory=dict)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "frames_observed": self.frames_observed,
+            "frames_accepted": self.frames_accepted,
+            "mean_area_ratio": self.area_ratio_sum / max(self.frames_observed, 1),
+            "mean_object_score": self.object_score_sum / self.object_score_count
+            if self.object_score_count
+            else None,
+            "rejections": dict(self.rejections),
+        }
+
+
+@dataclass(frozen=True)
+class StatePlacement:
+    """Where the frames and per-frame outputs of an inference state are kept."""
+
+    DEVICE: str = "device"
+    CPU: str = "cpu"
+    MMAP: str = "mmap"  # frames in a memory-mapped file, outputs on the CPU
@@ -1,76 +1,342 @@
-import json
 from pathlib import Path
-from typing import Any, cast
+from typing import Any
 
 import faiss
 import numpy as np
 import torch
 
+from src.config import (
+    VECTOR_INDEX_HNSW_EF_SEARCH,
+    VECTOR_INDEX_HNSW_NEIGHBORS,
+    VECTOR_INDEX_IVF_LISTS,
+    VECTOR_INDEX_IVF_PROBES,
+    VECTOR_INDEX_PQ_BITS,
+    VECTOR_INDEX_PQ_SUBQUANTIZERS,
+    VECTOR_INDEX_TRAIN_SIZE,
+    VECTOR_INDEX_TYPE,
+    VectorIndexType,
+)
+
+# Faiss wants at least this many training vectors per inverted list
+MIN_TRAIN_VECTORS_PER_LIST = 39
+
 
 class FAISSIndexWithMetadata:
-    def __init__(self, dim: int) -> None:
+    """
+    A faiss inner-product index over normalized embeddings, so search scores
+    are cosine similarities, with one row of scalar metadata per vector.
+
+    Metadata is kept column-wise next to the sorted vector ids: every column
+    is a numpy array, so looking up the metadata of a whole batch of search
+    results is a searchsorted and a gather instead of a Python loop. Vector
+    ids only ever grow, removed ids are never handed out again.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        index_type: str = VECTOR_INDEX_TYPE,
+        ivf_lists: int = VECTOR_INDEX_IVF_LISTS,
+        ivf_probes: int = VECTOR_INDEX_IVF_PROBES,
+        pq_subquantizers: int = VECTOR_INDEX_PQ_SUBQUANTIZERS,
+        pq_bits: int = VECTOR_INDEX_PQ_BITS,
+        hnsw_neighbors: int = VECTOR_INDEX_HNSW_NEIGHBORS,
+        hnsw_ef_search: int = VECTOR_INDEX_HNSW_EF_SEARCH,
+    ) -> None:
         self.dim = dim
-        self.index = faiss.IndexIDMap(faiss.IndexFlatL2(dim))
-        self.metadata: list[dict[str, Any]] = []
+        self.index_type = index_type
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.pq_subquantizers = pq_subquantizers
+        self.pq_bits = pq_bits
+        self.hnsw_neighbors = hnsw_neighbors
+        self.hnsw_ef_search = hnsw_ef_search
+        self.read_only = False
+
+        self.index = faiss.index_factory(dim, self.factory_string(), faiss.METRIC_INNER_PRODUCT)
+        self.apply_search_params()
+
+        self.ids = np.empty(0, dtype=np.int64)  # sorted, aligned with the columns
+        self.columns: dict[str, np.ndarray] = {}
+        self.next_id = 0
+        self.hidden_count = 0  # removed from the metadata but still in an HNSW graph
+
+    def factory_string(self) -> str:
+        if self.index_type == VectorIndexType.FLAT:
+            return "IDMap,Flat"
+        if self.index_type == VectorIndexType.IVF_FLAT:
+            return f"IVF{self.ivf_lists},Flat"
+        if self.index_type == VectorIndexType.IVF_PQ:
+            return f"IVF{self.ivf_lists},PQ{self.pq_subquantizers}x{self.pq_bits}"
+        if self.index_type == VectorIndexType.HNSW:
+            return f"IDMap,HNSW{self.hnsw_neighbors}"
+        raise ValueError(f"Unknown vector index type {self.index_type}")
+
+    def apply_search_params(self) -> None:
+        if self.index_type in (VectorIndexType.IVF_FLAT, VectorIndexType.IVF_PQ):
+            faiss.extract_index_ivf(self.index).nprobe = self.ivf_probes
+        elif self.index_type == VectorIndexType.HNSW:
+            faiss.downcast_index(faiss.downcast_index(self.index).index).hnsw.efSearch = self.hnsw_ef_search
+
+    @property
+    def is_trained(self) -> bool:
+        return self.index.is_trained
+
+    @property
+    def ntotal(self) -> int:
+        """The number of vectors that can still be found."""
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: torch.Tensor,
+        metadata: list[dict[str, Any]],
+        index_type: str = VECTOR_INDEX_TYPE,
+        **params: Any,
+    ) -> "FAISSIndexWithMetadata":
+        """
+        Create an index for a first batch of embeddings, train it on them when
+        the index type needs training and add them. IVF indexes get fewer
+        lists when there are too few vectors to train the configured amount.
+        """
+        vectors = to_vectors(embeddings)
+        if index_type in (VectorIndexType.IVF_FLAT, VectorIndexType.IVF_PQ):
+            max_lists = max(1, len(vectors) // MIN_TRAIN_VECTORS_PER_LIST)
+            params["ivf_lists"] = min(params.get("ivf_lists", VECTOR_INDEX_IVF_LISTS), max_lists)
 
-    def add(self, embeddings: torch.Tensor, metadata: list[dict[str, Any]]) -> None:
-        if embeddings.shape[0] != len(metadata):
+        instance = cls(vectors.shape[1], index_type=index_type, **params)
+        instance.train(vectors)
+        instance.add_vectors(vectors, metadata)
+        return instance
+
+    def train(self, vectors: np.ndarray, train_size: int = VECTOR_INDEX_TRAIN_SIZE) -> None:
+        if self.is_trained:
+            return
+
+        if len(vectors) > train_size:
+            sample = np.random.default_rng(0).choice(len(vectors), train_size, replace=False)
+            vectors = vectors[sample]
+
+        if self.index_type == VectorIndexType.IVF_PQ and len(vectors) < 2**self.pq_bits:
+            raise ValueError(
+                f"PQ with {self.pq_bits} bits needs at least {2**self.pq_bits} training vectors"
+            )
+        self.index.train(vectors)
+
+    def add(self, embeddings: torch.Tensor, metadata: list[dict[str, Any]]) -> np.ndarray:
+        """Add embeddings with their metadata and return the ids they were given."""
+        return self.add_vectors(to_vectors(embeddings), metadata)
+
+    def add_vectors(self, vectors: np.ndarray, metadata: list[dict[str, Any]]) -> np.ndarray:
+        if vectors.shape[0] != len(metadata):
             raise ValueError("Number of embeddings must match number of metadata entries")
+        if self.read_only:
+            raise ValueError("A memory-mapped index is read-only, load it without mmap to change it")
+        if not self.is_trained:
+            raise ValueError(f"A {self.index_type} index must be trained before vectors are added")
+
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+
+        new_columns = to_columns(metadata)
+        if len(self.ids) and set(new_columns) != set(self.columns):
+            raise ValueError(
+                f"Metadata keys {sorted(new_columns)} do not match the index's {sorted(self.columns)}"
+            )
+
+        new_ids = np.arange(self.next_id, self.next_id + len(vectors), dtype=np.int64)
+        self.index.add_with_ids(vectors, new_ids)
+        self.next_id += len(vectors)
+
+        if not len(self.ids):
+            self.columns = new_columns
+        else:
+            self.columns = {
+                key: np.concatenate([column, new_columns[key]])
+                for key, column in self.columns.items()
+            }
+        self.ids = np.concatenate([self.ids, new_ids])
+        return new_ids
+
+    def remove(self, ids: np.ndarray | list[int]) -> int:
+        """
+        Remove vectors by id and return how many were removed. An HNSW graph
+        cannot drop vectors, there they are only hidden from search results.
+        """
+        if self.read_only:
+            raise ValueError("A memory-mapped index is read-only, load it without mmap to change it")
 
-        # check if metadata values are all json serializable by trying to dump them
-        for entry in metadata:
-            try:
-                json.dumps(entry)
-            except TypeError as e:
-                raise ValueError(
-                    f"Metadata entry {entry} is not JSON serializable"
-                ) from e
+        ids = np.asarray(ids, dtype=np.int64)
+        keep = ~np.isin(self.ids, ids)
+        removed = int(len(self.ids) - keep.sum())
 
-        new_vectors_count = embeddings.shape[0]
-        current_count = self.index.ntotal
-        new_vector_ids = np.arange(current_count, current_count + new_vectors_count)
+        if self.index_type == VectorIndexType.HNSW:
+            self.hidden_count += removed
+        else:
+            self.index.remove_ids(ids)
 
-        vectors = embeddings.detach().cpu().numpy().astype(np.float32)
-        faiss.normalize_L2(vectors)
-        self.index.add_with_ids(vectors, new_vector_ids)
+        self.ids = self.ids[keep]
+        self.columns = {key: column[keep] for key, column in self.columns.items()}
+        return removed
 
-        self.metadata.extend(metadata)
+    def remove_where(self, key: str, value: Any) -> int:
+        """Remove every vector whose metadata column key equals value."""
+        if key not in self.columns:
+            return 0
+        return self.remove(self.ids[self.columns[key] == value])
+
+    def search(
+        self, embeddings: torch.Tensor, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The k most similar vectors of every query as (scores, ids), both of
+        shape (queries, k). Missing neighbours have id -1 and score -inf.
+        """
+        vectors = to_vectors(embeddings)
+        k = max(1, min(k, self.ntotal))
+        # Hidden vectors can take the place of real neighbours, ask for extra
+        fetch = max(k, min(k + self.hidden_count, self.index.ntotal))
+        scores, ids = self.index.search(vectors, fetch)
+
+        if self.hidden_count:
+            found = self.contains(ids)
+            # Stable sort moves the hidden results back, keeping score order
+            order = np.argsort(~found, axis=1, kind="stable")[:, :k]
+            scores = np.take_along_axis(np.where(found, scores, -np.inf), order, axis=1)
+            ids = np.take_along_axis(np.where(found, ids, -1), order, axis=1)
+
+        scores = np.where(ids < 0, -np.inf, scores)
+        return scores.astype(np.float32), ids
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        if not len(self.ids):
+            return np.zeros(np.shape(ids), dtype=bool)
+        positions = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+        return (ids >= 0) & (self.ids[positions] == ids)
+
+    def get_metadata_columns(self, ids: np.ndarray) -> dict[str, np.ndarray]:
+        """
+        The metadata columns gathered for an array of ids of any shape, such
+        as the ids returned by search. Unknown ids must be masked by the caller.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.clip(np.searchsorted(self.ids, ids), 0, max(len(self.ids) - 1, 0))
+        return {key: column[positions] for key, column in self.columns.items()}
+
+    def get_metadata(self, vector_id: int) -> dict[str, Any]:
+        return self.get_metadatas([vector_id])[0]
+
+    def get_metadatas(self, ids: list[int]) -> list[dict[str, Any]]:
+        ids = np.asarray(ids, dtype=np.int64)
+        if not self.contains(ids).all():
+            raise IndexError("Vector id not in the index")
+
+        columns = self.get_metadata_columns(ids)
+        return [
+            {key: column[i].item() for key, column in columns.items()}
+            for i in range(len(ids))
+        ]
 
     def write(self, index_path: Path) -> None:
+        index_path = Path(index_path)
         faiss.write_index(self.index, str(index_path))
-        metadata_path = Path(index_path).parent / (index_path.stem + ".json")
-        with Path.open(metadata_path, "w") as f:
-            json.dump(self.metadata, f)
+        np.savez(
+            metadata_path(index_path),
+            ids=self.ids,
+            next_id=np.int64(self.next_id),
+            hidden_count=np.int64(self.hidden_count),
+            index_type=np.str_(self.index_type),
+            params=np.array(
+                [
+                    self.ivf_lists,
+                    self.ivf_probes,
+                    self.pq_subquantizers,
+                    self.pq_bits,
+                    self.hnsw_neighbors,
+                    self.hnsw_ef_search,
+                ],
+                dtype=np.int64,
+            ),
+            **{f"column:{key}": column for key, column in self.columns.items()},
+        )
 
     @classmethod
-    def load(cls, index_path: Path) -> "FAISSIndexWithMetadata":
-        index: faiss.IndexIDMap = faiss.read_index(str(index_path))
-        metadata_path = Path(index_path).parent / (index_path.stem + ".json")
-        with Path.open(metadata_path) as f:
-            metadata = json.load(f)
-        instance = cls(index.d)
+    def load(cls, index_path: Path, mmap: bool = True) -> "FAISSIndexWithMetadata":
+        """
+        Load an index written by write. With mmap the vectors stay on disk and
+        are paged in as they are searched, which keeps large indexes out of
+        memory; such an index is read-only.
+        """
+        index_path = Path(index_path)
+        flags = faiss.IO_FLAG_MMAP if mmap else 0
+        index = faiss.read_index(str(index_path), flags)
+
+        with np.load(metadata_path(index_path), allow_pickle=False) as sidecar:
+            (
+                ivf_lists,
+                ivf_probes,
+                pq_subquantizers,
+                pq_bits,
+                hnsw_neighbors,
+                hnsw_ef_search,
+            ) = (int(value) for value in sidecar["params"])
+            instance = cls(
+                index.d,
+                index_type=str(sidecar["index_type"]),
+                ivf_lists=ivf_lists,
+                ivf_probes=ivf_probes,
+                pq_subquantizers=pq_subquantizers,
+                pq_bits=pq_bits,
+                hnsw_neighbors=hnsw_neighbors,
+                hnsw_ef_search=hnsw_ef_search,
+            )
+            instance.ids = sidecar["ids"]
+            instance.next_id = int(sidecar["next_id"])
+            instance.hidden_count = int(sidecar["hidden_count"])
+            instance.columns = {
+                key.removeprefix("column:"): sidecar[key]
+                for key in sidecar.files
+                if key.startswith("column:")
+            }
+
         instance.index = index
-        instance.metadata = metadata
+        instance.read_only = mmap
+        instance.apply_search_params()
         return instance
 
-    def search(
-        self, embeddings: torch.Tensor, k: int
-    ) -> tuple[torch.Tensor, torch.Tensor]:
-        vectors = embeddings.detach().cpu().numpy().astype(np.float32)
-        faiss.normalize_L2(vectors)
-        distances, indices = self.index.search(vectors, k)
-
-        return cast(torch.Tensor, distances), cast(torch.Tensor, indices)
-
-    def get_metadata(self, i: int) -> dict[str, Any]:
-        if i < 0 or i >= self.index.ntotal:
-            raise IndexError("Index out of bounds")
-        return self.metadata[i]
-
-    def get_metadatas(self, indices: list[int]) -> list[dict[str, Any]]:
-        metadatas = []
-        for i in indices:
-            if i < 0 or i >= self.index.ntotal:
-                raise IndexError("Index out of bounds")
-            metadatas.append(self.metadata[i])
-        return metadatas
+
+def metadata_path(index_path: Path) -> Path:
+    return index_path.parent / (index_path.stem + ".meta.npz")
+
+
+def to_vectors(embeddings: torch.Tensor | np.ndarray) -> np.ndarray:
+    """Normalized, contiguous float32 rows, so inner products are cosine similarities."""
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.detach().cpu().numpy()
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def to_columns(metadata: list[dict[str, Any]]) -> dict[str, np.ndarray]:
+    """Turn metadata rows into numpy columns; every row needs the same scalar keys."""
+    if not metadata:
+        return {}
+
+    keys = set(metadata[0])
+    columns = {}
+    for key in keys:
+        try:
+            values = [entry[key] for entry in metadata]
+        except KeyError as e:
+            raise ValueError(f"Metadata entries must all have the key {e}") from e
+
+        column = np.asarray(values)
+        if column.dtype == object or column.ndim != 1:
+            raise ValueError(f"Metadata values of {key} must be scalars of one type")
+        columns[key] = column
+
+    if any(set(entry) != keys for entry in metadata):
+        raise ValueError("Metadata entries must all have the same keys")
+    return columns
@@ -1,8 +1,10 @@
+from collections.abc import Iterable
 from pathlib import Path
 
 from sqlalchemy.orm import Session
 from src.api.exceptions import NotFoundError
 from src.api.models.db import Annotation, PointLabel
+from src.api.repositories import embeddings_repo
 
 
 def get_annotations_by_frame_idx(
@@ -66,6 +68,18 @@ def get_annotations_by_class_id(
     return annotations
 
 
+def get_annotations_by_calibration_id(
+    db: Session,
+    calibration_id: int,
+) -> list[Annotation]:
+    annotations = (
+        db.query(Annotation)
+        .filter(Annotation.calibration_id == calibration_id)
+        .all()
+    )
+    return annotations
+
+
 def get_annotation_by_id(
     db: Session,
     annotation_id: int,
@@ -103,6 +117,8 @@ def delete_annotation(db: Session, annotation_id: int) -> None:
     annotation = db.query(Annotation).filter(Annotation.id == annotation_id).first()
     if not annotation:
         raise NotFoundError(f"Annotation with id {annotation_id} not found")
+    # The annotation's embedding goes with it, the prototype has to be rebuilt
+    embeddings_repo.invalidate_class_prototypes(db, [annotation.simroom_class_id])
     db.delete(annotation)
     db.flush()
 
@@ -140,7 +156,12 @@ def get_tracks(class_tracking_results_path: Path) -> list[tuple[int, int]]:
         return []
 
     results = list(class_tracking_results_path.glob("*.npz"))
-    results_frame_idx = sorted(int(result.stem) for result in results)
+    return frames_to_tracks(int(result.stem) for result in results)
+
+
+def frames_to_tracks(frame_indices: Iterable[int]) -> list[tuple[int, int]]:
+    """Group frame indices into (start, end) tracks of consecutive frames."""
+    results_frame_idx = sorted(frame_indices)
 
     if not results_frame_idx:
         return []
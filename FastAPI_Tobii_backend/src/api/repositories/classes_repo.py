@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 
 from src.api.models.db import Annotation, CalibrationRecording, Recording, SimRoomClass
 from src.api.exceptions import NotFoundError
+from src.api.repositories import embeddings_repo
 
 def add_calibration_recording(db: Session, recording_id: str) -> CalibrationRecording:
     recording = db.query(Recording).filter(Recording.id == recording_id).first()
@@ -32,6 +33,9 @@ def delete_calibration_recording(db: Session, calibration_id: int) -> None:
     if calibration.tracking_results_path.exists():
         shutil.rmtree(calibration.tracking_results_path)
 
+    embeddings_repo.invalidate_class_prototypes(
+        db, {annotation.simroom_class_id for annotation in calibration.annotations}
+    )
     db.delete(calibration)
 
 
@@ -96,7 +100,8 @@ def get_tracked_classes(db: Session, calibration_id: int) -> list[SimRoomClass]:
     """
     cal_rec = get_calibration_recording(db, calibration_id=calibration_id)
     result_paths = cal_rec.tracking_result_paths
-    result_paths = [path for path in result_paths if len(list(path.iterdir())) > 0]
+    # A class folder also holds its tracking manifest, only results count
+    result_paths = [path for path in result_paths if any(path.glob("*.npz"))]
     class_ids = [int(path.stem) for path in result_paths]
     return get_classes_by_ids(db, class_ids)
 
@@ -0,0 +1,194 @@
+import json
+from collections.abc import Iterable
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from src.api.models.db import AnnotationEmbedding, ClassifierHead, ClassPrototype
+
+
+def create_annotation_embedding(
+    db: Session,
+    annotation_id: int,
+    simroom_class_id: int,
+    model_version: str,
+    embedding_mode: str,
+    embedding: np.ndarray,
+) -> AnnotationEmbedding:
+    annotation_embedding = AnnotationEmbedding(
+        annotation_id=annotation_id,
+        simroom_class_id=simroom_class_id,
+        model_version=model_version,
+        embedding_mode=embedding_mode,
+        embedding=embedding.astype(np.float32).tobytes(),
+    )
+    db.add(annotation_embedding)
+    db.flush()
+    return annotation_embedding
+
+
+def get_annotation_embeddings(
+    db: Session,
+    simroom_class_id: int,
+    model_version: str,
+    embedding_mode: str,
+) -> dict[int, np.ndarray]:
+    """The stored embeddings of a class by annotation id."""
+    rows = (
+        db.query(AnnotationEmbedding)
+        .filter(
+            AnnotationEmbedding.simroom_class_id == simroom_class_id,
+            AnnotationEmbedding.model_version == model_version,
+            AnnotationEmbedding.embedding_mode == embedding_mode,
+        )
+        .all()
+    )
+    return {
+        row.annotation_id: np.frombuffer(row.embedding, dtype=np.float32)
+        for row in rows
+    }
+
+
+def get_class_prototype(
+    db: Session,
+    simroom_class_id: int,
+    model_version: str,
+    embedding_mode: str,
+) -> ClassPrototype | None:
+    return (
+        db.query(ClassPrototype)
+        .filter(
+            ClassPrototype.simroom_class_id == simroom_class_id,
+            ClassPrototype.model_version == model_version,
+            ClassPrototype.embedding_mode == embedding_mode,
+        )
+        .first()
+    )
+
+
+def save_class_prototype(
+    db: Session,
+    simroom_class_id: int,
+    model_version: str,
+    embedding_mode: str,
+    embedding_sum: np.ndarray,
+    annotation_count: int,
+) -> ClassPrototype:
+    prototype = get_class_prototype(db, simroom_class_id, model_version, embedding_mode)
+    if prototype is None:
+        prototype = ClassPrototype(
+            simroom_class_id=simroom_class_id,
+            model_version=model_version,
+            embedding_mode=embedding_mode,
+        )
+        db.add(prototype)
+
+    prototype.embedding_sum = embedding_sum.astype(np.float32).tobytes()
+    prototype.annotation_count = annotation_count
+    db.flush()
+    return prototype
+
+
+def add_to_class_prototype(
+    db: Session,
+    simroom_class_id: int,
+    model_version: str,
+    embedding_mode: str,
+    embedding: np.ndarray,
+) -> None:
+    """
+    Add a new annotation's embedding to the class prototype. Without a
+    prototype there is nothing to update, it is built on the next lookup.
+    """
+    prototype = get_class_prototype(db, simroom_class_id, model_version, embedding_mode)
+    if prototype is None:
+        return
+
+    embedding_sum = np.frombuffer(prototype.embedding_sum, dtype=np.float32) + embedding
+    prototype.embedding_sum = embedding_sum.astype(np.float32).tobytes()
+    prototype.annotation_count += 1
+    db.flush()
+
+
+def invalidate_class_prototypes(db: Session, simroom_class_ids: Iterable[int]) -> None:
+    """Drop the prototypes of every model version, they no longer match the annotations."""
+    db.query(ClassPrototype).filter(
+        ClassPrototype.simroom_class_id.in_(set(simroom_class_ids))
+    ).delete(synchronize_session=False)
+
+
+def create_classifier_head(
+    db: Session,
+    class_ids: list[int],
+    model_version: str,
+    embedding_mode: str,
+    hidden: int,
+    embedding_count: int,
+    embeddings_digest: str,
+    accuracy: float | None,
+) -> ClassifierHead:
+    class_ids_json = json.dumps(sorted(class_ids))
+    # Versions keep counting up when older ones are pruned
+    last_version = (
+        db.query(func.max(ClassifierHead.version))
+        .filter(ClassifierHead.class_ids_json == class_ids_json)
+        .scalar()
+    )
+    head = ClassifierHead(
+        class_ids_json=class_ids_json,
+        model_version=model_version,
+        embedding_mode=embedding_mode,
+        version=(last_version or 0) + 1,
+        hidden=hidden,
+        embedding_count=embedding_count,
+        embeddings_digest=embeddings_digest,
+        accuracy=accuracy,
+        created=datetime.now().isoformat(),
+    )
+    db.add(head)
+    db.flush()
+    return head
+
+
+def get_class_set_heads(
+    db: Session, class_ids: list[int], model_version: str, embedding_mode: str
+) -> list[ClassifierHead]:
+    """The heads trained on exactly these classes, newest first."""
+    return (
+        db.query(ClassifierHead)
+        .filter(
+            ClassifierHead.class_ids_json == json.dumps(sorted(class_ids)),
+            ClassifierHead.model_version == model_version,
+            ClassifierHead.embedding_mode == embedding_mode,
+        )
+        .order_by(ClassifierHead.id.desc())
+        .all()
+    )
+
+
+def prune_classifier_heads(
+    db: Session, class_ids: list[int], model_version: str, embedding_mode: str, keep: int
+) -> int:
+    """Delete all but the newest keep heads of a class set, with their weights."""
+    old_heads = get_class_set_heads(db, class_ids, model_version, embedding_mode)[keep:]
+    for head in old_heads:
+        head.weights_path.unlink(missing_ok=True)
+        db.delete(head)
+    return len(old_heads)
+
+
+def get_classifier_heads(
+    db: Session, model_version: str, embedding_mode: str
+) -> list[ClassifierHead]:
+    """Heads trained on embeddings of this model version, newest first."""
+    return (
+        db.query(ClassifierHead)
+        .filter(
+            ClassifierHead.model_version == model_version,
+            ClassifierHead.embedding_mode == embedding_mode,
+        )
+        .order_by(ClassifierHead.id.desc())
+        .all()
+    )
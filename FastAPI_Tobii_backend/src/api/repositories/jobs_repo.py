@@ -0,0 +1,180 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from src.api.exceptions import NotFoundError
+from src.api.models.db import Job
+from src.api.models.jobs import JobPriority, JobStatus
+
+
+def create_job(
+    db: Session,
+    kind: str,
+    payload: dict[str, Any],
+    resource_class: str,
+    priority: int = JobPriority.BULK,
+) -> Job:
+    job = Job(
+        id=str(uuid.uuid4()),
+        kind=kind,
+        resource_class=resource_class,
+        priority=priority,
+        status=JobStatus.QUEUED,
+        payload_json=json.dumps(payload),
+        progress=0.0,
+        cancel_requested=False,
+        created=datetime.now().isoformat(),
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+
+def has_queued_job(db: Session, kind: str, payload: dict[str, Any]) -> bool:
+    """Whether a job of this kind and payload is still waiting for a worker."""
+    return (
+        db.query(Job)
+        .filter(
+            Job.kind == kind,
+            Job.status == JobStatus.QUEUED,
+            Job.payload_json == json.dumps(payload),
+        )
+        .first()
+        is not None
+    )
+
+
+def get_job(db: Session, job_id: str) -> Job:
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if job is None:
+        raise NotFoundError(f"Job {job_id} not found")
+    return job
+
+
+def claim_next_job(db: Session, resource_class: str, worker_id: str) -> Job | None:
+    """
+    Mark the most urgent queued job of a resource class as running and return it.
+    The status check in the UPDATE makes sure two workers never claim the same job.
+    """
+    candidates = (
+        db.query(Job.id)
+        .filter(Job.status == JobStatus.QUEUED, Job.resource_class == resource_class)
+        .order_by(Job.priority.desc(), Job.created)
+        .limit(5)
+        .all()
+    )
+
+    for (job_id,) in candidates:
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.QUEUED)
+            .values(
+                status=JobStatus.RUNNING,
+                worker_id=worker_id,
+                started=datetime.now().isoformat(),
+            )
+        ).rowcount
+        db.commit()
+        if claimed:
+            return get_job(db, job_id)
+
+    return None
+
+
+def update_progress(
+    db: Session, job_id: str, progress: float, eta_seconds: float | None
+) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(progress=progress, eta_seconds=eta_seconds)
+    )
+
+
+def finish_job(db: Session, job_id: str, result: Any) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            status=JobStatus.FINISHED,
+            result_json=json.dumps(result),
+            progress=1.0,
+            eta_seconds=0,
+            finished=datetime.now().isoformat(),
+        )
+    )
+
+
+def fail_job(db: Session, job_id: str, error: str) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            status=JobStatus.FAILED,
+            error=error,
+            finished=datetime.now().isoformat(),
+        )
+    )
+
+
+def fail_worker_jobs(db: Session, worker_id: str, error: str) -> list[str]:
+    """Fail the jobs a worker was running, returns their ids."""
+    job_ids = [
+        job_id
+        for (job_id,) in db.query(Job.id).filter(
+            Job.status == JobStatus.RUNNING, Job.worker_id == worker_id
+        )
+    ]
+    for job_id in job_ids:
+        fail_job(db, job_id, error)
+    return job_ids
+
+
+def request_cancel(db: Session, job_id: str) -> None:
+    db.execute(update(Job).where(Job.id == job_id).values(cancel_requested=True))
+
+
+def is_cancel_requested(db: Session, job_id: str) -> bool:
+    return bool(
+        db.query(Job.cancel_requested).filter(Job.id == job_id).scalar()
+    )
+
+
+def cancel_job(db: Session, job_id: str) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            status=JobStatus.CANCELLED,
+            cancel_requested=False,
+            finished=datetime.now().isoformat(),
+        )
+    )
+
+
+def requeue_job(db: Session, job_id: str) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            status=JobStatus.QUEUED,
+            cancel_requested=False,
+            error=None,
+            worker_id=None,
+            started=None,
+            finished=None,
+        )
+    )
+
+
+def requeue_interrupted_jobs(db: Session) -> int:
+    """Put jobs that were running when the server stopped back in the queue."""
+    return db.execute(
+        update(Job)
+        .where(Job.status == JobStatus.RUNNING)
+        .values(status=JobStatus.QUEUED, worker_id=None, started=None)
+    ).rowcount
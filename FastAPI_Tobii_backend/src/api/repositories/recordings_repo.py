@@ -1,3 +1,5 @@
+import shutil
+
 from sqlalchemy.orm import Session
 from src.api.exceptions import NotFoundError
 from src.api.models.db import Recording
@@ -10,6 +12,9 @@ def delete(db: Session, recording_id: str) -> None:
 
     rec.video_path.unlink(missing_ok=True)
     rec.gaze_data_path.unlink(missing_ok=True)
+    rec.gaze_columns_path.unlink(missing_ok=True)
+    rec.frame_timestamps_path.unlink(missing_ok=True)
+    shutil.rmtree(rec.heatmaps_path, ignore_errors=True)
     db.delete(rec)
 
 
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from src.api.db import get_db
+from src.api.exceptions import NotFoundError
+from src.api.services import jobs_service
+
+router = APIRouter(prefix="/jobs")
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = jobs_service.get(db, job_id)
+    return JSONResponse(content=job.model_dump())
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the progress, tracking segments and result of a job."""
+    # Once the stream has started, an unknown job can no longer be a 404
+    try:
+        await run_in_threadpool(jobs_service.get_status, job_id)
+    except NotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return StreamingResponse(
+        jobs_service.stream_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str, db: Session = Depends(get_db)):
+    job = jobs_service.cancel(db, job_id)
+    return JSONResponse(content=job.model_dump())
+
+
+@router.post("/{job_id}/resume")
+async def resume_job(job_id: str, db: Session = Depends(get_db)):
+    job = jobs_service.resume(db, job_id)
+    return JSONResponse(content=job.model_dump())
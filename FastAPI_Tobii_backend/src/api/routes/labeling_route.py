@@ -16,7 +16,7 @@ from src.api.exceptions import (
 )
 from src.api.models import App
 from src.api.repositories import annotations_repo
-from src.api.services import annotations_service
+from src.api.services import annotations_service, classifier_service
 from src.api.services.labeling_service import Labeler
 from ..utils import image_utils
 import base64
@@ -80,7 +80,8 @@ async def get_timeline(
         "tracks": [],
         "selected_class_color": None,
         "tracking_progress": None,
-        "is_tracking": False
+        "is_tracking": False,
+        "tracking_job_id": None,
     }
 
     if labeler.has_selected_class:
@@ -88,9 +89,11 @@ async def get_timeline(
         timeline["tracks"] = annotations_repo.get_tracks(labeler.current_class_results_path)
         timeline["selected_class_color"] = simroom_class.color
 
-    if labeler.is_tracking_current_class and labeler.tracking_progress is not None:
-        timeline["tracking_progress"] = labeler.tracking_progress
+    tracking_job = labeler.get_tracking_job(db)
+    if tracking_job is not None and labeler.is_tracking_class(selected_class_id):
+        timeline["tracking_progress"] = tracking_job.progress
         timeline["is_tracking"] = True
+        timeline["tracking_job_id"] = tracking_job.id
 
     labeler.seek(frame_idx)
     return JSONResponse(content=timeline)
@@ -150,6 +153,7 @@ async def post_annotation(
 @router.delete("/annotations/{annotation_id}")
 async def delete_annotation(annotation_id: int, db: Session = Depends(get_db), labeler: Labeler = Depends(require_labeler)):
     annotations_repo.delete_annotation(db, annotation_id)
+    classifier_service.queue_head_training(db, labeler.calibration_id)
     annotations = annotations_service.get_annotations_by_class_id(
         db=db, calibration_id=labeler.calibration_id, class_id=labeler.selected_class_id
     )
@@ -166,23 +170,50 @@ async def delete_all_annotations(calibration_id: int, db: Session = Depends(get_
         annotations.extend(anns)
     for ann in annotations:
         annotations_repo.delete_annotation(db, ann.id)
-    
+    classifier_service.queue_head_training(db, calibration_id)
+
     return JSONResponse(content=[])
 
 
 @router.post("/tracking")
-async def start_tracking(db: Session = Depends(get_db), labeler: Labeler = Depends(require_labeler)):
-    if labeler.is_tracking:
+async def start_tracking(
+    full_retrack: bool = False,
+    all_classes: bool = False,
+    db: Session = Depends(get_db),
+    labeler: Labeler = Depends(require_labeler),
+):
+    if labeler.get_tracking_job(db) is not None:
         raise TrackingJobAlreadyRunningError()
-    if not labeler.has_selected_class:
-        raise NoClassSelectedError()
-    annotations = annotations_service.get_annotations_by_class_id(
-        db=db, calibration_id=labeler.calibration_id, class_id=labeler.selected_class_id
+    if all_classes:
+        annotations = annotations_service.get_annotations_by_calibration_id(
+            db=db, calibration_id=labeler.calibration_id
+        )
+    else:
+        if not labeler.has_selected_class:
+            raise NoClassSelectedError()
+        annotations = annotations_service.get_annotations_by_class_id(
+            db=db, calibration_id=labeler.calibration_id, class_id=labeler.selected_class_id
+        )
+    labeler.start_tracking(
+        db, annotations, full_retrack=full_retrack, all_classes=all_classes
     )
-    labeler.start_tracking(annotations)
     return await get_timeline(db=db, labeler=labeler)
 
 
+@router.post("/tracking/cancel")
+async def cancel_tracking(db: Session = Depends(get_db), labeler: Labeler = Depends(require_labeler)):
+    job = labeler.cancel_tracking(db)
+    return JSONResponse(content=job.model_dump())
+
+
+@router.post("/tracking/resume")
+async def resume_tracking(db: Session = Depends(get_db), labeler: Labeler = Depends(require_labeler)):
+    if labeler.get_tracking_job(db) is not None:
+        raise TrackingJobAlreadyRunningError()
+    job = labeler.resume_tracking(db)
+    return JSONResponse(content=job.model_dump())
+
+
 @router.post("/settings")
 async def update_settings(show_inactive_classes: Annotated[bool, Form()], labeler: Labeler = Depends(require_labeler)):
     labeler.set_show_inactive_classes(show_inactive_classes)
@@ -4,10 +4,11 @@ from sqlalchemy.orm import Session
 
 from src.api.db import get_db
 from src.api.repositories import recordings_repo
-from src.api.services import glasses_service, recordings_service
+from src.api.services import glasses_service, heatmap_service, recordings_service
 
 from datetime import datetime
 from src.api.exceptions import NotFoundError
+from src.config import HEATMAP_SHAPES
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parents[3] 
@@ -104,3 +105,24 @@ async def download_recording(recording_id: str, db: Session = Depends(get_db)):
     # Return updated local recordings
     recordings = recordings_service.get_all(db)
     return [r for r in recordings]
+
+
+@router.get("/local/{recording_id}/heatmap")
+def get_local_recording_heatmap(
+    recording_id: str,
+    start: float | None = None,
+    end: float | None = None,
+    level: int = len(HEATMAP_SHAPES) - 1,
+):
+    """
+    Gaze counts per heatmap cell between start and end seconds of a recording.
+    Levels go from coarse (0) to fine, the range snaps to whole tiles.
+    """
+    try:
+        heatmap = heatmap_service.get_heatmap(recording_id, start=start, end=end, level=level)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Gaze data not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return JSONResponse(content=heatmap)
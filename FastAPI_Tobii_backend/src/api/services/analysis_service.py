@@ -0,0 +1,601 @@
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+from src.api.db import SessionLocal
+from src.api.models.analysis import (
+    AnalysisRequest,
+    AnalysisResponse,
+    ClassAnalysisResult,
+    ViewSegment,
+)
+from src.api.models.gaze import Fixations
+from src.api.models.jobs import JobEventType
+from src.api.models.pydantic import SAMAnnotationDTO, SAMPointDTO
+from src.api.repositories import classes_repo
+from src.api.services import recordings_service, sam2_service
+from src.api.services.classifier_service import HeadClassifier
+from src.api.services.embeddings_service import (
+    KNNClassifier,
+    PrototypeMatrix,
+    build_annotation_index,
+    build_prototypes,
+    device,
+    get_crop_embeddings,
+    get_mask_embeddings,
+)
+from src.api.services.gaze_service import (
+    get_fixation_frames,
+    get_frame_timestamps,
+    get_gaze_position_per_frame,
+    load_fixations,
+    masks_were_viewed,
+)
+from src.api.services.jobs_service import JobContext
+from src.api.services.labeling_service import TrackingJob
+from src.api.utils.pipeline import Pipeline, PipelineStage, StageMetrics
+from src.config import (
+    ANALYSIS_MATCH_WORKERS,
+    ANALYSIS_USE_FIXATIONS,
+    ANALYSIS_PIPELINE_QUEUE_SIZE,
+    ANALYSIS_TRACKING_FRAME_STRIDE,
+    EMBEDDING_MODE,
+    MATCHING_STRATEGY,
+    RECORDINGS_PATH,
+    TOBII_GLASSES_FPS,
+    VIEWED_RADIUS,
+    EmbeddingMode,
+    MatchingStrategy,
+    Sam2Checkpoints,
+)
+from src.utils import extract_frames_to_dir
+
+MIN_ANNOTATIONS_PER_CLASS = 5
+SIM_THRESHOLD = 0.6
+FRAME_TARGETS = [2, 3, 4, 5, 6, 7, 8, 9]  # Sampled keyframes per segmentation round
+
+# Share of the overall progress of every stage, roughly their share of the runtime
+STAGE_WEIGHTS = {
+    "extract": 0.05,
+    "gaze": 0.02,
+    "prototypes": 0.03,
+    "segmentation": 0.20,
+    "tracking": 0.65,
+    "scoring": 0.05,
+}
+
+
+def run_analysis_job(payload: dict[str, Any], context: JobContext) -> dict[str, Any]:
+    """Job handler: find the requested classes in a recording and measure how long they were viewed."""
+    body = AnalysisRequest.model_validate(payload)
+    return AnalysisPipeline(body, context).run().model_dump(mode="json")
+
+
+class AnalysisPipeline:
+    """
+    Runs an analysis as a sequence of stages that each time themselves and
+    report their own progress. The stages share their outputs through the
+    pipeline's attributes. Frames and tracking results live in the job's
+    working directory, so a cancelled or interrupted analysis resumes where
+    it stopped.
+    """
+
+    def __init__(self, body: AnalysisRequest, context: JobContext) -> None:
+        self.body = body
+        self.context = context
+        self.frames_dir = context.work_path / "frames"
+        self.results_dir = context.work_path / "multi_tracking"
+        self.fps = TOBII_GLASSES_FPS
+        self.stage_timings: dict[str, float] = {}
+        self.pipeline_metrics: dict[str, StageMetrics] = {}
+        self.current_stage: str | None = None
+
+        self.recording_id: str = body.recording_id
+        self.video_path: Path | None = None
+        self.frame_files: list[Path] = []
+        self.gaze_positions: dict[int, tuple[int, int]] = {}
+        self.gaze_frames: list[int] = []
+        self.fixations: Fixations | None = None
+        # First, last and middle frame of every fixation
+        self.fixation_frames: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+        self.class_names: dict[int, str] = {}
+        self.matcher: PrototypeMatrix | KNNClassifier | HeadClassifier = (
+            PrototypeMatrix.from_prototypes({})
+        )
+        self.annotations: list[SAMAnnotationDTO] = []
+        # Matches of every segmented frame, no frame is segmented twice
+        self.frame_matches: dict[int, list[tuple[int, tuple[int, int, int, int], float]]] = {}
+        self.results: list[ClassAnalysisResult] = []
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.frame_files)
+
+    @property
+    def stages(self) -> list[tuple[str, Callable[[], None]]]:
+        return [
+            ("extract", self.extract_frames),
+            ("gaze", self.load_gaze),
+            ("prototypes", self.build_prototypes),
+            ("segmentation", self.segment_keyframes),
+            ("tracking", self.track),
+            ("scoring", self.score),
+        ]
+
+    def run(self) -> AnalysisResponse:
+        for name, stage in self.stages:
+            self.run_stage(name, stage)
+
+        return AnalysisResponse(
+            recording_id=self.recording_id,
+            fps=self.fps,
+            total_frames=self.frame_count,
+            classes=self.results,
+            stage_timings=self.stage_timings,
+            pipeline_metrics={
+                name: metrics.summary() for name, metrics in self.pipeline_metrics.items()
+            },
+        )
+
+    def run_stage(self, name: str, stage: Callable[[], None]) -> None:
+        self.context.raise_if_cancelled()
+        self.current_stage = name
+        self.report_stage_progress(0.0)
+
+        start = time.perf_counter()
+        stage()
+        duration = time.perf_counter() - start
+
+        self.stage_timings[name] = duration
+        self.report_stage_progress(1.0)
+        self.context.publish(
+            JobEventType.STAGE,
+            {
+                "stage": name,
+                "duration_seconds": duration,
+                "pipeline_metrics": {
+                    name: metrics.summary()
+                    for name, metrics in self.pipeline_metrics.items()
+                },
+            },
+        )
+        print(f"Analysis stage {name} took {duration:.2f}s", flush=True)
+
+    def report_stage_progress(self, fraction: float, eta_seconds: float | None = None) -> None:
+        """Map the progress within the current stage onto the overall progress."""
+        done = 0.0
+        for name in STAGE_WEIGHTS:
+            if name == self.current_stage:
+                break
+            done += STAGE_WEIGHTS[name]
+
+        progress = done + STAGE_WEIGHTS[self.current_stage] * min(fraction, 1.0)
+        self.context.report_progress(
+            progress, eta_seconds, stage=self.current_stage, force=fraction >= 1.0
+        )
+
+    def extract_frames(self) -> None:
+        with SessionLocal() as db:
+            recording = recordings_service.get(db=db, recording_id=self.body.recording_id)
+        self.recording_id = recording.id
+        self.video_path = recording.video_path
+
+        # A resumed job reuses the frames once they were extracted completely
+        frames_extracted_marker = self.frames_dir / ".extracted"
+        if not frames_extracted_marker.exists():
+            self.frames_dir.mkdir(exist_ok=True)
+            extract_frames_to_dir(self.video_path, self.frames_dir)
+            frames_extracted_marker.touch()
+
+        self.frame_files = sorted(self.frames_dir.glob("*.jpg"))
+
+    def load_gaze(self) -> None:
+        self.gaze_positions = get_gaze_position_per_frame(
+            recording_id=self.recording_id,
+            frame_count=self.frame_count,
+        )
+
+        # Select frames where gaze exists
+        self.gaze_frames = sorted(
+            frame_idx
+            for frame_idx, (x, y) in self.gaze_positions.items()
+            if x is not None and y is not None
+        )
+
+        if ANALYSIS_USE_FIXATIONS:
+            self.fixations = load_fixations(RECORDINGS_PATH / f"{self.recording_id}.tsv")
+            frame_timestamps = get_frame_timestamps(self.video_path, self.frame_count, self.fps)
+            self.fixation_frames = get_fixation_frames(self.fixations, frame_timestamps)
+            print(f"{len(self.fixations)} fixations in {self.frame_count} frames", flush=True)
+
+            # One keyframe candidate per fixation, the frames in between show the same
+            if len(self.fixations) > 0:
+                self.gaze_frames = sorted(set(self.fixation_frames[2].tolist()))
+
+        if len(self.gaze_frames) == 0:
+            self.gaze_frames = list(range(0, self.frame_count, 30))
+
+    def build_prototypes(self) -> None:
+        with SessionLocal() as db:
+            class_map = {}
+            for class_id in self.body.class_ids:
+                sim_class = classes_repo.get_class(db, class_id)
+                class_map[class_id] = sim_class
+            # Stacked once, every frame is matched against the same matrix
+            head = None
+            if MATCHING_STRATEGY == MatchingStrategy.HEAD:
+                head = HeadClassifier.load(db, self.body.class_ids, device)
+
+            if head is not None:
+                self.matcher = head
+            elif MATCHING_STRATEGY == MatchingStrategy.KNN:
+                self.matcher = KNNClassifier.from_index(build_annotation_index(db, class_map))
+            else:
+                self.matcher = PrototypeMatrix.from_prototypes(build_prototypes(db, class_map))
+            # Keep the embeddings and prototypes that had to be built
+            db.commit()
+            self.class_names = {
+                class_id: sim_class.class_name for class_id, sim_class in class_map.items()
+            }
+
+    def segment_keyframes(self) -> None:
+        """
+        Prompt the tracker with masks of sampled gaze frames that match a class
+        prototype. Every round samples a few more frames until each class has
+        enough annotations; the samples of a round extend those of the previous
+        one, so only the new frames are segmented. Decoding, SAM2 mask generation
+        and matching run as overlapping pipeline stages, so a frame is decoded
+        and an earlier one matched while SAM2 segments the current one.
+        """
+        sam2_model = sam2_service.load_generator(
+                    Sam2Checkpoints.SMALL
+                )
+        total_frames = len(sample_frames_incrementally(self.gaze_frames, FRAME_TARGETS[-1]))
+        segmented_frames = 0
+        progress_lock = threading.Lock()
+
+        def decode(frame_idx: int) -> tuple[int, np.ndarray]:
+            self.context.raise_if_cancelled()
+            frame_img = cv2.imread(str(self.frame_files[frame_idx]))  # BGR uint8
+            return frame_idx, frame_img
+
+        def segment(item: tuple[int, np.ndarray]) -> tuple[int, np.ndarray, list[np.ndarray]]:
+            frame_idx, frame_img = item
+            frame_img_rgb = cv2.cvtColor(frame_img, cv2.COLOR_BGR2RGB)  # RGB uint8
+            mask_dicts = sam2_model.generate(frame_img_rgb)      # List[Dict]
+            masks      = [m["segmentation"] for m in mask_dicts] # List[np.ndarray HW bool]
+            return frame_idx, frame_img, masks
+
+        def match(item: tuple[int, np.ndarray, list[np.ndarray]]) -> tuple[int, list]:
+            nonlocal segmented_frames
+            frame_idx, frame_img, masks = item
+            matches = match_masks_to_classes(masks, frame_img, self.matcher)
+
+            with progress_lock:
+                segmented_frames += 1
+                self.report_stage_progress(segmented_frames / total_frames)
+            return frame_idx, matches
+
+        for frame_target in FRAME_TARGETS:
+
+            sampled_frames = sample_frames_incrementally(self.gaze_frames, frame_target)
+            new_frames = [f for f in sampled_frames if f not in self.frame_matches]
+            if not new_frames:
+                # Fewer gaze frames than the target, nothing left to sample
+                break
+
+            print(f"running analysis with {frame_target} frames", flush=True)
+
+            pipeline = Pipeline(
+                [
+                    PipelineStage("decode", decode),
+                    # SAM2 keeps the GPU busy, a second generator would only compete
+                    PipelineStage("segment", segment),
+                    PipelineStage("match", match, workers=ANALYSIS_MATCH_WORKERS),
+                ],
+                queue_size=ANALYSIS_PIPELINE_QUEUE_SIZE,
+            )
+            frame_matches = sorted(pipeline.run(new_frames), key=lambda m: m[0])
+            self.record_pipeline_metrics(pipeline)
+
+            # Create annotations
+            for frame_idx, matches in frame_matches:
+                self.frame_matches[frame_idx] = matches
+
+                # SAM2 keeps one prompt per object and frame, use the best match
+                best_matches = {}
+                for class_id, bbox, score in matches:
+                    if class_id not in best_matches or score > best_matches[class_id][1]:
+                        best_matches[class_id] = (bbox, score)
+
+                for class_id, ((x1, y1, x2, y2), score) in best_matches.items():
+                    cx = int((x1 + x2) / 2)
+                    cy = int((y1 + y2) / 2)
+
+                    self.annotations.append(
+                        SAMAnnotationDTO(
+                            id=str(uuid.uuid4()),
+                            simroom_class_id=class_id,
+                            frame_idx=frame_idx,
+                            point_labels=[SAMPointDTO(x=cx, y=cy, label=1)]  # ← proper object
+                        )
+                    )
+
+            # Stop if enough annotations
+            if enough_annotations(self.annotations, self.body.class_ids):
+                print("genoeg annotaties gevonden", flush=True)
+                break
+
+        print(
+            "Keyframe pipeline utilization: "
+            + ", ".join(
+                f"{name} {metrics.utilization:.0%}"
+                for name, metrics in self.pipeline_metrics.items()
+            ),
+            flush=True,
+        )
+
+    def record_pipeline_metrics(self, pipeline: Pipeline) -> None:
+        """Add the metrics of one sampling round to those of the whole analysis."""
+        for name, metrics in pipeline.metrics.items():
+            if name not in self.pipeline_metrics:
+                self.pipeline_metrics[name] = StageMetrics(metrics.workers)
+            self.pipeline_metrics[name].merge(metrics)
+
+    def track(self) -> None:
+        if not self.annotations:
+            return
+
+        self.results_dir.mkdir(exist_ok=True)
+        tracking_job = TrackingJob(
+            annotations=self.annotations,
+            frames_path=self.frames_dir,
+            results_path=self.results_dir,
+            frame_count=self.frame_count,
+            video_path=self.video_path,
+            # Results of an interrupted run are kept for the resume
+            remove_previous_results=False,
+            frame_stride=ANALYSIS_TRACKING_FRAME_STRIDE,
+            progress_callback=self.report_stage_progress,
+            should_cancel=self.context.is_cancelled,
+            checkpoint_path=self.context.work_path / "checkpoint.json",
+        )
+        tracking_job.run()
+
+    def score(self) -> None:
+        """Measure per class in which frames the gaze fell on its tracked mask."""
+        if not self.annotations:
+            return
+
+        # Evaluate gaze per class
+        for class_id, class_name in self.class_names.items():
+            class_dir = self.results_dir / str(class_id)
+            if not class_dir.exists():
+                continue
+
+            # Without any fixation, e.g. very noisy gaze, fall back to every sample
+            if self.fixations is not None and len(self.fixations) > 0:
+                viewed_frames = self.viewed_frames_per_fixation(class_dir)
+            else:
+                viewed_frames = self.viewed_frames_per_sample(class_dir)
+
+            segments = []
+            start = None
+            prev = None
+
+            for f in viewed_frames:
+                if start is None:
+                    start = f
+                elif prev is not None and f != prev + 1:
+                    segments.append((start, prev))
+                    start = f
+                prev = f
+
+            if start is not None:
+                segments.append((start, prev))
+
+            total_frames = sum(end - start + 1 for start, end in segments)
+            total_seconds = total_frames / self.fps
+
+            self.results.append(
+                ClassAnalysisResult(
+                    class_id=class_id,
+                    class_name=class_name,
+                    total_view_time_seconds=total_seconds,
+                    view_segments=[
+                        ViewSegment(start_frame=s, end_frame=e)
+                        for s, e in segments
+                    ],
+                )
+            )
+
+
+    def viewed_frames_per_sample(self, class_dir: Path) -> list[int]:
+        """Tracked frames of a class whose mask the frame's gaze position fell on."""
+        frame_indices = []
+        masks = []
+        gaze_in_box = []
+        for npz_file in class_dir.glob("*.npz"):
+            data = np.load(str(npz_file))
+            frame_idx = int(data["frame_idx"])
+
+            if frame_idx not in self.gaze_positions:
+                continue
+            gaze_x, gaze_y = self.gaze_positions[frame_idx]
+
+            if not gaze_near_box(data["box"], gaze_x, gaze_y):
+                continue
+
+            frame_indices.append(frame_idx)
+            masks.append(data["mask"])
+            gaze_in_box.append((gaze_x - data["box"][0], gaze_y - data["box"][1]))
+
+        viewed = masks_were_viewed(masks, gaze_in_box)
+        return sorted(
+            frame_idx for frame_idx, was_viewed in zip(frame_indices, viewed) if was_viewed
+        )
+
+    def viewed_frames_per_fixation(self, class_dir: Path) -> list[int]:
+        """
+        Tracked frames of a class during fixations on its mask. Every fixation
+        is tested once, on the tracked frame nearest its middle, against its
+        centroid; a hit counts all its tracked frames as viewed.
+        """
+        tracked = np.array(sorted(int(path.stem) for path in class_dir.glob("*.npz")))
+        if len(tracked) == 0 or len(self.fixations) == 0:
+            return []
+
+        first_frames, last_frames, middle_frames = self.fixation_frames
+        # The tracked frame closest to the middle of every fixation
+        after = np.clip(np.searchsorted(tracked, middle_frames), 0, len(tracked) - 1)
+        before = np.clip(after - 1, 0, len(tracked) - 1)
+        nearest = np.where(
+            np.abs(tracked[before] - middle_frames) < np.abs(tracked[after] - middle_frames),
+            tracked[before],
+            tracked[after],
+        )
+        in_fixation = (nearest >= first_frames) & (nearest <= last_frames)
+
+        fixation_indices = []
+        masks = []
+        gaze_in_box = []
+        for i in np.flatnonzero(in_fixation).tolist():
+            gaze_x, gaze_y = self.fixations.x[i], self.fixations.y[i]
+            with np.load(str(class_dir / f"{nearest[i]}.npz")) as data:
+                if not gaze_near_box(data["box"], gaze_x, gaze_y):
+                    continue
+                fixation_indices.append(i)
+                masks.append(data["mask"])
+                gaze_in_box.append((gaze_x - data["box"][0], gaze_y - data["box"][1]))
+
+        viewed_frames = set()
+        for i, was_viewed in zip(fixation_indices, masks_were_viewed(masks, gaze_in_box)):
+            if was_viewed:
+                in_range = (tracked >= first_frames[i]) & (tracked <= last_frames[i])
+                viewed_frames.update(tracked[in_range].tolist())
+        return sorted(viewed_frames)
+
+
+def gaze_near_box(box: np.ndarray, gaze_x: float, gaze_y: float) -> bool:
+    """Whether the gaze disk can touch a mask inside this box, its centre may lie just outside."""
+    x1, y1, x2, y2 = box
+    return (
+        x1 - VIEWED_RADIUS <= gaze_x < x2 + VIEWED_RADIUS
+        and y1 - VIEWED_RADIUS <= gaze_y < y2 + VIEWED_RADIUS
+    )
+
+
+def sample_frames_incrementally(frame_indices: list[int], n: int) -> list[int]:
+    """
+    Select n spread out frames from a list, such that the selection for n
+    always starts with the selection for n - 1. Positions follow the van der
+    Corput sequence (0, 1/2, 1/4, 3/4, 1/8, ...), which keeps halving the
+    largest gaps between the frames selected so far.
+    """
+    if len(frame_indices) <= n:
+        return list(frame_indices)
+
+    selected = []
+    seen_positions = set()
+    i = 0
+    while len(selected) < n:
+        position = int(van_der_corput(i) * len(frame_indices))
+        i += 1
+        if position in seen_positions:
+            continue
+        seen_positions.add(position)
+        selected.append(frame_indices[position])
+
+    return selected
+
+
+def van_der_corput(i: int) -> float:
+    """The i-th element of the base 2 van der Corput sequence."""
+    value, denominator = 0.0, 1.0
+    while i:
+        denominator *= 2
+        i, bit = divmod(i, 2)
+        value += bit / denominator
+    return value
+
+
+def annotations_per_class(annotations):
+    counts = {}
+    for ann in annotations:
+        cid = ann.simroom_class_id
+        counts[cid] = counts.get(cid, 0) + 1
+    return counts
+
+
+def enough_annotations(annotations, class_ids):
+    counts = annotations_per_class(annotations)
+
+    for cid in class_ids:
+        if counts.get(cid, 0) < MIN_ANNOTATIONS_PER_CLASS:
+            return False
+
+    return True
+
+
+def mask_to_bbox(mask):
+    """Convert SAM mask to bounding box."""
+    ys, xs = mask.nonzero()
+
+    if len(xs) == 0 or len(ys) == 0:
+        return None
+
+    x1, x2 = xs.min(), xs.max()
+    y1, y2 = ys.min(), ys.max()
+
+    return (x1, y1, x2, y2)
+
+
+def match_masks_to_classes(
+    masks,
+    frame_img,
+    matcher: PrototypeMatrix | KNNClassifier | HeadClassifier,
+    mode: str = EMBEDDING_MODE,
+    top_k: int = 1,
+    threshold: float = SIM_THRESHOLD,
+) -> list[tuple[int, tuple[int, int, int, int], float]]:
+    """
+    The top_k classes of every mask whose similarity to a prototype, or to
+    the annotations voting for it, reaches threshold, as (class_id, bbox, score) tuples.
+    """
+    bboxes = []
+    crops = []
+    kept_masks = []
+
+    for mask in masks:
+        bbox = mask_to_bbox(mask)
+        if bbox is None:
+            continue
+
+        x1, y1, x2, y2 = bbox
+        crop = frame_img[y1:y2, x1:x2]
+
+        if crop.size == 0:
+            continue
+
+        bboxes.append(bbox)
+        crops.append(crop)
+        kept_masks.append(mask)
+
+    if mode == EmbeddingMode.MASK_POOLED:
+        # One forward pass for the frame, every mask pools its own patch features
+        crop_embs = get_mask_embeddings(frame_img, kept_masks)
+    else:
+        # All candidate crops of the frame go through DINOv2 in batches
+        crop_embs = get_crop_embeddings(crops, log_performance=True)
+
+    rows, class_ids, scores = matcher.match(crop_embs, threshold, top_k)
+    return [
+        (class_id, bboxes[row], score)
+        for row, class_id, score in zip(rows.tolist(), class_ids.tolist(), scores.tolist())
+    ]
@@ -8,7 +8,7 @@ from sqlalchemy.orm import Session
 from src.aliases import UInt8Array
 from src.api.models.pydantic import AnnotationDTO, PointLabelDTO
 from src.api.repositories import annotations_repo
-from src.api.services import sam2_service
+from src.api.services import classifier_service, embeddings_service, sam2_service
 from ..utils import image_utils
 
 
@@ -49,6 +49,17 @@ def get_annotations_by_class_id(
     return [AnnotationDTO.from_orm(annotation) for annotation in annotations]
 
 
+def get_annotations_by_calibration_id(
+    db: Session, calibration_id: int
+) -> list[AnnotationDTO]:
+    annotations = annotations_repo.get_annotations_by_calibration_id(
+        db=db,
+        calibration_id=calibration_id,
+    )
+
+    return [AnnotationDTO.from_orm(annotation) for annotation in annotations]
+
+
 def get_all_annotations_by_class_id(
     db: Session, class_id: int
 ) -> list[AnnotationDTO]:
@@ -122,6 +133,13 @@ def create_annotation(
     annotations_repo.create_point_labels(
         db=db, annotation_id=annotation.id, points=points, labels=labels
     )
+    # Updates recreate the annotation, so both embed it here
+    embeddings_service.store_annotation_embedding(
+        db=db,
+        annotation=annotation,
+        crop_bgr=frame_crop,
+        mask=mask > 0,
+    )
 
 
 def update_annotation(
@@ -208,3 +226,4 @@ def post_annotation_point(
             frame_idx=frame_idx,
             calibration_id=calibration_id,
         )
+    classifier_service.queue_head_training(db, calibration_id)
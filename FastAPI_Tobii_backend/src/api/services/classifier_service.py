@@ -0,0 +1,245 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sqlalchemy.orm import Session
+
+from src.api.db import SessionLocal
+from src.api.models.db import ClassifierHead
+from src.api.models.jobs import JobKind
+from src.api.repositories import classes_repo, embeddings_repo, jobs_repo
+from src.api.services import jobs_service
+from src.api.services.jobs_service import JobContext
+from src.config import (
+    CLASSIFIER_HEAD_EPOCHS,
+    CLASSIFIER_HEAD_HIDDEN,
+    CLASSIFIER_HEAD_HOLDOUT,
+    CLASSIFIER_HEAD_KEEP_VERSIONS,
+    EMBEDDING_MODE,
+    EMBEDDING_MODEL_VERSION,
+)
+
+# Below this many embeddings per class there is nothing to hold out
+MIN_EMBEDDINGS_FOR_HOLDOUT = 5
+
+
+def run_head_training_job(payload: dict[str, Any], context: JobContext) -> dict[str, Any]:
+    """Job handler: train a classification head for a set of classes on their stored embeddings."""
+    with SessionLocal() as db:
+        head = train_head(db, payload["class_ids"], payload.get("embedding_mode", EMBEDDING_MODE))
+        db.commit()
+
+        if head is None:
+            return {"head_id": None}
+        return {"head_id": head.id, "version": head.version, "accuracy": head.accuracy}
+
+
+def queue_head_training(db: Session, calibration_id: int) -> None:
+    """
+    Annotations of a calibration changed, train its classes' head again. A job
+    still waiting in the queue trains on the latest embeddings anyway.
+    """
+    class_ids = sorted(
+        sim_class.id for sim_class in classes_repo.get_classes_by_calibration(db, calibration_id)
+    )
+    payload = {"class_ids": class_ids}
+    if len(class_ids) < 2 or jobs_repo.has_queued_job(db, JobKind.HEAD_TRAINING, payload):
+        return
+    jobs_service.submit(db, JobKind.HEAD_TRAINING, payload=payload)
+
+
+def create_head_model(dim: int, class_count: int, hidden: int) -> torch.nn.Module:
+    if hidden == 0:
+        return torch.nn.Linear(dim, class_count)
+    return torch.nn.Sequential(
+        torch.nn.Linear(dim, hidden),
+        torch.nn.ReLU(),
+        torch.nn.Dropout(0.1),
+        torch.nn.Linear(hidden, class_count),
+    )
+
+
+def fit_head(
+    embeddings: torch.Tensor,
+    labels: torch.Tensor,
+    class_count: int,
+    hidden: int,
+    epochs: int = CLASSIFIER_HEAD_EPOCHS,
+) -> torch.nn.Module:
+    """Full-batch training on the CPU, a few thousand embeddings take seconds."""
+    torch.manual_seed(0)
+    model = create_head_model(embeddings.shape[1], class_count, hidden)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-2, weight_decay=1e-4)
+
+    # Classes with few annotations count as much as classes with many
+    counts = torch.bincount(labels, minlength=class_count).clamp_min(1).float()
+    class_weights = len(labels) / (class_count * counts)
+
+    model.train()
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = F.cross_entropy(model(embeddings), labels, weight=class_weights)
+        loss.backward()
+        optimizer.step()
+
+    model.eval()
+    return model
+
+
+def holdout_accuracy(
+    embeddings: torch.Tensor, labels: torch.Tensor, class_count: int, hidden: int
+) -> float | None:
+    """Accuracy of a head trained without a random share of the embeddings, on that share."""
+    counts = torch.bincount(labels, minlength=class_count)
+    if counts.min() < MIN_EMBEDDINGS_FOR_HOLDOUT:
+        return None
+
+    generator = torch.Generator().manual_seed(0)
+    order = torch.randperm(len(labels), generator=generator)
+    holdout_count = max(1, int(len(labels) * CLASSIFIER_HEAD_HOLDOUT))
+    holdout, train = order[:holdout_count], order[holdout_count:]
+
+    model = fit_head(embeddings[train], labels[train], class_count, hidden)
+    with torch.no_grad():
+        predictions = model(embeddings[holdout]).argmax(dim=1)
+    return float((predictions == labels[holdout]).float().mean())
+
+
+def train_head(
+    db: Session,
+    class_ids: list[int],
+    mode: str = EMBEDDING_MODE,
+    hidden: int = CLASSIFIER_HEAD_HIDDEN,
+) -> ClassifierHead | None:
+    """
+    Fit a new version of the head for these classes. Only annotations that
+    already have an embedding are used, they are embedded when created.
+    """
+    class_ids = sorted(set(class_ids))
+    annotation_ids = []
+    vectors = []
+    labels = []
+    for label, class_id in enumerate(class_ids):
+        class_embeddings = embeddings_repo.get_annotation_embeddings(
+            db, class_id, EMBEDDING_MODEL_VERSION, mode
+        )
+        annotation_ids.extend(class_embeddings.keys())
+        vectors.extend(class_embeddings.values())
+        labels.extend([label] * len(class_embeddings))
+
+    if len(set(labels)) < 2:
+        print(f"Not enough embedded classes to train a head for {class_ids}", flush=True)
+        return None
+
+    # Nothing to learn when the newest head saw exactly these annotations
+    digest = hashlib.sha1(json.dumps(sorted(annotation_ids)).encode()).hexdigest()
+    heads = embeddings_repo.get_class_set_heads(db, class_ids, EMBEDDING_MODEL_VERSION, mode)
+    if heads and heads[0].embeddings_digest == digest and heads[0].weights_path.exists():
+        print(f"Head v{heads[0].version} of classes {class_ids} is up to date", flush=True)
+        return heads[0]
+
+    embeddings = torch.from_numpy(np.stack(vectors))
+    labels = torch.tensor(labels, dtype=torch.long)
+
+    accuracy = holdout_accuracy(embeddings, labels, len(class_ids), hidden)
+    model = fit_head(embeddings, labels, len(class_ids), hidden)
+
+    # Prototypes keep masks unlike any class out, a softmax always picks one
+    prototypes = torch.stack(
+        [F.normalize(embeddings[labels == label].sum(dim=0), dim=0) for label in range(len(class_ids))]
+    )
+
+    head = embeddings_repo.create_classifier_head(
+        db,
+        class_ids=class_ids,
+        model_version=EMBEDDING_MODEL_VERSION,
+        embedding_mode=mode,
+        hidden=hidden,
+        embedding_count=len(labels),
+        embeddings_digest=digest,
+        accuracy=accuracy,
+    )
+    torch.save(
+        {"state_dict": model.state_dict(), "prototypes": prototypes},
+        head.weights_path,
+    )
+    print(
+        f"Trained head v{head.version} for classes {class_ids} on {len(labels)} embeddings, "
+        f"holdout accuracy {accuracy}",
+        flush=True,
+    )
+
+    embeddings_repo.prune_classifier_heads(
+        db, class_ids, EMBEDDING_MODEL_VERSION, mode, CLASSIFIER_HEAD_KEEP_VERSIONS
+    )
+    return head
+
+
+@dataclass(frozen=True)
+class HeadClassifier:
+    """
+    Scores masks with a trained head. A head trained on more classes than
+    requested is used with its other classes masked out of the softmax.
+    """
+
+    class_ids: torch.Tensor  # (C,) long, the requested classes
+    columns: torch.Tensor  # (C,) the head's output of every requested class
+    model: torch.nn.Module
+    prototypes: torch.Tensor  # (C, D) normalized
+
+    @classmethod
+    def load(
+        cls, db: Session, class_ids: list[int], device: str, mode: str = EMBEDDING_MODE
+    ) -> "HeadClassifier | None":
+        """The newest head whose classes include every requested class, if any."""
+        requested = sorted(set(class_ids))
+        for head in embeddings_repo.get_classifier_heads(db, EMBEDDING_MODEL_VERSION, mode):
+            head_class_ids = head.class_ids
+            if not set(requested) <= set(head_class_ids) or not head.weights_path.exists():
+                continue
+
+            checkpoint = torch.load(head.weights_path, map_location=device)
+            prototypes = checkpoint["prototypes"]
+            model = create_head_model(prototypes.shape[1], len(head_class_ids), head.hidden)
+            model.load_state_dict(checkpoint["state_dict"])
+            model.to(device).eval()
+
+            columns = torch.tensor(
+                [head_class_ids.index(class_id) for class_id in requested], device=device
+            )
+            print(f"Using classifier head v{head.version} of classes {head_class_ids}", flush=True)
+            return cls(
+                class_ids=torch.tensor(requested, dtype=torch.long, device=device),
+                columns=columns,
+                model=model,
+                prototypes=prototypes[columns],
+            )
+        return None
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    def match(
+        self, embeddings: torch.Tensor, threshold: float, top_k: int = 1
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        The top_k classes of every embedding by head probability, kept when the
+        embedding is at least threshold similar to that class's prototype.
+        Returns flat (embedding index, class id, probability) tensors on the CPU.
+        """
+        empty = torch.empty(0, dtype=torch.long)
+        if len(embeddings) == 0:
+            return empty, empty, torch.empty(0)
+
+        with torch.no_grad():
+            probabilities = self.model(embeddings)[:, self.columns].softmax(dim=1)
+        similarities = F.normalize(embeddings, dim=1) @ self.prototypes.T
+
+        top_probabilities, top_idx = probabilities.topk(min(top_k, len(self)), dim=1)
+        keep = similarities.gather(1, top_idx) >= threshold
+        rows = keep.nonzero(as_tuple=True)[0]
+        return rows.cpu(), self.class_ids[top_idx[keep]].cpu(), top_probabilities[keep].cpu()
@@ -2,10 +2,10 @@ from pathlib import Path
 import tempfile
 import time
 from collections.abc import Generator
+from dataclasses import dataclass
 
 from src.api.services import recordings_service
 from src.utils import extract_frames_to_dir, get_frame_from_dir
-from src.api.services import annotations_service
 import torch
 import torchvision.transforms as T
 from transformers import AutoImageProcessor, AutoModel, BitImageProcessor
@@ -19,7 +19,22 @@ import torch.nn.functional as F
 from torchvision import transforms
 from PIL import Image
 
+from sqlalchemy.orm import Session
+
 from src.aliases import UInt8Array
+from src.api.models.vector_index import FAISSIndexWithMetadata
+from src.api.repositories import embeddings_repo
+from src.api.utils import image_utils
+from src.config import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MODE,
+    EMBEDDING_MODEL_VERSION,
+    KNN_NEIGHBORS,
+    MASK_POOLING_CHUNK_SIZE,
+    MASK_POOLING_SHORT_SIDE,
+    EmbeddingMode,
+    VectorIndexType,
+)
 
 IMAGE_PROCESSOR: BitImageProcessor = AutoImageProcessor.from_pretrained(
     "facebook/dinov2-base"
@@ -28,9 +43,10 @@ EMBEDDING_DIM = 768
 
 
 crop_size = IMAGE_PROCESSOR.crop_size["height"]
+resize_size = int((256 / 224) * crop_size)
 transformation_chain = T.Compose([
     T.ToTensor(),  # Convert numpy array (HWC) to tensor (CHW) scaled to [0,1]
-    T.Resize(int((256 / 224) * crop_size)),
+    T.Resize(resize_size),
     T.CenterCrop(crop_size),
     T.Normalize(mean=IMAGE_PROCESSOR.image_mean, std=IMAGE_PROCESSOR.image_std),
 ])
@@ -38,6 +54,7 @@ transformation_chain = T.Compose([
 device = "cuda" if torch.cuda.is_available() else "cpu"
 dinov2_model: torch.nn.Module = AutoModel.from_pretrained("facebook/dinov2-base").to(device).float()
 image_processor: BitImageProcessor = BitImageProcessor.from_pretrained("facebook/dinov2-base")
+PATCH_SIZE: int = dinov2_model.config.patch_size
 
 
 def get_embeddings(
@@ -100,35 +117,415 @@ def get_crop_embedding(crop_bgr: np.ndarray) -> torch.Tensor:
         emb = dinov2_model(tensor).last_hidden_state[:, 0].squeeze(0)
     return F.normalize(emb, dim=0)
 
-def build_prototypes(class_map: dict) -> dict[int, torch.Tensor]:
+def to_image_tensor(image_bgr: np.ndarray) -> torch.Tensor:
+    """A BGR uint8 image as a (1, 3, H, W) RGB tensor in [0, 1] on the model's device."""
+    tensor = torch.from_numpy(np.ascontiguousarray(image_bgr[:, :, ::-1]))
+    return tensor.to(device).permute(2, 0, 1).unsqueeze(0).float() / 255.0
+
+
+def normalize_batch(batch: torch.Tensor) -> torch.Tensor:
+    mean = torch.tensor(IMAGE_PROCESSOR.image_mean, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGE_PROCESSOR.image_std, device=device).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+
+def preprocess_crops(crops_bgr: list[np.ndarray]) -> torch.Tensor:
     """
-    For each SimRoomClass, decode annotation crops → DINOv2 embeddings → mean prototype.
+    The tensor equivalent of transformation_chain for a batch of BGR crops.
+    Every crop is resized on the device, the crop and normalization run on
+    the whole batch at once.
     """
-    prototypes = {}
+    resized = []
+    for crop_bgr in crops_bgr:
+        tensor = to_image_tensor(crop_bgr)
 
-    for class_id, sim_class in class_map.items():
-        embeddings = []
+        # Resize the shorter side, like T.Resize with a single size
+        height, width = tensor.shape[-2:]
+        scale = resize_size / min(height, width)
+        size = (max(resize_size, round(height * scale)), max(resize_size, round(width * scale)))
+        resized.append(
+            T.functional.center_crop(
+                F.interpolate(tensor, size=size, mode="bilinear", antialias=True),
+                [crop_size, crop_size],
+            )
+        )
+
+    return normalize_batch(torch.cat(resized))
+
+
+def get_crop_embeddings(
+    crops_bgr: list[np.ndarray],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    log_performance: bool = False,
+) -> torch.Tensor:
+    """Normalized DINOv2 CLS-token embeddings for BGR crops, one row per crop."""
+    if not crops_bgr:
+        return torch.empty((0, EMBEDDING_DIM), device=device)
+
+    start_time = time.time()
+    embeddings = []
+    with torch.no_grad():
+        for i in range(0, len(crops_bgr), batch_size):
+            batch_tensor = preprocess_crops(crops_bgr[i : i + batch_size])
+            embeddings.append(dinov2_model(batch_tensor).last_hidden_state[:, 0])
+
+    if log_performance:
+        cps = len(crops_bgr) / (time.time() - start_time)
+        print(f"Embedded {len(crops_bgr)} crops at {cps:.2f} crops per second", flush=True)
+
+    return F.normalize(torch.cat(embeddings), dim=1)
+
+
+def get_patch_features(images: torch.Tensor) -> torch.Tensor:
+    """
+    DINOv2 patch-token features of a normalized image batch whose sides are
+    multiples of the patch size, as a (B, rows, cols, D) grid.
+    """
+    with torch.no_grad():
+        tokens = dinov2_model(images).last_hidden_state[:, 1:]  # drop the CLS token
+    batch_size, _, height, width = images.shape
+    return tokens.reshape(batch_size, height // PATCH_SIZE, width // PATCH_SIZE, -1)
+
+
+def pool_masks(patch_features: torch.Tensor, masks: torch.Tensor) -> torch.Tensor:
+    """
+    Average (B, rows, cols, D) patch features under (B, N, H, W) masks, weighted
+    by how much of every patch a mask covers. Returns normalized (B, N, D) descriptors.
+    """
+    _, rows, cols, _ = patch_features.shape
+    weights = []
+    # Downsampling full-resolution masks is the memory-heavy part, so go in chunks
+    for i in range(0, masks.shape[1], MASK_POOLING_CHUNK_SIZE):
+        chunk = masks[:, i : i + MASK_POOLING_CHUNK_SIZE].float()
+        weights.append(F.interpolate(chunk, size=(rows, cols), mode="area"))
+    weights = torch.cat(weights, dim=1).flatten(2)  # (B, N, rows * cols)
+
+    pooled = torch.einsum("bnp,bpd->bnd", weights, patch_features.flatten(1, 2))
+    pooled = pooled / weights.sum(dim=2, keepdim=True).clamp_min(1e-6)
+    return F.normalize(pooled, dim=2)
+
+
+def get_mask_embeddings(frame_bgr: np.ndarray, masks: list[np.ndarray]) -> torch.Tensor:
+    """
+    Mask-pooled embeddings for masks of a single frame, one row per mask. The
+    frame goes through DINOv2 once, whatever the number of masks.
+    """
+    if not masks:
+        return torch.empty((0, EMBEDDING_DIM), device=device)
+
+    height, width = frame_bgr.shape[:2]
+    scale = MASK_POOLING_SHORT_SIDE / min(height, width)
+    size = (
+        max(PATCH_SIZE, round(height * scale / PATCH_SIZE) * PATCH_SIZE),
+        max(PATCH_SIZE, round(width * scale / PATCH_SIZE) * PATCH_SIZE),
+    )
+    image = F.interpolate(to_image_tensor(frame_bgr), size=size, mode="bilinear", antialias=True)
+    patch_features = get_patch_features(normalize_batch(image))
+
+    mask_tensor = torch.from_numpy(np.stack(masks).astype(np.uint8)).to(device)
+    return pool_masks(patch_features, mask_tensor.unsqueeze(0))[0]
+
+
+def get_masked_crop_embeddings(
+    crops_bgr: list[np.ndarray],
+    masks: list[np.ndarray],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+) -> torch.Tensor:
+    """
+    Mask-pooled embeddings for box crops with their box-sized masks, such as
+    stored annotations. Crops are squashed to the model's input size so they batch.
+    """
+    if not crops_bgr:
+        return torch.empty((0, EMBEDDING_DIM), device=device)
+
+    embeddings = []
+    for i in range(0, len(crops_bgr), batch_size):
+        images = []
+        batch_masks = []
+        for crop_bgr, mask in zip(crops_bgr[i : i + batch_size], masks[i : i + batch_size]):
+            images.append(
+                F.interpolate(
+                    to_image_tensor(crop_bgr),
+                    size=(crop_size, crop_size),
+                    mode="bilinear",
+                    antialias=True,
+                )
+            )
+            mask_tensor = torch.from_numpy(mask.astype(np.float32)).to(device)
+            batch_masks.append(
+                F.interpolate(mask_tensor[None, None], size=(crop_size, crop_size))
+            )
+
+        patch_features = get_patch_features(normalize_batch(torch.cat(images)))
+        embeddings.append(pool_masks(patch_features, torch.cat(batch_masks))[:, 0])
+
+    return torch.cat(embeddings)
+
+
+def decode_annotation(annotation, mode: str) -> tuple[np.ndarray, np.ndarray | None] | None:
+    """The stored crop of an annotation and, in mask-pooled mode, its box-cropped mask."""
+    if not annotation.frame_crop_base64:
+        return None
+
+    img_bytes = base64.b64decode(annotation.frame_crop_base64)
+    img_array = np.frombuffer(img_bytes, dtype=np.uint8)
+    crop_bgr  = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+    if crop_bgr is None or crop_bgr.size == 0:
+        return None
+
+    if mode != EmbeddingMode.MASK_POOLED:
+        return crop_bgr, None
+
+    if not annotation.mask_base64:
+        return None
+    # Stored masks are cropped to the box, like the frame crop
+    mask = image_utils.decode_from_base64(annotation.mask_base64) > 0
+    if mask.shape[:2] != crop_bgr.shape[:2] or not mask.any():
+        return None
+    return crop_bgr, mask
 
-        for annotation in sim_class.annotations:
-            if not annotation.frame_crop_base64:
-                continue
 
-            img_bytes = base64.b64decode(annotation.frame_crop_base64)
-            img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-            crop_bgr  = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+def embed_annotation_crops(
+    crops_bgr: list[np.ndarray], masks: list[np.ndarray | None], mode: str
+) -> torch.Tensor:
+    if mode == EmbeddingMode.MASK_POOLED:
+        return get_masked_crop_embeddings(crops_bgr, masks)
+    return get_crop_embeddings(crops_bgr)
 
-            if crop_bgr is None or crop_bgr.size == 0:
-                continue
 
-            embeddings.append(get_crop_embedding(crop_bgr))
+def store_annotation_embedding(
+    db: Session,
+    annotation,
+    crop_bgr: np.ndarray,
+    mask: np.ndarray,
+    mode: str = EMBEDDING_MODE,
+) -> None:
+    """
+    Embed a new annotation once and keep the embedding, so building a
+    prototype is a lookup. mask is the annotation's mask cropped to its box.
+    """
+    if crop_bgr.size == 0 or (mode == EmbeddingMode.MASK_POOLED and not mask.any()):
+        return
+
+    embedding = embed_annotation_crops([crop_bgr], [mask], mode)[0].cpu().numpy()
+    embeddings_repo.create_annotation_embedding(
+        db,
+        annotation_id=annotation.id,
+        simroom_class_id=annotation.simroom_class_id,
+        model_version=EMBEDDING_MODEL_VERSION,
+        embedding_mode=mode,
+        embedding=embedding,
+    )
+    embeddings_repo.add_to_class_prototype(
+        db, annotation.simroom_class_id, EMBEDDING_MODEL_VERSION, mode, embedding
+    )
+
+
+def get_class_embeddings(db: Session, sim_class, mode: str) -> dict[int, np.ndarray]:
+    """
+    The stored embeddings of a class by annotation id. Annotations without
+    an embedding for this model version are embedded and stored first.
+    """
+    embeddings = embeddings_repo.get_annotation_embeddings(
+        db, sim_class.id, EMBEDDING_MODEL_VERSION, mode
+    )
+
+    missing = []
+    crops = []
+    masks = []
+    for annotation in sim_class.annotations:
+        if annotation.id in embeddings:
+            continue
+        decoded = decode_annotation(annotation, mode)
+        if decoded is None:
+            continue
+        missing.append(annotation)
+        crops.append(decoded[0])
+        masks.append(decoded[1])
+
+    if missing:
+        print(f"Embedding {len(missing)} annotations of class {sim_class.id}", flush=True)
+        new_embeddings = embed_annotation_crops(crops, masks, mode).cpu().numpy()
+        for annotation, embedding in zip(missing, new_embeddings):
+            embeddings_repo.create_annotation_embedding(
+                db,
+                annotation_id=annotation.id,
+                simroom_class_id=sim_class.id,
+                model_version=EMBEDDING_MODEL_VERSION,
+                embedding_mode=mode,
+                embedding=embedding,
+            )
+            embeddings[annotation.id] = embedding
+
+    return embeddings
 
-        if not embeddings:
+
+def rebuild_class_prototype(db: Session, sim_class, mode: str) -> np.ndarray | None:
+    """Sum the stored embeddings of a class into a new prototype."""
+    embeddings = get_class_embeddings(db, sim_class, mode)
+
+    if not embeddings:
+        return None
+
+    embedding_sum = np.sum(list(embeddings.values()), axis=0)
+    embeddings_repo.save_class_prototype(
+        db,
+        sim_class.id,
+        EMBEDDING_MODEL_VERSION,
+        mode,
+        embedding_sum=embedding_sum,
+        annotation_count=len(embeddings),
+    )
+    return embedding_sum
+
+
+def build_prototypes(
+    db: Session, class_map: dict, mode: str = EMBEDDING_MODE
+) -> dict[int, torch.Tensor]:
+    """
+    For each SimRoomClass, the normalized mean of its annotation embeddings.
+    Prototypes and embeddings are stored, so this is normally a lookup; a
+    prototype that was invalidated is rebuilt from the stored embeddings.
+    """
+    prototypes = {}
+
+    for class_id, sim_class in class_map.items():
+        prototype = embeddings_repo.get_class_prototype(
+            db, class_id, EMBEDDING_MODEL_VERSION, mode
+        )
+        if prototype is not None:
+            embedding_sum = np.frombuffer(prototype.embedding_sum, dtype=np.float32)
+        else:
+            embedding_sum = rebuild_class_prototype(db, sim_class, mode)
+
+        if embedding_sum is None:
             continue
 
-        prototype = torch.stack(embeddings).mean(dim=0)
+        # The sum and the mean of the embeddings point the same way
+        prototype = torch.from_numpy(embedding_sum.copy()).to(device)
         prototypes[class_id] = F.normalize(prototype, dim=0)
 
     return prototypes
 
 
+@dataclass(frozen=True)
+class PrototypeMatrix:
+    """
+    Class prototypes stacked into one normalized (C, D) matrix, so every
+    mask embedding of a frame is scored against every class in a single
+    matrix multiply.
+    """
+
+    class_ids: torch.Tensor  # (C,) long
+    matrix: torch.Tensor  # (C, D), rows normalized
+
+    @classmethod
+    def from_prototypes(cls, prototypes: dict[int, torch.Tensor]) -> "PrototypeMatrix":
+        if not prototypes:
+            return cls(
+                class_ids=torch.empty(0, dtype=torch.long, device=device),
+                matrix=torch.empty((0, EMBEDDING_DIM), device=device),
+            )
+        class_ids = torch.tensor(list(prototypes.keys()), dtype=torch.long, device=device)
+        matrix = torch.stack([prototype.to(device) for prototype in prototypes.values()])
+        return cls(class_ids=class_ids, matrix=F.normalize(matrix, dim=1))
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    def match(
+        self, embeddings: torch.Tensor, threshold: float, top_k: int = 1
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        The top_k classes of every embedding whose cosine similarity reaches
+        threshold. Returns flat (embedding index, class id, score) tensors,
+        moved to the CPU together so the device syncs once per call.
+        """
+        empty = torch.empty(0, dtype=torch.long)
+        if len(self) == 0 or len(embeddings) == 0:
+            return empty, empty, torch.empty(0)
+
+        scores = F.normalize(embeddings, dim=1) @ self.matrix.T  # (N, C)
+        top_scores, top_idx = scores.topk(min(top_k, len(self)), dim=1)
+
+        keep = top_scores >= threshold
+        rows = keep.nonzero(as_tuple=True)[0]
+        class_ids = self.class_ids[top_idx[keep]]
+        return rows.cpu(), class_ids.cpu(), top_scores[keep].cpu()
+
+
+def build_annotation_index(
+    db: Session, class_map: dict, mode: str = EMBEDDING_MODE
+) -> FAISSIndexWithMetadata | None:
+    """An index over every stored annotation embedding of the classes, tagged with their class."""
+    vectors = []
+    metadata = []
+    for class_id, sim_class in class_map.items():
+        for annotation_id, embedding in get_class_embeddings(db, sim_class, mode).items():
+            vectors.append(embedding)
+            metadata.append({"class_id": class_id, "annotation_id": annotation_id})
+
+    if not vectors:
+        return None
+
+    # A few thousand annotations at most, exact search is both fast and untrained
+    return FAISSIndexWithMetadata.build(
+        torch.from_numpy(np.stack(vectors)), metadata, index_type=VectorIndexType.FLAT
+    )
+
+
+@dataclass(frozen=True)
+class KNNClassifier:
+    """
+    Assigns classes by a similarity-weighted vote of the k nearest annotation
+    embeddings, so every view of a multi-view object can match on its own
+    instead of through one averaged prototype.
+    """
+
+    index: FAISSIndexWithMetadata | None
+    class_ids: np.ndarray  # sorted unique class ids in the index
+    k: int = KNN_NEIGHBORS
+
+    @classmethod
+    def from_index(cls, index: FAISSIndexWithMetadata | None, k: int = KNN_NEIGHBORS) -> "KNNClassifier":
+        if index is None or index.ntotal == 0:
+            return cls(index=None, class_ids=np.empty(0, dtype=np.int64), k=k)
+        return cls(index=index, class_ids=np.unique(index.columns["class_id"]), k=k)
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    def match(
+        self, embeddings: torch.Tensor, threshold: float, top_k: int = 1
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The top_k classes by vote of every embedding. Only neighbours at least
+        threshold similar vote, each with its similarity; a class's score is
+        its most similar neighbour. Returns flat (embedding index, class id, score) arrays.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if self.index is None or len(embeddings) == 0:
+            return empty, empty, np.empty(0, dtype=np.float32)
+
+        # One search for every candidate mask of the frame
+        scores, ids = self.index.search(embeddings, self.k)
+        neighbour_classes = self.index.get_metadata_columns(ids)["class_id"]
+        voting = (ids >= 0) & (scores >= threshold)
+
+        rows = np.broadcast_to(np.arange(len(ids))[:, None], ids.shape)[voting]
+        class_pos = np.searchsorted(self.class_ids, neighbour_classes[voting])
+
+        votes = np.zeros((len(ids), len(self.class_ids)), dtype=np.float32)
+        np.add.at(votes, (rows, class_pos), scores[voting])
+        best_scores = np.zeros_like(votes)
+        np.maximum.at(best_scores, (rows, class_pos), scores[voting])
 
+        top = np.argsort(-votes, axis=1, kind="stable")[:, : min(top_k, len(self.class_ids))]
+        keep = np.take_along_axis(votes, top, axis=1) > 0
+        match_rows = np.nonzero(keep)[0]
+        return (
+            match_rows,
+            self.class_ids[top[keep]],
+            np.take_along_axis(best_scores, top, axis=1)[keep],
+        )
@@ -1,197 +1,578 @@
-import json
+import functools
+import os
+import queue
+import threading
+from collections.abc import Sequence
 from pathlib import Path
 
 import numpy as np
+import numpy.typing as npt
 import torch
 
-from src.api.models.gaze import GazeData, GazePoint
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, the standard library decoder is a few times slower
+    from json import loads as json_loads
+
+from src.api.models.gaze import (
+    FrameGazeAlignment,
+    GazeColumn,
+    GazeColumns,
+    Fixations,
+    GazeSamples,
+    fixations_path,
+    frame_timestamps_path,
+    gaze_columns_path,
+)
 from src.config import (
+    FIXATION_ALGORITHM,
+    FIXATION_DISPERSION_THRESHOLD,
+    FIXATION_MIN_DURATION,
+    FIXATION_VELOCITY_THRESHOLD,
+    GAZE_FRAME_AGGREGATE,
     RECORDINGS_PATH,
     TOBII_GLASSES_FPS,
     TOBII_GLASSES_RESOLUTION,
     VIEWED_RADIUS,
+    FixationAlgorithm,
+    GazeAggregate,
 )
-from src.utils import clamp
+from src.utils import probe_frame_timestamps
+
+NAN = float("nan")
+
+
+@functools.lru_cache
+def disk_kernel(radius: int) -> npt.NDArray[np.bool_]:
+    """A (2r + 1, 2r + 1) disk around its centre pixel, computed once per radius."""
+    offsets = np.arange(-radius, radius + 1)
+    return offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius**2
+
+
+@functools.lru_cache
+def disk_offsets(radius: int) -> npt.NDArray[np.int64]:
+    """The (dy, dx) offsets of the pixels of disk_kernel, (K, 2)."""
+    return np.argwhere(disk_kernel(radius)) - radius
+
+
+def to_numpy_mask(mask: torch.Tensor | np.ndarray) -> np.ndarray:
+    if isinstance(mask, torch.Tensor):
+        mask = mask.detach().cpu().numpy()
+    if mask.ndim == 3:
+        mask = mask.squeeze(0)
+    return mask
 
 
 def mask_was_viewed(
-    mask: torch.Tensor,
+    mask: torch.Tensor | np.ndarray,
     gaze_position: tuple[float, float],
     viewed_radius: float = VIEWED_RADIUS,
 ) -> bool:
     """
     Check if the mask is at least partially within the viewed radius of the gaze point.
-    The mask is assumed to be at the original frame size.
+    Only the mask window under the gaze disk is read, so this costs O(r²)
+    whatever the mask size. The gaze position is rounded to a pixel and may
+    lie outside the mask.
 
     Args:
-        mask: A tensor containing a single mask of shape (H, W)
+        mask: A single mask of shape (H, W) or (1, H, W)
         gaze_position: Tuple (x, y) representing the gaze position.
 
     Returns:
         bool: True if part of the mask falls within the circular
               area defined by viewed_radius, False otherwise.
     """
-    if mask.ndim == 3:
-        mask = mask.squeeze(0)
-
+    mask = to_numpy_mask(mask)
+    radius = int(viewed_radius)
+    kernel = disk_kernel(radius)
     height, width = mask.shape
-    device = mask.device
+    gaze_x, gaze_y = round(gaze_position[0]), round(gaze_position[1])
 
-    # Create a coordinate grid for the mask.
-    y_coords = torch.arange(0, height, device=device).view(-1, 1).repeat(1, width)
-    x_coords = torch.arange(0, width, device=device).view(1, -1).repeat(height, 1)
+    # The part of the disk's bounding square that lies inside the mask
+    x0, x1 = max(gaze_x - radius, 0), min(gaze_x + radius + 1, width)
+    y0, y1 = max(gaze_y - radius, 0), min(gaze_y + radius + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        return False
 
-    # Create the circular mask based on self.viewed_radius.
-    dist_sq = (x_coords - gaze_position[0]) ** 2 + (y_coords - gaze_position[1]) ** 2
-    circular_mask = (dist_sq <= viewed_radius**2).float()
+    window = mask[y0:y1, x0:x1] > 0
+    kx, ky = x0 - (gaze_x - radius), y0 - (gaze_y - radius)
+    return bool(np.any(window & kernel[ky : ky + (y1 - y0), kx : kx + (x1 - x0)]))
 
-    # Apply the circular mask to the input mask.
-    overlapped_mask = mask * circular_mask
-    return bool(overlapped_mask.sum() > 0)
 
-
-def parse_gazedata_file(file_path: Path) -> list[GazeData]:
+def masks_were_viewed(
+    masks: Sequence[torch.Tensor | np.ndarray] | np.ndarray,
+    gaze_positions: npt.ArrayLike,
+    viewed_radius: float = VIEWED_RADIUS,
+) -> npt.NDArray[np.bool_]:
+    """
+    mask_was_viewed for many (mask, gaze position) pairs. Masks of one shape
+    stacked into an (N, H, W) array are tested in a single gather of the disk
+    pixels; masks of different shapes, such as box crops, one by one.
+    """
+    gaze_positions = np.rint(np.asarray(gaze_positions, dtype=np.float64)).astype(np.int64)
+    if len(gaze_positions) == 0:
+        return np.zeros(0, dtype=bool)
+
+    if not isinstance(masks, np.ndarray) or masks.ndim != 3:
+        return np.array(
+            [
+                mask_was_viewed(mask, (x, y), viewed_radius)
+                for mask, (x, y) in zip(masks, gaze_positions.tolist())
+            ],
+            dtype=bool,
+        )
+
+    count, height, width = masks.shape
+    offsets = disk_offsets(int(viewed_radius))
+    ys = gaze_positions[:, 1, None] + offsets[None, :, 0]  # (N, K)
+    xs = gaze_positions[:, 0, None] + offsets[None, :, 1]
+    inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+
+    hits = masks[
+        np.arange(count)[:, None],
+        np.clip(ys, 0, height - 1),
+        np.clip(xs, 0, width - 1),
+    ] > 0
+    return np.any(hits & inside, axis=1)
+
+
+def parse_gazedata_row(line: bytes) -> list[float]:
+    """One line of a gaze data file as a GazeColumn row, NaN where data is missing."""
+    sample = json_loads(line)
+    row = [NAN] * GazeColumn.COUNT
+    row[GazeColumn.TIMESTAMP] = sample["timestamp"]
+
+    gaze_data = sample["data"]
+    if not gaze_data:
+        # No gaze data available for this timestamp
+        return row
+
+    row[GazeColumn.GAZE2D] = gaze_data["gaze2d"]
+    row[GazeColumn.GAZE3D] = gaze_data["gaze3d"]
+    left_eye = gaze_data.get("eyeleft")
+    if left_eye:
+        row[GazeColumn.ORIGIN_LEFT] = left_eye["gazeorigin"]
+        row[GazeColumn.DIRECTION_LEFT] = left_eye["gazedirection"]
+        row[GazeColumn.PUPIL_LEFT] = left_eye["pupildiameter"]
+    right_eye = gaze_data.get("eyeright")
+    if right_eye:
+        row[GazeColumn.ORIGIN_RIGHT] = right_eye["gazeorigin"]
+        row[GazeColumn.DIRECTION_RIGHT] = right_eye["gazedirection"]
+        row[GazeColumn.PUPIL_RIGHT] = right_eye["pupildiameter"]
+    return row
+
+
+def parse_gazedata_file(file_path: Path) -> GazeColumns:
+    """Stream a gaze data file line by line into columns, without keeping its text."""
     if not file_path.exists():
         raise FileNotFoundError(f"File {file_path} does not exist")
 
-    with file_path.open("r") as f:
-        return [GazeData.from_dict(json.loads(line)) for line in f.readlines()]
+    with file_path.open("rb") as f:
+        rows = [parse_gazedata_row(line) for line in f if line.strip()]
+
+    data = np.array(rows, dtype=np.float64).reshape(-1, GazeColumn.COUNT)
+    return GazeColumns(data)
+
+
+class GazeDataStreamParser:
+    """
+    Parses a gaze data file in a thread of its own while it is being received,
+    so the receiving loop only hands over chunks. Chunks may split lines
+    anywhere, the unfinished tail is kept until the next chunk. A line that
+    fails to parse stops the parsing, the file is then parsed when loaded.
+    """
+
+    def __init__(self) -> None:
+        self.rows: list[list[float]] = []
+        self.tail = b""
+        self.error: Exception | None = None
+        self._chunks: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._parse_chunks, daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk: bytes) -> None:
+        if self.error is None:
+            self._chunks.put(chunk)
+
+    def finish(self) -> GazeColumns | None:
+        """Wait for the fed chunks to be parsed, None when a line failed to parse."""
+        self._chunks.put(None)
+        self._thread.join()
+
+        rows, self.rows = self.rows, []
+        if self.error is not None:
+            print(f"Failed to parse streamed gaze data: {self.error}", flush=True)
+            return None
+
+        data = np.array(rows, dtype=np.float64).reshape(-1, GazeColumn.COUNT)
+        return GazeColumns(data)
+
+    def _parse_chunks(self) -> None:
+        while (chunk := self._chunks.get()) is not None:
+            if self.error is None:
+                self._parse(chunk)
+        if self.error is None and self.tail.strip():
+            self._parse(b"\n")
+
+    def _parse(self, chunk: bytes) -> None:
+        try:
+            lines = (self.tail + chunk).split(b"\n")
+            self.tail = lines.pop()
+            self.rows.extend(parse_gazedata_row(line) for line in lines if line.strip())
+        except Exception as e:
+            self.error = e
+            self.rows = []
+
+
+def write_gaze_columns(columns: GazeColumns, sidecar_path: Path) -> None:
+    # Write next to the sidecar and swap it in, readers never see half a file
+    tmp_path = sidecar_path.with_name(sidecar_path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        np.save(f, columns.data)
+    os.replace(tmp_path, sidecar_path)
+
+
+def load_gaze_columns(gaze_data_path: Path) -> GazeColumns:
+    """
+    The parsed columns of a gaze data file, memory-mapped from its sidecar.
+    The file is parsed and the sidecar written when it is missing or older
+    than the gaze data.
+    """
+    sidecar_path = gaze_columns_path(gaze_data_path)
+    if (
+        not sidecar_path.exists()
+        or sidecar_path.stat().st_mtime < gaze_data_path.stat().st_mtime
+    ):
+        columns = parse_gazedata_file(gaze_data_path)
+        write_gaze_columns(columns, sidecar_path)
+        return columns
+
+    return GazeColumns(np.load(sidecar_path, mmap_mode="r"))
 
 
 def get_gaze_points(
-    gaze_data: list[GazeData], resolution: tuple[int, int]
-) -> list[GazePoint]:
+    gaze_data: GazeColumns, resolution: tuple[int, int]
+) -> GazeSamples:
     """
-    Extract gaze points from a list of gaze data
+    Extract gaze points from parsed gaze data
     and denormalize them to the video resolution.
     Ignores gaze data with type MISSING.
 
     Args:
-        gaze_data (List[GazeData]): List of gaze data objects.
+        gaze_data (GazeColumns): Parsed gaze data.
         resolution (tuple[int, int]): Resolution of the video (height, width).
 
     Returns:
-        List[GazePoint]: List of gaze points with denormalized coordinates.
+        GazeSamples: Gaze points with denormalized coordinates, in time order.
     """
+    gaze = gaze_data.data[gaze_data.has_gaze]
+
+    gaze2d = np.clip(gaze[:, GazeColumn.GAZE2D], 0, 1)
+    # Gaze depth is the distance from the average origin of both eyes to the
+    # gaze point, NaN when either eye is missing
+    gaze_origin = (gaze[:, GazeColumn.ORIGIN_LEFT] + gaze[:, GazeColumn.ORIGIN_RIGHT]) / 2
+
+    samples = GazeSamples(
+        x=(gaze2d[:, 0] * resolution[1]).astype(np.int64),
+        y=(gaze2d[:, 1] * resolution[0]).astype(np.int64),
+        depth=np.linalg.norm(gaze[:, GazeColumn.GAZE3D] - gaze_origin, axis=1),
+        timestamp=np.ascontiguousarray(gaze[:, GazeColumn.TIMESTAMP]),
+    )
+    if len(samples) > 1 and np.any(np.diff(samples.timestamp) < 0):
+        samples = samples[np.argsort(samples.timestamp, kind="stable")]
+    return samples
 
-    gaze_points = []
-    for data in gaze_data:
-        if data.gaze2d is None:
-            continue
 
-        gaze_depth = None
-        if data.gaze3d and data.eye_data_left and data.eye_data_right:
-            eyeleft = data.eye_data_left
-            eyeright = data.eye_data_right
+def load_frame_timestamps(video_path: Path) -> np.ndarray | None:
+    """The probed timestamp of every frame of a video, cached next to it."""
+    if not video_path.exists():
+        return None
 
-            # Calculate gaze origin as the average of both eyes' gaze origins
-            gaze_origin = (
-                np.add(eyeleft.origin, eyeright.origin) / 2
-                if (eyeleft and eyeright)
-                else eyeleft.origin
-                if eyeleft
-                else eyeright.origin
-            )
+    timestamps_path = frame_timestamps_path(video_path)
+    if (
+        timestamps_path.exists()
+        and timestamps_path.stat().st_mtime >= video_path.stat().st_mtime
+    ):
+        return np.load(timestamps_path)
 
-            # Calculate gaze depth as the distance from the gaze origin to the gaze point
-            gaze_depth = np.sqrt(np.sum((data.gaze3d - gaze_origin) ** 2, axis=0))
+    timestamps = probe_frame_timestamps(video_path)
+    if timestamps is not None:
+        np.save(timestamps_path, timestamps)
+    return timestamps
 
-        x = int(clamp(data.gaze2d[0], 0, 1) * resolution[1])
-        y = int(clamp(data.gaze2d[1], 0, 1) * resolution[0])
 
-        gaze_points.append(GazePoint(x, y, gaze_depth, data.timestamp))
+def get_frame_timestamps(video_path: Path, frame_count: int, fps: float) -> np.ndarray:
+    """
+    The start time of every frame plus the end of the last one, (frame_count + 1,).
+    Real timestamps are probed once and cached next to the video; without them,
+    or when they do not cover the frames, frames are assumed to be 1 / fps apart.
+    """
+    timestamps = load_frame_timestamps(video_path)
+    if timestamps is None or len(timestamps) < frame_count:
+        return np.arange(frame_count + 1, dtype=np.float64) / fps
 
-    return gaze_points
+    timestamps = timestamps[:frame_count]
+    frame_duration = np.median(np.diff(timestamps)) if frame_count > 1 else 1 / fps
+    end = timestamps[-1] + frame_duration if frame_count else 0.0
+    return np.append(timestamps, end)
 
 
-def match_frames_to_gaze(
-    frame_count: int, gaze_points: list[GazePoint], fps: float
-) -> list[list[GazePoint]]:
+def align_gaze_to_frames(
+    samples: GazeSamples, frame_timestamps: np.ndarray
+) -> FrameGazeAlignment:
     """
-    Match video frames to their corresponding gaze points.
-    The polling rate of gaze data is twice the fps of the video,
-    so there are max two gaze points per frame.
+    Bin time-ordered gaze samples into the frames they were recorded during.
+    Samples before the first frame count for it, as with a video that starts
+    a little late; samples after the end of the video are dropped.
+    """
+    frame_count = len(frame_timestamps) - 1
+    frame_idx = np.searchsorted(frame_timestamps, samples.timestamp, side="right") - 1
+    frame_idx = np.maximum(frame_idx, 0)
+
+    in_video = frame_idx < frame_count
+    samples = samples[in_video]
+    frame_idx = frame_idx[in_video]
+
+    # Samples are time ordered, so every frame's samples are contiguous
+    offsets = np.searchsorted(frame_idx, np.arange(frame_count + 1), side="left")
+    return FrameGazeAlignment(
+        samples=samples,
+        frame_idx=frame_idx,
+        offsets=offsets.astype(np.int64),
+        frame_timestamps=frame_timestamps,
+    )
 
-    Args:
-        num_frames (int): Number of video frames.
-        gaze_points (List[GazePoint]): List of gaze points sorted by timestamp.
-        fps (float): Frames per second of the video.
 
-    Returns:
-        List[FrameGazes]: List mapping each frame to its corresponding gaze points.
+def aggregate_gaze(
+    alignment: FrameGazeAlignment, method: str = GAZE_FRAME_AGGREGATE
+) -> np.ndarray:
     """
-    frame_gaze_mapping = []
-    gaze_index = 0
-
-    for frame_num in range(frame_count):
-        next_frame_timestamp = (frame_num + 1) / fps
-        frame_gazes = []
+    One gaze position per frame as a (frame_count, 2) float array of x, y,
+    NaN for frames without a gaze sample.
+    """
+    counts = alignment.counts
+    has_gaze = counts > 0
+    starts = alignment.offsets[:-1][has_gaze]
+    samples = alignment.samples
+    positions = np.full((alignment.frame_count, 2), np.nan)
+
+    if method == GazeAggregate.FIRST:
+        picked = starts
+    elif method == GazeAggregate.NEAREST_CENTRE:
+        centres = (alignment.frame_timestamps[:-1] + alignment.frame_timestamps[1:]) / 2
+        distance = np.abs(samples.timestamp - centres[alignment.frame_idx])
+        # Order by frame, then by distance, the first of every frame is the nearest
+        order = np.lexsort((distance, alignment.frame_idx))
+        picked = order[starts]
+    elif method == GazeAggregate.MEAN:
+        for axis, values in enumerate((samples.x, samples.y)):
+            sums = np.bincount(alignment.frame_idx, weights=values, minlength=alignment.frame_count)
+            positions[has_gaze, axis] = sums[has_gaze] / counts[has_gaze]
+        return positions
+    elif method == GazeAggregate.MEDIAN:
+        lower = starts + (counts[has_gaze] - 1) // 2
+        upper = starts + counts[has_gaze] // 2
+        for axis, values in enumerate((samples.x, samples.y)):
+            # Sort the values within every frame, the middle ones are the median
+            ordered = values[np.lexsort((values, alignment.frame_idx))]
+            positions[has_gaze, axis] = (ordered[lower] + ordered[upper]) / 2
+        return positions
+    else:
+        raise ValueError(f"Unknown gaze aggregate {method}")
+
+    positions[has_gaze, 0] = samples.x[picked]
+    positions[has_gaze, 1] = samples.y[picked]
+    return positions
+
+
+def get_frame_gaze_alignment(
+    recording_id: str,
+    frame_count: int,
+    resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
+    fps: float = TOBII_GLASSES_FPS,
+) -> FrameGazeAlignment:
+    gaze_data = load_gaze_columns(RECORDINGS_PATH / f"{recording_id}.tsv")
+    frame_timestamps = get_frame_timestamps(
+        RECORDINGS_PATH / f"{recording_id}.mp4", frame_count, fps
+    )
+    return align_gaze_to_frames(get_gaze_points(gaze_data, resolution), frame_timestamps)
 
-        while (
-            gaze_index < len(gaze_points)
-            and gaze_points[gaze_index].timestamp < next_frame_timestamp
-        ):
-            gaze_point = gaze_points[gaze_index]
-            frame_gazes.append(gaze_point)
-            gaze_index += 1
 
-        frame_gaze_mapping.append(frame_gazes)
+def get_gaze_position_per_frame(
+    recording_id: str,
+    frame_count: int,
+    resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
+    fps: float = TOBII_GLASSES_FPS,
+    method: str = GAZE_FRAME_AGGREGATE,
+) -> dict[int, tuple[int, int]]:
+    alignment = get_frame_gaze_alignment(recording_id, frame_count, resolution, fps)
+    positions = aggregate_gaze(alignment, method)
+
+    frame_indices = np.flatnonzero(~np.isnan(positions[:, 0]))
+    xs = positions[frame_indices, 0].astype(int).tolist()
+    ys = positions[frame_indices, 1].astype(int).tolist()
+    return {
+        frame_idx: (x, y)
+        for frame_idx, x, y in zip(frame_indices.tolist(), xs, ys)
+    }
 
-    for points in frame_gaze_mapping:
-        if len(points) >= 3:
-            print(
-                f"Warning: Detected {len(points)} gaze points for a frame in the video. This is unexpected."
-            )
 
-    return frame_gaze_mapping
+def mean_of_eyes(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """The mean of both eyes' vectors, or the one eye that was tracked; NaN without either."""
+    both = np.stack([left, right])
+    tracked = (~np.isnan(both)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(both, axis=0) / tracked
 
 
-def get_gaze_point_per_frame(
-    gaze_data_path: Path, resolution: tuple[int, int], frame_count: int, fps: float
-) -> dict[int, GazePoint]:
+def gaze_directions(gaze_data: GazeColumns) -> np.ndarray:
+    """
+    Unit gaze direction of every sample, (samples, 3): from the eyes to the
+    3D gaze point, or the mean eye direction without one. NaN when missing.
     """
-    Process gaze data and map frame indices to gaze points.
+    origin = mean_of_eyes(gaze_data.origin_left, gaze_data.origin_right)
+    directions = gaze_data.gaze3d - origin
+    eye_directions = mean_of_eyes(gaze_data.direction_left, gaze_data.direction_right)
+    directions = np.where(np.isnan(directions), eye_directions, directions)
 
-    Args:
-        gaze_data_path (Path): Path to the gaze data file.
-        resolution (tuple[int, int]): Video resolution as (height, width).
-        frame_count (int): Number of frames in the video.
-        fps (float): Frames per second of the video.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return directions / np.linalg.norm(directions, axis=1, keepdims=True)
 
-    Returns:
-        dict[int, GazePoint]: Dictionary mapping frame indices
-                              to their first valid gaze point.
+
+def true_runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The inclusive (starts, ends) indices of every run of True in a boolean array."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def ivt_fixation_samples(
+    directions: np.ndarray, timestamps: np.ndarray, velocity_threshold: float
+) -> np.ndarray:
+    """Samples whose angular velocity from the previous sample stays below the threshold."""
+    cosines = np.einsum("ij,ij->i", directions[1:], directions[:-1])
+    angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        velocities = angles / np.diff(timestamps)
+
+    # The first sample takes the velocity of the second, NaN compares False
+    velocities = np.concatenate([velocities[:1], velocities])
+    return velocities < velocity_threshold
+
+
+def idt_fixation_samples(
+    directions: np.ndarray,
+    timestamps: np.ndarray,
+    dispersion_threshold: float,
+    min_duration: float,
+) -> np.ndarray:
+    """
+    Samples covered by a window of min_duration whose horizontal plus vertical
+    spread stays below the threshold. Overlapping windows join into one
+    fixation, the same result as growing a window while its dispersion allows.
     """
-    gaze_data = parse_gazedata_file(gaze_data_path)
-    gaze_points = get_gaze_points(gaze_data, resolution)
-    frame_gaze_mapping = match_frames_to_gaze(
-        frame_count=frame_count, gaze_points=gaze_points, fps=fps
+    sample_count = len(timestamps)
+    interval = np.median(np.diff(timestamps)) if sample_count > 1 else min_duration
+    window = max(2, int(np.ceil(min_duration / interval)))
+    if sample_count < window:
+        return np.zeros(sample_count, dtype=bool)
+
+    azimuth = np.degrees(np.arctan2(directions[:, 0], directions[:, 2]))
+    elevation = np.degrees(np.arctan2(directions[:, 1], directions[:, 2]))
+    windows_azimuth = np.lib.stride_tricks.sliding_window_view(azimuth, window)
+    windows_elevation = np.lib.stride_tricks.sliding_window_view(elevation, window)
+    dispersion = (
+        windows_azimuth.max(axis=1) - windows_azimuth.min(axis=1)
+        + windows_elevation.max(axis=1) - windows_elevation.min(axis=1)
     )
+    window_starts = np.flatnonzero(dispersion <= dispersion_threshold)
+
+    # Mark every sample inside a qualifying window with a difference array
+    coverage = np.zeros(sample_count + 1, dtype=np.int64)
+    np.add.at(coverage, window_starts, 1)
+    np.add.at(coverage, window_starts + window, -1)
+    return np.cumsum(coverage[:-1]) > 0
 
-    gaze_point_per_frame = {
-        frame_idx: gaze_points[0]
-        for frame_idx, gaze_points in enumerate(frame_gaze_mapping)
-        if len(gaze_points) > 0
-    }
 
-    return gaze_point_per_frame
+def detect_fixations(
+    gaze_data: GazeColumns,
+    resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
+    algorithm: str = FIXATION_ALGORITHM,
+    threshold: float | None = None,
+    min_duration: float = FIXATION_MIN_DURATION,
+) -> Fixations:
+    """
+    Classify gaze samples as fixations with I-VT or I-DT and return every
+    fixation of at least min_duration with its centroid in video pixels.
+    Missing samples always end a fixation.
+    """
+    timestamps = gaze_data.timestamp
+    directions = gaze_directions(gaze_data)
+
+    if algorithm == FixationAlgorithm.IVT:
+        is_fixation = ivt_fixation_samples(
+            directions, timestamps, threshold or FIXATION_VELOCITY_THRESHOLD
+        )
+    elif algorithm == FixationAlgorithm.IDT:
+        is_fixation = idt_fixation_samples(
+            directions, timestamps, threshold or FIXATION_DISPERSION_THRESHOLD, min_duration
+        )
+    else:
+        raise ValueError(f"Unknown fixation algorithm {algorithm}")
+
+    is_fixation &= gaze_data.has_gaze & ~np.isnan(directions[:, 0])
+    starts, ends = true_runs(is_fixation)
+    long_enough = timestamps[ends] - timestamps[starts] >= min_duration
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    # Centroids from running sums, no loop over the fixations
+    gaze2d = np.nan_to_num(np.clip(gaze_data.gaze2d, 0, 1))
+    running_sums = np.concatenate([np.zeros((1, 2)), np.cumsum(gaze2d, axis=0)])
+    sample_counts = ends - starts + 1
+    centroids = (running_sums[ends + 1] - running_sums[starts]) / sample_counts[:, None]
+
+    return Fixations(
+        start=timestamps[starts],
+        end=timestamps[ends],
+        x=centroids[:, 0] * resolution[1],
+        y=centroids[:, 1] * resolution[0],
+        sample_count=sample_counts.astype(np.int64),
+    )
 
 
-def get_gaze_position_per_frame(
-    recording_id: str,
-    frame_count: int,
+def load_fixations(
+    gaze_data_path: Path,
     resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
-    fps: float = TOBII_GLASSES_FPS,
-) -> dict[int, tuple[int, int]]:
-    gaze_data_path = RECORDINGS_PATH / f"{recording_id}.tsv"
-    gaze_point_per_frame = get_gaze_point_per_frame(
-        gaze_data_path=gaze_data_path,
-        resolution=resolution,
-        frame_count=frame_count,
-        fps=fps,
+    algorithm: str = FIXATION_ALGORITHM,
+) -> Fixations:
+    """The fixations of a gaze data file, detected once and cached next to it."""
+    threshold = (
+        FIXATION_VELOCITY_THRESHOLD
+        if algorithm == FixationAlgorithm.IVT
+        else FIXATION_DISPERSION_THRESHOLD
+    )
+    cache_path = fixations_path(gaze_data_path, algorithm, threshold)
+    if cache_path.exists() and cache_path.stat().st_mtime >= gaze_data_path.stat().st_mtime:
+        return Fixations.from_array(np.load(cache_path))
+
+    fixations = detect_fixations(
+        load_gaze_columns(gaze_data_path), resolution, algorithm, threshold
+    )
+    np.save(cache_path, fixations.to_array())
+    return fixations
+
+
+def get_fixation_frames(
+    fixations: Fixations, frame_timestamps: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The (first, last, middle) frame of every fixation."""
+    frame_count = len(frame_timestamps) - 1
+
+    def to_frames(timestamps: np.ndarray) -> np.ndarray:
+        frames = np.searchsorted(frame_timestamps, timestamps, side="right") - 1
+        return np.clip(frames, 0, max(frame_count - 1, 0))
+
+    return (
+        to_frames(fixations.start),
+        to_frames(fixations.end),
+        to_frames(fixations.midpoint),
     )
-    gaze_position_per_frame = {
-        frame_idx: (gaze_point.x, gaze_point.y)
-        for frame_idx, gaze_point in gaze_point_per_frame.items()
-    }
-    return gaze_position_per_frame
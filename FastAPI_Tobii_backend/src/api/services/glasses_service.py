@@ -11,9 +11,17 @@ from src.api.exceptions import (
     NotFoundError,
     RecordingAlreadyExistsError,
 )
+from src.api.models.gaze import GazeColumns, gaze_columns_path
 from src.api.models.pydantic import RecordingDTO
 from src.api.repositories import recordings_repo
 from src.api.services import recordings_service
+from src.api.services.gaze_service import (
+    GazeDataStreamParser,
+    load_fixations,
+    load_frame_timestamps,
+    write_gaze_columns,
+)
+from src.api.services.heatmap_service import build_heatmaps
 from src.config import DEBUG_MODE, DEFAULT_GLASSES_HOSTNAME, RECORDINGS_PATH
 from src.utils import download_file
 
@@ -141,10 +149,13 @@ async def download_recording(
         video_path = recordings_path / f"{glasses_rec.uuid}.mp4"
         gaze_data_path = recordings_path / f"{glasses_rec.uuid}.tsv"
 
+        # The gaze data is parsed while it downloads, not again before an analysis
+        gaze_parser = GazeDataStreamParser()
         try:
             await download_file(scene_video_url, video_path)
-            await download_file(gaze_data_url, gaze_data_path)
+            await download_file(gaze_data_url, gaze_data_path, on_chunk=gaze_parser.feed)
         except Exception as e:
+            await asyncio.to_thread(gaze_parser.finish)
             # Clean up created files if there is an error
             video_path.unlink(missing_ok=True)
             gaze_data_path.unlink(missing_ok=True)
@@ -152,6 +163,9 @@ async def download_recording(
                 f"Failed to download recording {recording_id}: {e}"
             ) from e
 
+        gaze_columns = await asyncio.to_thread(gaze_parser.finish)
+        await asyncio.to_thread(precompute_gaze_data, video_path, gaze_data_path, gaze_columns)
+
         rec_dto = await RecordingDTO.from_glasses_recording(glasses_rec)
         recordings_repo.create(
             db=db,
@@ -161,3 +175,28 @@ async def download_recording(
             created=rec_dto.created.isoformat(),
             duration=rec_dto.duration,
         )
+
+
+def precompute_gaze_data(
+    video_path: Path, gaze_data_path: Path, gaze_columns: GazeColumns | None
+) -> None:
+    """
+    Write the columns sidecar, frame timestamps, fixations and heatmaps of a
+    downloaded recording. Whatever fails or was not parsed while downloading
+    is computed again when needed.
+    """
+    try:
+        load_frame_timestamps(video_path)
+        if gaze_columns is None:
+            return
+
+        write_gaze_columns(gaze_columns, gaze_columns_path(gaze_data_path))
+        fixations = load_fixations(gaze_data_path)
+        build_heatmaps(gaze_data_path)
+        print(
+            f"Precomputed {len(gaze_columns.data)} gaze samples and "
+            f"{len(fixations)} fixations of {gaze_data_path.stem}",
+            flush=True,
+        )
+    except Exception as e:
+        print(f"Failed to precompute gaze data of {gaze_data_path.stem}: {e}", flush=True)
@@ -0,0 +1,147 @@
+import json
+import math
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from src.api.models.gaze import GazeSamples, heatmaps_path
+from src.api.services.gaze_service import get_gaze_points, load_gaze_columns
+from src.config import (
+    HEATMAP_BUCKET_SECONDS,
+    HEATMAP_SHAPES,
+    RECORDINGS_PATH,
+    TOBII_GLASSES_RESOLUTION,
+)
+
+
+def bin_gaze_samples(
+    samples: GazeSamples,
+    resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
+    bucket_seconds: float = HEATMAP_BUCKET_SECONDS,
+    shapes: list[tuple[int, int]] = HEATMAP_SHAPES,
+) -> list[np.ndarray]:
+    """
+    Count gaze samples per time bucket and heatmap cell, one (buckets, rows, cols)
+    array per level. The finest level is binned with a single bincount, every
+    coarser level sums 2x2 blocks of the next finer one.
+    """
+    rows, cols = shapes[-1]
+    bucket_count = (
+        int(samples.timestamp.max() // bucket_seconds) + 1 if len(samples) else 0
+    )
+
+    buckets = np.clip(samples.timestamp // bucket_seconds, 0, None).astype(np.int64)
+    cell_rows = np.clip(samples.y * rows // resolution[0], 0, rows - 1)
+    cell_cols = np.clip(samples.x * cols // resolution[1], 0, cols - 1)
+    flat = (buckets * rows + cell_rows) * cols + cell_cols
+    counts = np.bincount(flat, minlength=bucket_count * rows * cols)
+    counts = counts.reshape(bucket_count, rows, cols)
+
+    levels = [counts]
+    for level_rows, level_cols in reversed(shapes[:-1]):
+        finer = levels[0]
+        factor_rows = finer.shape[1] // level_rows
+        factor_cols = finer.shape[2] // level_cols
+        levels.insert(
+            0,
+            finer.reshape(bucket_count, level_rows, factor_rows, level_cols, factor_cols).sum(
+                axis=(2, 4)
+            ),
+        )
+
+    # No cell holds more samples than its tile, 10 seconds of 50 Hz gaze fit in 16 bits
+    per_bucket = np.bincount(buckets, minlength=bucket_count)
+    dtype = np.uint16 if per_bucket.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+    return [level.astype(dtype) for level in levels]
+
+
+def build_heatmaps(
+    gaze_data_path: Path,
+    resolution: tuple[int, int] = TOBII_GLASSES_RESOLUTION,
+    bucket_seconds: float = HEATMAP_BUCKET_SECONDS,
+) -> None:
+    """Precompute the heatmap levels of a gaze data file into its heatmaps directory."""
+    samples = get_gaze_points(load_gaze_columns(gaze_data_path), resolution)
+    levels = bin_gaze_samples(samples, resolution, bucket_seconds)
+
+    # Concurrent first requests may build the same heatmaps, each in its own directory
+    target_path = heatmaps_path(gaze_data_path)
+    tmp_path = Path(tempfile.mkdtemp(prefix=target_path.name + ".tmp-", dir=target_path.parent))
+
+    for i, level in enumerate(levels):
+        np.save(tmp_path / f"level{i}.npy", level)
+    with (tmp_path / "meta.json").open("w") as f:
+        json.dump(
+            {
+                "bucket_seconds": bucket_seconds,
+                "bucket_count": int(levels[-1].shape[0]),
+                "shapes": [list(level.shape[1:]) for level in levels],
+            },
+            f,
+        )
+
+    if not heatmaps_are_current(gaze_data_path):
+        shutil.rmtree(target_path, ignore_errors=True)
+    try:
+        tmp_path.rename(target_path)
+    except OSError:
+        # Another build got there first, its heatmaps are just as good
+        if not heatmaps_are_current(gaze_data_path):
+            raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def heatmaps_are_current(gaze_data_path: Path) -> bool:
+    meta_path = heatmaps_path(gaze_data_path) / "meta.json"
+    return meta_path.exists() and meta_path.stat().st_mtime >= gaze_data_path.stat().st_mtime
+
+
+def get_heatmap(
+    recording_id: str,
+    start: float | None = None,
+    end: float | None = None,
+    level: int = len(HEATMAP_SHAPES) - 1,
+) -> dict[str, Any]:
+    """
+    Gaze counts per cell between start and end seconds, summed from the
+    precomputed tiles; the range is widened to whole tiles. The heatmaps are
+    built on the first request when they were not precomputed.
+    """
+    gaze_data_path = RECORDINGS_PATH / f"{recording_id}.tsv"
+    if not gaze_data_path.exists():
+        raise FileNotFoundError(f"File {gaze_data_path} does not exist")
+    if not heatmaps_are_current(gaze_data_path):
+        build_heatmaps(gaze_data_path)
+
+    directory = heatmaps_path(gaze_data_path)
+    with (directory / "meta.json").open() as f:
+        meta = json.load(f)
+    if not 0 <= level < len(meta["shapes"]):
+        raise ValueError(f"Heatmap level must be between 0 and {len(meta['shapes']) - 1}")
+
+    bucket_seconds = meta["bucket_seconds"]
+    first_bucket = max(0, math.floor((start or 0.0) / bucket_seconds))
+    last_bucket = (
+        meta["bucket_count"]
+        if end is None
+        else min(meta["bucket_count"], math.ceil(end / bucket_seconds))
+    )
+
+    # Only the tiles in the range are read from the memory-mapped level
+    tiles = np.load(directory / f"level{level}.npy", mmap_mode="r")
+    counts = tiles[first_bucket:last_bucket].sum(axis=0, dtype=np.uint32)
+    if last_bucket <= first_bucket:
+        counts = np.zeros(meta["shapes"][level], dtype=np.uint32)
+
+    return {
+        "rows": int(counts.shape[0]),
+        "cols": int(counts.shape[1]),
+        "start": first_bucket * bucket_seconds,
+        "end": max(first_bucket, last_bucket) * bucket_seconds,
+        "max": int(counts.max(initial=0)),
+        "counts": counts.tolist(),
+    }
@@ -0,0 +1,487 @@
+import asyncio
+import importlib
+import json
+import multiprocessing
+import shutil
+import threading
+import time
+import traceback
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any, Callable
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from src.api.db import SessionLocal
+from src.api.exceptions import JobCancelledError, JobStateError
+from src.api.models.jobs import (
+    JobEventType,
+    JobKind,
+    JobPriority,
+    JobStatus,
+    ResourceClass,
+)
+from src.api.models.pydantic import JobDTO
+from src.api.repositories import jobs_repo
+from src.config import (
+    JOB_CANCEL_CHECK_INTERVAL_SECONDS,
+    JOB_EVENT_HEARTBEAT_SECONDS,
+    JOB_EVENT_PROGRESS_INTERVAL_SECONDS,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_WATCHDOG_INTERVAL_SECONDS,
+    JOB_PROGRESS_INTERVAL_SECONDS,
+    JOB_WORKERS,
+    JOBS_PATH,
+    TRACKING_NODE_MEMORY_BYTES,
+)
+
+# Handlers are imported inside the workers only, so the API
+# process never loads the models they need
+JOB_HANDLERS: dict[str, str] = {
+    JobKind.ANALYSIS: "src.api.services.analysis_service:run_analysis_job",
+    JobKind.TRACKING: "src.api.services.labeling_service:run_tracking_job",
+    JobKind.HEAD_TRAINING: "src.api.services.classifier_service:run_head_training_job",
+}
+
+DEFAULT_RESOURCE_CLASSES: dict[str, str] = {
+    JobKind.ANALYSIS: ResourceClass.GPU,
+    JobKind.TRACKING: ResourceClass.GPU,
+    # Trains on stored embeddings only, no model is loaded
+    JobKind.HEAD_TRAINING: ResourceClass.CPU,
+}
+
+TERMINAL_EVENTS = {JobEventType.FINISHED, JobEventType.FAILED, JobEventType.CANCELLED}
+
+_workers: list[multiprocessing.Process] = []  # by ledger slot
+_worker_specs: list[tuple[str, str]] = []  # (resource class, worker id) by ledger slot
+_context = None
+_worker_event_queue = None  # API process only, the workers publish through _event_queue
+_stop_event = None
+_broker: "JobEventBroker | None" = None  # API process only
+_event_queue = None  # Set in the workers, carries their events to the API process
+_memory_ledger: "MemoryLedger | None" = None  # Shared by every worker process
+
+
+def publish(job_id: str, event_type: str, data: Any) -> None:
+    """Push an event of a job to the streams that follow it, a no-op outside the workers."""
+    if _event_queue is not None:
+        _event_queue.put({"job_id": job_id, "type": event_type, "data": data})
+
+
+class MemoryLedger:
+    """
+    Hands out shares of the node's memory so concurrent jobs cannot overcommit it.
+    Created before the workers are spawned and shared by all of them. Every
+    worker reserves in a slot of its own, so the reservations of a worker that
+    died can be released; the last slot belongs to the API process.
+    """
+
+    def __init__(self, capacity_bytes: int, slot_count: int = 1, context=multiprocessing) -> None:
+        self.capacity_bytes = capacity_bytes
+        self.slot = slot_count - 1  # set in every worker
+        self._reserved_bytes = context.Array("q", slot_count, lock=False)
+        self._condition = context.Condition()
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._reserved_bytes)
+
+    def reserve(self, nbytes: int) -> int:
+        """Block until nbytes are available, a job larger than the node gets all of it."""
+        nbytes = min(nbytes, self.capacity_bytes)
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.reserved_bytes + nbytes <= self.capacity_bytes
+            )
+            self._reserved_bytes[self.slot] += nbytes
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self._reserved_bytes[self.slot] -= nbytes
+            self._condition.notify_all()
+
+    def release_slot(self, slot: int) -> None:
+        """Release everything a worker reserved, when it died without releasing it."""
+        with self._condition:
+            self._reserved_bytes[slot] = 0
+            self._condition.notify_all()
+
+
+def get_memory_ledger() -> MemoryLedger:
+    """The workers' shared ledger, or one of this process alone outside the workers."""
+    global _memory_ledger
+
+    if _memory_ledger is None:
+        _memory_ledger = MemoryLedger(TRACKING_NODE_MEMORY_BYTES)
+    return _memory_ledger
+
+
+class JobEventBroker:
+    """Fans the events the workers publish out to the open event streams of the API process."""
+
+    def __init__(self, event_queue, loop: asyncio.AbstractEventLoop) -> None:
+        self.event_queue = event_queue
+        self.loop = loop
+        self.subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.event_queue.put(None)
+        self._thread.join(timeout=1.0)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        events: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self.subscribers.setdefault(job_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, job_id: str, events: asyncio.Queue) -> None:
+        with self._lock:
+            job_subscribers = self.subscribers.get(job_id, set())
+            job_subscribers.discard(events)
+            if not job_subscribers:
+                self.subscribers.pop(job_id, None)
+
+    def _dispatch(self) -> None:
+        while True:
+            event = self.event_queue.get()
+            if event is None:
+                return
+
+            with self._lock:
+                job_subscribers = list(self.subscribers.get(event["job_id"], ()))
+            for events in job_subscribers:
+                self.loop.call_soon_threadsafe(events.put_nowait, event)
+
+
+class JobContext:
+    """Handed to a job handler to report progress back to the queue and check for cancellation."""
+
+    def __init__(self, job_id: str) -> None:
+        self.job_id = job_id
+        self._last_report = 0.0
+        self._last_event = 0.0
+        self._last_cancel_check = 0.0
+        self._cancelled = False
+
+    @property
+    def work_path(self) -> Path:
+        """
+        A directory that survives cancellation and restarts, so a resumed
+        job can pick up its intermediate files. Removed when the job ends.
+        """
+        path = JOBS_PATH / self.job_id
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def publish(self, event_type: str, data: Any) -> None:
+        publish(self.job_id, event_type, data)
+
+    def is_cancelled(self) -> bool:
+        # Checked between propagated frames, so reads are throttled
+        now = time.time()
+        if self._cancelled or now - self._last_cancel_check < JOB_CANCEL_CHECK_INTERVAL_SECONDS:
+            return self._cancelled
+        self._last_cancel_check = now
+
+        with SessionLocal() as db:
+            self._cancelled = jobs_repo.is_cancel_requested(db, self.job_id)
+        return self._cancelled
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise JobCancelledError()
+
+    def report_progress(
+        self,
+        progress: float,
+        eta_seconds: float | None = None,
+        stage: str | None = None,
+        force: bool = False,
+    ) -> None:
+        # Progress is written from the tracking loop, so writes are throttled
+        now = time.time()
+        if force or now - self._last_event >= JOB_EVENT_PROGRESS_INTERVAL_SECONDS:
+            self._last_event = now
+            self.publish(
+                JobEventType.PROGRESS,
+                {"progress": progress, "eta_seconds": eta_seconds, "stage": stage},
+            )
+
+        if not force and now - self._last_report < JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_report = now
+
+        with SessionLocal() as db:
+            jobs_repo.update_progress(db, self.job_id, progress, eta_seconds)
+            db.commit()
+
+
+def submit(
+    db: Session,
+    kind: str,
+    payload: dict[str, Any],
+    priority: int = JobPriority.BULK,
+    resource_class: str | None = None,
+) -> JobDTO:
+    """Queue a job, it is picked up by the first free worker of its resource class."""
+    job = jobs_repo.create_job(
+        db=db,
+        kind=kind,
+        payload=payload,
+        resource_class=resource_class or DEFAULT_RESOURCE_CLASSES[kind],
+        priority=priority,
+    )
+    return JobDTO.from_orm(job)
+
+
+def get(db: Session, job_id: str) -> JobDTO:
+    return JobDTO.from_orm(jobs_repo.get_job(db, job_id))
+
+
+def is_active(job: JobDTO) -> bool:
+    return job.status in (JobStatus.QUEUED, JobStatus.RUNNING)
+
+
+def get_result(db: Session, job_id: str) -> Any | None:
+    job = jobs_repo.get_job(db, job_id)
+    if job.result_json is None:
+        return None
+    return json.loads(job.result_json)
+
+
+def cancel(db: Session, job_id: str) -> JobDTO:
+    """
+    Cancel a job. A queued job is cancelled right away, a running job stops
+    at its next cancellation check and keeps its checkpoint for a resume.
+    """
+    job = jobs_repo.get_job(db, job_id)
+    if job.status == JobStatus.QUEUED:
+        jobs_repo.cancel_job(db, job_id)
+    elif job.status == JobStatus.RUNNING:
+        jobs_repo.request_cancel(db, job_id)
+    else:
+        raise JobStateError(f"Job {job_id} is {job.status} and cannot be cancelled")
+
+    db.flush()
+    db.refresh(job)
+    return JobDTO.from_orm(job)
+
+
+def resume(db: Session, job_id: str) -> JobDTO:
+    """Queue a cancelled or failed job again, it continues from its last checkpoint."""
+    job = jobs_repo.get_job(db, job_id)
+    if job.status not in (JobStatus.CANCELLED, JobStatus.FAILED):
+        raise JobStateError(f"Job {job_id} is {job.status} and cannot be resumed")
+
+    jobs_repo.requeue_job(db, job_id)
+    db.flush()
+    db.refresh(job)
+    return JobDTO.from_orm(job)
+
+
+def get_status(job_id: str) -> tuple[JobDTO, Any | None]:
+    """A job and its result, read in a session of its own."""
+    with SessionLocal() as db:
+        return get(db, job_id), get_result(db, job_id)
+
+
+def format_event(event_type: str, data: Any) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(job_id: str) -> AsyncGenerator[str, None]:
+    """
+    Server-sent events of a job: its current status first, then progress and
+    tracking segments as the worker pushes them, and finally the result.
+    The job must exist, check it before the response starts.
+    """
+    events = _broker.subscribe(job_id)
+    try:
+        # Subscribed before reading the status, so no event can fall in between
+        job, result = await run_in_threadpool(get_status, job_id)
+
+        yield format_event(JobEventType.STATUS, job.model_dump())
+        if job.status == JobStatus.FINISHED:
+            yield format_event(JobEventType.FINISHED, result)
+            return
+        if job.status == JobStatus.FAILED:
+            yield format_event(JobEventType.FAILED, {"error": job.error})
+            return
+        if job.status == JobStatus.CANCELLED:
+            yield format_event(JobEventType.CANCELLED, {})
+            return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), JOB_EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+
+            yield format_event(event["type"], event["data"])
+            if event["type"] in TERMINAL_EVENTS:
+                return
+    finally:
+        _broker.unsubscribe(job_id, events)
+
+
+def resolve_handler(kind: str) -> Callable[[dict[str, Any], JobContext], Any]:
+    module_name, function_name = JOB_HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_job(db: Session, job_id: str) -> None:
+    job = jobs_repo.get_job(db, job_id)
+    payload = job.payload_json
+    kind = job.kind
+    print(f"Job {job_id} ({kind}) started", flush=True)
+    publish(job_id, JobEventType.STATUS, JobDTO.from_orm(job).model_dump())
+
+    try:
+        handler = resolve_handler(kind)
+        result = handler(json.loads(payload), JobContext(job_id))
+    except JobCancelledError:
+        db.rollback()
+        jobs_repo.cancel_job(db, job_id)
+        db.commit()
+        publish(job_id, JobEventType.CANCELLED, {})
+        print(f"Job {job_id} ({kind}) cancelled", flush=True)
+    except Exception:
+        traceback.print_exc()
+        db.rollback()
+        error = traceback.format_exc(limit=5)
+        jobs_repo.fail_job(db, job_id, error)
+        db.commit()
+        publish(job_id, JobEventType.FAILED, {"error": error})
+        print(f"Job {job_id} ({kind}) failed", flush=True)
+    else:
+        jobs_repo.finish_job(db, job_id, result)
+        db.commit()
+        publish(job_id, JobEventType.FINISHED, result)
+        shutil.rmtree(JOBS_PATH / job_id, ignore_errors=True)
+        print(f"Job {job_id} ({kind}) finished", flush=True)
+
+
+def worker_main(
+    resource_class: str, worker_id: str, slot: int, stop_event, event_queue, memory_ledger
+) -> None:
+    """Entry point of a worker process, runs queued jobs until it is stopped."""
+    global _event_queue, _memory_ledger
+
+    _event_queue = event_queue
+    _memory_ledger = memory_ledger
+    _memory_ledger.slot = slot
+    print(f"Worker {worker_id} started", flush=True)
+    while not stop_event.is_set():
+        with SessionLocal() as db:
+            job = jobs_repo.claim_next_job(db, resource_class, worker_id)
+            if job is None:
+                stop_event.wait(JOB_POLL_INTERVAL_SECONDS)
+                continue
+            run_job(db, job.id)
+
+
+def requeue_interrupted_jobs(db: Session) -> None:
+    requeued = jobs_repo.requeue_interrupted_jobs(db)
+    if requeued:
+        print(f"Requeued {requeued} interrupted job(s)", flush=True)
+
+
+def spawn_worker(slot: int) -> multiprocessing.Process:
+    resource_class, worker_id = _worker_specs[slot]
+    worker = _context.Process(
+        target=worker_main,
+        args=(
+            resource_class,
+            worker_id,
+            slot,
+            _stop_event,
+            _worker_event_queue,
+            _memory_ledger,
+        ),
+        daemon=True,
+    )
+    worker.start()
+    return worker
+
+
+def replace_dead_workers() -> None:
+    """
+    Fail the job of every worker that died while running it, e.g. killed for
+    running out of memory, release its memory and start a new worker in its place.
+    Its job is failed, not requeued, as it would likely take the new worker down too.
+    """
+    for slot, worker in enumerate(_workers):
+        if worker.is_alive() or _stop_event.is_set():
+            continue
+
+        _, worker_id = _worker_specs[slot]
+        error = f"Worker {worker_id} died with exit code {worker.exitcode}"
+        with SessionLocal() as db:
+            job_ids = jobs_repo.fail_worker_jobs(db, worker_id, error)
+            db.commit()
+        for job_id in job_ids:
+            _worker_event_queue.put(
+                {"job_id": job_id, "type": JobEventType.FAILED, "data": {"error": error}}
+            )
+
+        _memory_ledger.release_slot(slot)
+        _workers[slot] = spawn_worker(slot)
+        print(f"{error}, failed job(s) {job_ids} and restarted it", flush=True)
+
+
+def watch_workers() -> None:
+    while not _stop_event.wait(JOB_WATCHDOG_INTERVAL_SECONDS):
+        try:
+            replace_dead_workers()
+        except Exception:
+            traceback.print_exc()
+
+
+def start_workers(
+    loop: asyncio.AbstractEventLoop, workers: dict[str, int] = JOB_WORKERS
+) -> None:
+    global _context, _stop_event, _worker_event_queue, _memory_ledger, _broker
+
+    # CUDA cannot be used in forked processes
+    _context = multiprocessing.get_context("spawn")
+    _stop_event = _context.Event()
+    _worker_event_queue = _context.Queue()
+    _broker = JobEventBroker(_worker_event_queue, loop)
+    _broker.start()
+
+    _worker_specs.extend(
+        (resource_class, f"{resource_class}-{i}")
+        for resource_class, count in workers.items()
+        for i in range(count)
+    )
+    _memory_ledger = MemoryLedger(
+        TRACKING_NODE_MEMORY_BYTES, len(_worker_specs) + 1, _context
+    )
+    _workers.extend(spawn_worker(slot) for slot in range(len(_worker_specs)))
+
+    threading.Thread(target=watch_workers, daemon=True).start()
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    """Stop the workers, a running job is interrupted and requeued on the next start."""
+    if _stop_event is not None:
+        _stop_event.set()
+
+    for worker in _workers:
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.terminate()
+
+    _workers.clear()
+    _worker_specs.clear()
+    if _broker is not None:
+        _broker.stop()
+
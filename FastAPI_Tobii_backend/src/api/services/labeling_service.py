@@ -1,8 +1,14 @@
+import bisect
+import json
+import os
+import queue
 import shutil
 import tempfile
 import threading
-from collections.abc import Generator
+from collections.abc import Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 
 import numpy as np
 import torch
@@ -11,12 +17,32 @@ from sqlalchemy.orm import Session
 from torchvision.ops import masks_to_boxes
 
 from src.aliases import UInt8Array
-from src.api.models.pydantic import AnnotationDTO, CalibrationRecordingDTO, SAMAnnotationDTO
-from src.api.repositories import classes_repo
-from src.api.services import annotations_service, sam2_service
+from src.api.exceptions import JobCancelledError, NotFoundError
+from src.api.models.jobs import JobEventType, JobKind, JobPriority
+from src.api.models.pydantic import (
+    AnnotationDTO,
+    CalibrationRecordingDTO,
+    JobDTO,
+    SAMAnnotationDTO,
+    SAMPointDTO,
+)
+from src.api.models.tracking import MaskObservation, StatePlacement, TrackingSpan
+from src.api.repositories import annotations_repo, classes_repo
+from src.api.services import annotations_service, jobs_service, sam2_service
+from src.api.services.jobs_service import JobContext
+from src.api.services.tracking_policies import (
+    ConfidenceTerminationPolicy,
+    TerminationPolicy,
+)
 from ..utils import image_utils
 import time
-from src.config import MAX_INFERENCE_STATE_FRAMES
+from src.config import (
+    MAX_CONCURRENT_TRACKING_SPANS,
+    MAX_INFERENCE_STATE_FRAMES,
+    TRACKING_MEMORY_BUDGET_BYTES,
+    TRACKING_CHECKPOINT_INTERVAL_FRAMES,
+    TRACKING_STRIDE_DRIFT_IOU,
+)
 
 from src.config import (
     TRACKING_RESULTS_PATH,
@@ -25,8 +51,16 @@ from src.config import (
 from src.utils import extract_frames_to_dir, get_frame_from_dir
 
 
+# Tracking jobs running in this process, CUDA's peak memory statistic covers all of them
+_ACTIVE_TRACKING_JOBS: set["TrackingJob"] = set()
+_ACTIVE_TRACKING_LOCK = threading.Lock()
+
+
 class TrackingJob:
     GRACE_PERIOD: int = 25  # Number of frames to wait before considering a tracking loss
+    # Prompts and spans behind a class' results, readers of the folder glob for *.npz
+    MANIFEST_FILENAME: str = "manifest.json"
+    CHECKPOINT_VERSION: int = 1
     progress: float = 0.0
     eta_seconds: float | None = None
 
@@ -38,6 +72,18 @@ class TrackingJob:
         results_path: Path,
         frame_count: int,
         remove_previous_results: bool = True,
+        incremental: bool = False,
+        max_concurrent_spans: int = MAX_CONCURRENT_TRACKING_SPANS,
+        frame_stride: int = 1,
+        drift_iou_threshold: float = TRACKING_STRIDE_DRIFT_IOU,
+        termination_policy: TerminationPolicy | None = None,
+        memory_budget_bytes: int = TRACKING_MEMORY_BUDGET_BYTES,
+        progress_callback: Callable[[float, float | None], None] | None = None,
+        should_cancel: Callable[[], bool] | None = None,
+        segments_callback: Callable[[TrackingSpan, dict[int, list[tuple[int, int]]]], None]
+        | None = None,
+        checkpoint_path: Path | None = None,
+        checkpoint_interval: int = TRACKING_CHECKPOINT_INTERVAL_FRAMES,
     ) -> None:
         self.annotations = sorted(annotations, key=lambda x: x.frame_idx)
         self.frames_path = frames_path
@@ -45,39 +91,105 @@ class TrackingJob:
         self.frame_count = frame_count
         self.video_path = video_path 
         self.remove_previous_results = remove_previous_results
+        self.incremental = incremental and not remove_previous_results
+        self.max_concurrent_spans = max_concurrent_spans
+        self.frame_stride = max(1, frame_stride)
+        self.drift_iou_threshold = drift_iou_threshold
+        self.termination_policy = termination_policy or ConfidenceTerminationPolicy()
+        self.memory_budget_bytes = memory_budget_bytes
+        self.progress_callback = progress_callback
+        self.should_cancel = should_cancel
+        self.segments_callback = segments_callback
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.span_progress: dict[TrackingSpan, dict[str, Any]] = {}
+        self.resumed_frames = 0
+        self._frames_at_checkpoint = 0
+        self._checkpoint_lock = threading.Lock()
+        self.placement: str | None = None
+        self.reserved_bytes = 0
+        self.peak_memory_bytes: int | None = None
+        self.exclusive_peak = False  # no other job ran here since the peak was reset
+        self.spill_path: Path | None = None
+        self.estimated_bytes = 0
+        self.video_predictor = None
+        self.inference_state: dict[str, Any] | None = None
+        self._full_inference_state: dict[str, Any] | None = None
+        self.keyframes = list(range(frame_count))
+        self.keyframes_path: Path | None = None
         self.tracked_frames = 0
-        self.total_frames_to_track = frame_count * 2
+        self.total_frames_to_track = frame_count
         self.start_time = None
-    def run(self) -> int:
-        self.initialize()
-        self.start_time = time.time()
-        total_frames_tracked = 0
+        self._progress_lock = threading.Lock()
 
-        # forward pass
-        for _ in self.track_until_loss(0, reverse=False):
-            total_frames_tracked += 1
+    @property
+    def class_ids(self) -> set[int]:
+        return {a.simroom_class_id for a in self.annotations}
 
-        # backward pass
-        actual_last_frame = self.inference_state["images"].shape[0] - 1
-        for _ in self.track_until_loss(actual_last_frame, reverse=True):
-            total_frames_tracked += 1
+    def run(self) -> int:
+        self.prepare_results()
 
-        self.teardown()
+        checkpoint = self.load_checkpoint()
+        if checkpoint is not None:
+            spans = self.restore_checkpoint(checkpoint)
+            print(f"Resuming tracking after {self.resumed_frames} frames", flush=True)
+        else:
+            spans = self.schedule_spans()
+            if not spans:
+                self.progress = 1.0
+                return 0
+
+            self.clear_span_results(spans)
+            self.span_progress = {span: self.new_span_progress(span) for span in spans}
+            # From here on a resume must not clear the results again
+            self.write_checkpoint()
+
+        # Spans never overlap, so they can be tracked independently. Every
+        # worker needs its own inference state because propagation mutates it.
+        workers = max(1, min(self.max_concurrent_spans, len(spans)))
+        inference_states: queue.Queue[dict[str, Any]] = queue.Queue()
+
+        def span_runner(span: TrackingSpan) -> int:
+            inference_state = inference_states.get()
+            try:
+                return self.track_span(inference_state, span)
+            finally:
+                inference_states.put(inference_state)
+
+        try:
+            self.initialize(state_count=workers)
+            self.start_time = time.time()
+            self.total_frames_to_track = sum(span.frame_count for span in spans)
+
+            inference_states.put(self.inference_state)
+            for _ in range(workers - 1):
+                inference_states.put(self.init_inference_state())
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                total_frames_tracked = sum(executor.map(span_runner, spans))
+
+            if self.frame_stride > 1:
+                self.fill_stride_gaps()
+                # Interpolation closed the gaps between the keyframe tracks
+                for span in spans:
+                    self.publish_span_tracks(span)
+
+            self.write_manifests(spans)
+            self.termination_policy.log_summary()
+            if self.checkpoint_path is not None:
+                self.checkpoint_path.unlink(missing_ok=True)
+        except JobCancelledError:
+            self.write_checkpoint()
+            raise
+        finally:
+            # Drop the worker states before releasing their memory
+            while not inference_states.empty():
+                inference_states.get()
+            self.teardown()
 
         return total_frames_tracked
 
-    def initialize(self) -> None:
-        # Load the video predictor and initialize the inference state
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        # 1. Laad predictor
-        self.video_predictor = sam2_service.load_video_predictor(
-            Sam2Checkpoints.SMALL,
-            max_inference_state_frames=MAX_INFERENCE_STATE_FRAMES
-        )
-
-        # 2. Initialiseer inference state
-        self.inference_state = self.video_predictor.init_state(video_path=str(self.video_path))
-        self.inference_state["images"] = self.inference_state["images"].to(device)
+    def prepare_results(self) -> None:
         # Remove the results directory if it already exists
         if self.results_path.exists() and self.remove_previous_results:
             shutil.rmtree(self.results_path)
@@ -95,6 +207,103 @@ class TrackingJob:
             folder.mkdir(parents=True, exist_ok=True)
             self.class_folders[obj_id] = folder
 
+        self.manifests = {
+            class_id: self.load_manifest(class_id) for class_id in self.class_folders
+        }
+        self.span_ranges: dict[TrackingSpan, tuple[int, int]] = {}
+        self.written_frames: dict[int, set[int]] = {
+            class_id: set() for class_id in self.class_folders
+        }
+
+    def initialize(self, state_count: int = 1) -> None:
+        # 1. Laad predictor
+        self.video_predictor = sam2_service.load_video_predictor(
+            Sam2Checkpoints.SMALL,
+            max_inference_state_frames=MAX_INFERENCE_STATE_FRAMES
+        )
+        with _ACTIVE_TRACKING_LOCK:
+            for other in _ACTIVE_TRACKING_JOBS:
+                other.exclusive_peak = False
+            self.exclusive_peak = not _ACTIVE_TRACKING_JOBS
+            _ACTIVE_TRACKING_JOBS.add(self)
+            if torch.cuda.is_available() and self.exclusive_peak:
+                torch.cuda.reset_peak_memory_stats()
+
+        # In stride mode SAM2 only sees every k-th frame plus the prompted ones
+        if self.frame_stride > 1:
+            prompt_frames = {a.frame_idx for a in self.annotations}
+            self.keyframes = sorted(
+                set(range(0, self.frame_count, self.frame_stride))
+                | prompt_frames
+                | {self.frame_count - 1}
+            )
+            self.keyframes_path = self.link_keyframes()
+
+        self.choose_placement(state_count)
+        self.reserved_bytes = jobs_service.get_memory_ledger().reserve(self.estimated_bytes)
+
+        # 2. Initialiseer inference state
+        self.inference_state = self.init_inference_state()
+
+    def link_keyframes(self) -> Path:
+        """Expose the keyframes as a consecutively numbered JPEG folder for SAM2."""
+        keyframes_path = Path(tempfile.mkdtemp())
+        for state_frame_idx, frame_idx in enumerate(self.keyframes):
+            source = self.frames_path / f"{frame_idx:05}.jpg"
+            target = keyframes_path / f"{state_frame_idx:05}.jpg"
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy(source, target)
+        return keyframes_path
+
+    def choose_placement(self, state_count: int) -> None:
+        """
+        Keep everything on the compute device when the inference states fit both
+        the budget and the free device memory, offload them to the CPU when they
+        only fit the budget, and otherwise spill the frames to a memory-mapped file.
+        """
+        frame_bytes, output_bytes = sam2_service.estimate_state_bytes(
+            self.video_predictor, len(self.keyframes), len(self.class_ids)
+        )
+        total_bytes = state_count * (frame_bytes + output_bytes)
+
+        device_free_bytes = (
+            torch.cuda.mem_get_info()[0] if torch.cuda.is_available() else 0
+        )
+        if torch.cuda.is_available() and total_bytes <= min(
+            self.memory_budget_bytes, device_free_bytes
+        ):
+            self.placement = StatePlacement.DEVICE
+        elif total_bytes <= self.memory_budget_bytes:
+            self.placement = StatePlacement.CPU
+        else:
+            self.placement = StatePlacement.MMAP
+            self.spill_path = Path(tempfile.mkdtemp())
+            total_bytes = state_count * output_bytes
+
+        self.estimated_bytes = total_bytes
+        print(
+            f"Tracking {len(self.keyframes)} frames with state on {self.placement}, "
+            f"estimated {total_bytes / 1024**2:.0f} MiB "
+            f"(budget {self.memory_budget_bytes / 1024**2:.0f} MiB)",
+            flush=True,
+        )
+
+    def state_frame_idx(self, frame_idx: int) -> int:
+        """Index of the last keyframe at or before frame_idx in the inference state."""
+        return bisect.bisect_right(self.keyframes, frame_idx) - 1
+
+    def init_inference_state(self) -> dict[str, Any]:
+        """Create an inference state for the video with all prompts registered."""
+        inference_state = self.new_inference_state(
+            self.keyframes_path or self.video_path,
+            self.keyframes_path or self.frames_path,
+        )
+        self.register_prompts(inference_state)
+        return inference_state
+
+    def register_prompts(self, inference_state: dict[str, Any]) -> None:
         # Add the initial points to the video predictor
         for annotation in self.annotations:
             point_labels = annotation.point_labels
@@ -103,26 +312,452 @@ class TrackingJob:
             ]
             labels = [point_label.label for point_label in point_labels]
             self.video_predictor.add_new_points(
-                inference_state=self.inference_state,
-                frame_idx=annotation.frame_idx,
+                inference_state=inference_state,
+                frame_idx=self.state_frame_idx(annotation.frame_idx),
                 obj_id=annotation.simroom_class_id,
                 points=points,
                 labels=labels,
             )
 
+    @property
+    def termination_stats(self) -> dict[int, dict[str, Any]]:
+        return {
+            class_id: stats.summary()
+            for class_id, stats in self.termination_policy.class_stats.items()
+        }
+
+    def new_inference_state(self, video_path: Path, frames_path: Path) -> dict[str, Any]:
+        spill_file = None
+        if self.spill_path is not None:
+            spill_file = self.spill_path / f"{len(list(self.spill_path.iterdir()))}.npy"
+
+        return sam2_service.init_state(
+            self.video_predictor,
+            video_path,
+            placement=self.placement,
+            frames_path=frames_path,
+            spill_path=spill_file,
+        )
+
     def teardown(self) -> None:
-        del self.video_predictor
+        with _ACTIVE_TRACKING_LOCK:
+            _ACTIVE_TRACKING_JOBS.discard(self)
+
+        # Concurrent jobs share the peak, then only the estimate is this job's own
+        if (
+            torch.cuda.is_available()
+            and self.placement == StatePlacement.DEVICE
+            and self.exclusive_peak
+        ):
+            self.peak_memory_bytes = torch.cuda.max_memory_allocated()
+        else:
+            self.peak_memory_bytes = self.estimated_bytes
+        print(
+            f"Tracking peak memory: {self.peak_memory_bytes / 1024**2:.0f} MiB "
+            f"({self.placement})",
+            flush=True,
+        )
+
+        self.video_predictor = None
+        self.inference_state = None
+        self._full_inference_state = None
+        jobs_service.get_memory_ledger().release(self.reserved_bytes)
+        self.reserved_bytes = 0
+
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
 
+        if self.keyframes_path is not None:
+            shutil.rmtree(self.keyframes_path, ignore_errors=True)
 
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
             torch.cuda.synchronize()
 
+    def schedule_spans(self) -> list[TrackingSpan]:
+        """
+        Split the video into spans around the prompted frames. The frames
+        before the first prompt are tracked backward from it, the frames after
+        the last prompt forward from it, and every gap between two prompts is
+        tracked from both of its ends.
+        """
+        prompt_frames = sorted({a.frame_idx for a in self.annotations})
+        if not prompt_frames:
+            return []
+
+        last_frame_idx = self.frame_count - 1
+        spans = []
+
+        if prompt_frames[0] > 0:
+            spans.append(TrackingSpan(0, prompt_frames[0], False, True))
+
+        for start, end in zip(prompt_frames, prompt_frames[1:]):
+            spans.append(TrackingSpan(start, end, True, True))
+
+        spans.append(TrackingSpan(prompt_frames[-1], last_frame_idx, True, False))
+
+        changed_frames = self.changed_prompt_frames() if self.incremental else None
+        if changed_frames is None:
+            return spans
+
+        # Only the spans around an added, edited or deleted prompt are re-tracked
+        return [
+            span
+            for span in spans
+            if any(span.start_frame_idx <= f <= span.end_frame_idx for f in changed_frames)
+        ]
+
+    def prompt_signatures(self, class_id: int) -> dict[int, str]:
+        """Map each prompted frame of a class to a fingerprint of its point labels."""
+        return {
+            a.frame_idx: json.dumps(
+                sorted((pl.x, pl.y, pl.label) for pl in a.point_labels)
+            )
+            for a in self.annotations
+            if a.simroom_class_id == class_id
+        }
+
+    def changed_prompt_frames(self) -> set[int] | None:
+        """
+        Compare the current prompts against the ones stored in the manifests.
+        Returns None when a class has no manifest and must be tracked in full.
+        """
+        changed_frames = set()
+        for class_id, manifest in self.manifests.items():
+            if manifest is None:
+                return None
+
+            previous = {int(f): sig for f, sig in manifest["prompts"].items()}
+            current = self.prompt_signatures(class_id)
+            changed_frames |= {
+                f for f in previous.keys() | current.keys()
+                if previous.get(f) != current.get(f)
+            }
+
+        return changed_frames
+
+    def load_manifest(self, class_id: int) -> dict[str, Any] | None:
+        manifest_path = self.class_folders[class_id] / self.MANIFEST_FILENAME
+        if not manifest_path.exists():
+            return None
+
+        with manifest_path.open(encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_manifests(self, spans: list[TrackingSpan]) -> None:
+        """
+        Record which span, anchored by which prompts, produced which frame range.
+        Spans that were not re-tracked keep their previous entry.
+        """
+        new_records = [
+            {
+                "start_frame_idx": span.start_frame_idx,
+                "end_frame_idx": span.end_frame_idx,
+                "forward_anchor": span.forward_anchor,
+                "backward_anchor": span.backward_anchor,
+                "tracked_frames": self.span_ranges.get(span),
+            }
+            for span in spans
+        ]
+
+        for class_id, folder in self.class_folders.items():
+            manifest = self.manifests[class_id] if self.incremental else None
+            kept_records = [
+                record
+                for record in (manifest["spans"] if manifest else [])
+                if not any(
+                    span.overlaps(
+                        TrackingSpan(
+                            record["start_frame_idx"],
+                            record["end_frame_idx"],
+                            record["forward_anchor"],
+                            record["backward_anchor"],
+                        )
+                    )
+                    for span in spans
+                )
+            ]
+
+            manifest = {
+                "prompts": self.prompt_signatures(class_id),
+                "spans": sorted(
+                    kept_records + new_records, key=lambda r: r["start_frame_idx"]
+                ),
+            }
+            with (folder / self.MANIFEST_FILENAME).open("w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=4)
+
+    def clear_span_results(self, spans: list[TrackingSpan]) -> None:
+        """Remove the stored results of the frames the given spans will re-track."""
+        for folder in self.class_folders.values():
+            for result_path in folder.glob("*.npz"):
+                frame_idx = int(result_path.stem)
+                if any(
+                    span.owned_frames[0] <= frame_idx <= span.owned_frames[1]
+                    for span in spans
+                ):
+                    result_path.unlink()
+
+    def track_span(self, inference_state: dict[str, Any], span: TrackingSpan) -> int:
+        """
+        Track a single span. The forward pass stops at the next prompt or on
+        tracking loss; the backward pass then only covers the frames after the
+        last mask the forward pass found. A pass that was interrupted by a
+        cancellation or restart continues from its checkpointed frame.
+        """
+        progress = self.span_progress[span]
+        frames_tracked = 0
+
+        if not progress["forward_done"]:
+            start_frame_idx = None
+            if progress["forward_frame_idx"] is not None:
+                start_frame_idx = self.reseed(
+                    inference_state, span, progress["forward_frame_idx"], reverse=False
+                )
+
+            # The prompt at the end of the span is tracked by the next span
+            start_state_idx = self.state_frame_idx(
+                span.start_frame_idx if start_frame_idx is None else start_frame_idx
+            )
+            last_state_idx = self.state_frame_idx(span.owned_frames[1])
+            for frame_idx, mask_found in self.track_until_loss(
+                inference_state,
+                start_state_idx,
+                max_frame_num_to_track=last_state_idx - start_state_idx,
+                frame_indices=self.keyframes,
+            ):
+                frames_tracked += 1
+                self.record_span_progress(span, "forward", frame_idx, mask_found)
+
+            progress["forward_done"] = True
+            if start_frame_idx is not None:
+                self.restore_prompts(inference_state)
+
+        first_uncovered_frame = progress["first_uncovered_frame"]
+        if not progress["backward_done"] and first_uncovered_frame < span.end_frame_idx:
+            end_frame_idx = None
+            if progress["backward_frame_idx"] is not None:
+                end_frame_idx = self.reseed(
+                    inference_state, span, progress["backward_frame_idx"], reverse=True
+                )
+
+            end_state_idx = self.state_frame_idx(
+                span.end_frame_idx if end_frame_idx is None else end_frame_idx
+            )
+            first_state_idx = bisect.bisect_left(self.keyframes, first_uncovered_frame)
+            if end_state_idx >= first_state_idx:
+                for frame_idx, mask_found in self.track_until_loss(
+                    inference_state,
+                    end_state_idx,
+                    reverse=True,
+                    max_frame_num_to_track=end_state_idx - first_state_idx,
+                    frame_indices=self.keyframes,
+                ):
+                    frames_tracked += 1
+                    self.record_span_progress(span, "backward", frame_idx, mask_found)
+
+            if end_frame_idx is not None:
+                self.restore_prompts(inference_state)
+
+        progress["backward_done"] = True
+
+        first_tracked, last_tracked = progress["tracked_range"]
+        if first_tracked <= last_tracked:
+            self.span_ranges[span] = (first_tracked, last_tracked)
+
+        self.publish_span_tracks(span)
+        return frames_tracked
+
+    def publish_span_tracks(self, span: TrackingSpan) -> None:
+        """Hand the tracks of every class within a finished span to segments_callback."""
+        if self.segments_callback is None:
+            return
+
+        first, last = span.owned_frames
+        with self._checkpoint_lock:
+            tracks = {
+                class_id: annotations_repo.frames_to_tracks(
+                    f for f in written_frames if first <= f <= last
+                )
+                for class_id, written_frames in self.written_frames.items()
+            }
+        self.segments_callback(span, tracks)
+
+    @staticmethod
+    def new_span_progress(span: TrackingSpan) -> dict[str, Any]:
+        """The checkpointed state of a span's forward and backward pass."""
+        return {
+            "forward_done": not span.forward_anchor,
+            "forward_frame_idx": None,  # last frame the pass got through
+            "backward_done": not span.backward_anchor,
+            "backward_frame_idx": None,
+            "first_uncovered_frame": span.start_frame_idx,
+            "tracked_range": [span.end_frame_idx, span.start_frame_idx],
+        }
+
+    def record_span_progress(
+        self, span: TrackingSpan, direction: str, frame_idx: int, mask_found: bool
+    ) -> None:
+        with self._checkpoint_lock:
+            progress = self.span_progress[span]
+            progress[f"{direction}_frame_idx"] = frame_idx
+            if mask_found:
+                if direction == "forward":
+                    progress["first_uncovered_frame"] = frame_idx + 1
+                first_tracked, last_tracked = progress["tracked_range"]
+                progress["tracked_range"] = [
+                    min(first_tracked, frame_idx),
+                    max(last_tracked, frame_idx),
+                ]
+            checkpoint_due = (
+                self.tracked_frames - self._frames_at_checkpoint >= self.checkpoint_interval
+            )
+
+        if checkpoint_due:
+            self.write_checkpoint()
+
+    def reseed(
+        self,
+        inference_state: dict[str, Any],
+        span: TrackingSpan,
+        frame_idx: int,
+        reverse: bool,
+    ) -> int | None:
+        """
+        Replace the prompts of an inference state with the last mask every class
+        got in an interrupted pass, up to frame_idx. Returns the frame to continue
+        from, or None when nothing was stored yet and the pass starts over.
+        """
+        if reverse:
+            first, last = frame_idx, span.end_frame_idx
+        else:
+            first, last = span.start_frame_idx, frame_idx
+
+        seeds = {}
+        for class_id, written_frames in self.written_frames.items():
+            frames = [f for f in written_frames if first <= f <= last]
+            if frames:
+                seeds[class_id] = min(frames) if reverse else max(frames)
+
+        if not seeds:
+            return None
+
+        self.video_predictor.reset_state(inference_state)
+        for class_id, seed_frame_idx in seeds.items():
+            self.video_predictor.add_new_mask(
+                inference_state=inference_state,
+                frame_idx=self.state_frame_idx(seed_frame_idx),
+                obj_id=class_id,
+                mask=self.full_mask(inference_state, self.load_result(class_id, seed_frame_idx)),
+            )
+
+        return max(seeds.values()) if reverse else min(seeds.values())
+
+    def restore_prompts(self, inference_state: dict[str, Any]) -> None:
+        """Put the original prompts back after a re-seeded pass."""
+        self.video_predictor.reset_state(inference_state)
+        self.register_prompts(inference_state)
+
+    def load_checkpoint(self) -> dict[str, Any] | None:
+        """Load the checkpoint of an interrupted run, if it belongs to the same prompts."""
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return None
+
+        with self.checkpoint_path.open(encoding="utf-8") as f:
+            checkpoint = json.load(f)
+
+        prompts = {
+            str(class_id): self.prompt_signatures(class_id)
+            for class_id in self.class_folders
+        }
+        # Round-trip through JSON so the frame keys compare as strings
+        if (
+            checkpoint.get("version") != self.CHECKPOINT_VERSION
+            or checkpoint["frame_stride"] != self.frame_stride
+            or checkpoint["prompts"] != json.loads(json.dumps(prompts))
+        ):
+            print("Discarding tracking checkpoint of different prompts", flush=True)
+            self.checkpoint_path.unlink()
+            return None
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint: dict[str, Any]) -> list[TrackingSpan]:
+        self.tracked_frames = self.resumed_frames = checkpoint["tracked_frames"]
+        self._frames_at_checkpoint = self.tracked_frames
+        for class_id, frames in checkpoint["written_frames"].items():
+            self.written_frames[int(class_id)] = set(frames)
+
+        spans = []
+        for record in checkpoint["spans"]:
+            span = TrackingSpan(
+                record["start_frame_idx"],
+                record["end_frame_idx"],
+                record["forward_anchor"],
+                record["backward_anchor"],
+            )
+            self.span_progress[span] = record["progress"]
+            spans.append(span)
+
+        return spans
+
+    def write_checkpoint(self) -> None:
+        """
+        Store which frames every span got through and which results exist, so
+        a resumed run can re-seed each interrupted pass from its last masks.
+        """
+        if self.checkpoint_path is None:
+            return
+
+        with self._checkpoint_lock:
+            checkpoint = {
+                "version": self.CHECKPOINT_VERSION,
+                "frame_stride": self.frame_stride,
+                "prompts": {
+                    str(class_id): self.prompt_signatures(class_id)
+                    for class_id in self.class_folders
+                },
+                "tracked_frames": self.tracked_frames,
+                "written_frames": {
+                    str(class_id): sorted(frames)
+                    for class_id, frames in self.written_frames.items()
+                },
+                "spans": [
+                    {
+                        "start_frame_idx": span.start_frame_idx,
+                        "end_frame_idx": span.end_frame_idx,
+                        "forward_anchor": span.forward_anchor,
+                        "backward_anchor": span.backward_anchor,
+                        "progress": dict(progress),
+                    }
+                    for span, progress in self.span_progress.items()
+                ],
+            }
+            self._frames_at_checkpoint = self.tracked_frames
+
+            # Write next to the checkpoint and swap, so a crash never leaves half a file
+            temp_path = self.checkpoint_path.with_suffix(".tmp")
+            with temp_path.open("w", encoding="utf-8") as f:
+                json.dump(checkpoint, f)
+            os.replace(temp_path, self.checkpoint_path)
 
     def track_until_loss(
-        self, start_frame_idx: int, reverse: bool = False
-    ) -> Generator[int, None, None]:
-        tracking_loss = 0
+        self,
+        inference_state: dict[str, Any],
+        start_frame_idx: int,
+        reverse: bool = False,
+        max_frame_num_to_track: int | None = None,
+        frame_indices: list[int] | None = None,
+    ) -> Generator[tuple[int, bool], None, None]:
+        """
+        Propagate from start_frame_idx until the termination policy stops the
+        pass and store the masks it accepts. frame_indices maps the frames of a
+        keyframe inference state back to video frames; the grace period and
+        progress are scaled to the frame stride.
+        """
+        frames_per_step = 1 if frame_indices is None else self.frame_stride
+        grace_period = max(1, self.GRACE_PERIOD // frames_per_step)
+        termination_pass = self.termination_policy.new_pass(patience=grace_period)
         with torch.inference_mode():
             with torch.autocast(device_type="cuda"):  # disables BFloat16
                 for (
@@ -130,25 +765,34 @@ class TrackingJob:
                     obj_ids,
                     out_mask_logits,
                 ) in self.video_predictor.propagate_in_video(
-                    inference_state=self.inference_state,
+                    inference_state=inference_state,
                     start_frame_idx=start_frame_idx,
+                    max_frame_num_to_track=max_frame_num_to_track,
                     reverse=reverse,
                 ):  
-                    
-                    valid_mask_found = False
-                    
-
-                    frame_tensor = self.inference_state["images"][out_frame_idx]
+                    frame_tensor = inference_state["images"][out_frame_idx]
                     frame = frame_tensor.cpu().numpy().transpose(1,2,0).astype(np.uint8)
+                    state_frame_idx = out_frame_idx
+                    if frame_indices is not None:
+                        out_frame_idx = frame_indices[out_frame_idx]
 
+                    observations = []
                     for obj_id, mask_logits in zip(obj_ids, out_mask_logits):
 
                         mask_torch = mask_logits > 0.5
+                        observation = MaskObservation(
+                            class_id=obj_id,
+                            frame_idx=out_frame_idx,
+                            frame_area=mask_torch.numel(),
+                            object_score=self.object_score(
+                                inference_state, obj_id, state_frame_idx
+                            ),
+                        )
+                        observations.append(observation)
 
                         if not mask_torch.any():
                             continue
                         
-                        valid_mask_found = True
                         x1, y1, x2, y2 = (
                             masks_to_boxes(mask_torch)[0].cpu().numpy().astype(np.int32)
                         )
@@ -158,44 +802,242 @@ class TrackingJob:
 
                         x1, x2 = min(x1, x2), max(x1, x2)
                         y1, y2 = min(y1, y2), max(y1, y2)
-                        final_mask = mask[y1:y2, x1:x2]
+                        observation.mask = mask[y1:y2, x1:x2]
+                        observation.box = (x1, y1, x2, y2)
+
+                    accepted, stop_reason = termination_pass.observe(
+                        out_frame_idx, observations
+                    )
+                    for observation in accepted:
+                        x1, y1, x2, y2 = observation.box
+                        self.save_result(
+                            observation.class_id,
+                            out_frame_idx,
+                            observation.mask,
+                            observation.box,
+                            frame[y1:y2, x1:x2, :],
+                        )
 
-                        frame_roi = frame[y1:y2, x1:x2, :]
+                    if stop_reason is not None:
+                        break
+                    with self._progress_lock:
+                        self.tracked_frames += frames_per_step
+                        self.update_progress()
+                    if self.should_cancel is not None and self.should_cancel():
+                        raise JobCancelledError()
+                    yield out_frame_idx, bool(accepted)
+
+    @staticmethod
+    def object_score(
+        inference_state: dict[str, Any], obj_id: int, state_frame_idx: int
+    ) -> float | None:
+        """The SAM2 object score logit of an object in a frame, if still stored."""
+        obj_idx = inference_state["obj_id_to_idx"].get(obj_id)
+        if obj_idx is None:
+            return None
 
-                        file_path = self.class_folders[obj_id] / f"{out_frame_idx}.npz"
+        obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
+        frame_output = obj_output_dict["cond_frame_outputs"].get(
+            state_frame_idx
+        ) or obj_output_dict["non_cond_frame_outputs"].get(state_frame_idx)
+        if frame_output is None or frame_output.get("object_score_logits") is None:
+            return None
+
+        return float(frame_output["object_score_logits"].max())
+
+    def save_result(
+        self,
+        class_id: int,
+        frame_idx: int,
+        mask: UInt8Array,
+        box: tuple[int, int, int, int],
+        roi: UInt8Array,
+    ) -> None:
+        file_path = self.class_folders[class_id] / f"{frame_idx}.npz"
+
+        np.savez(file_path,
+            mask=mask,
+            box=np.array(box, dtype=np.int32),
+            roi=roi,
+            class_id=class_id,
+            frame_idx=frame_idx
+        )
+        with self._checkpoint_lock:
+            self.written_frames[class_id].add(frame_idx)
+
+    def fill_stride_gaps(self) -> None:
+        """
+        Fill the frames between consecutive tracked keyframes of every class.
+        Boxes are interpolated linearly and the keyframe masks warped into them,
+        unless the two keyframe masks overlap less than drift_iou_threshold. Those
+        gaps are propagated frame by frame on the full video instead.
+        """
+        drifted_gaps = []
+
+        for class_id, written_frames in self.written_frames.items():
+            tracked_keyframes = sorted(written_frames)
+            for start, end in zip(tracked_keyframes, tracked_keyframes[1:]):
+                next_keyframe = self.keyframes[self.state_frame_idx(start) + 1]
+                if end - start <= 1 or end != next_keyframe:
+                    continue
+
+                start_result = self.load_result(class_id, start)
+                end_result = self.load_result(class_id, end)
+                iou = image_utils.box_mask_iou(
+                    start_result["mask"], start_result["box"],
+                    end_result["mask"], end_result["box"],
+                )
+                if iou < self.drift_iou_threshold:
+                    drifted_gaps.append((class_id, start, end))
+                    continue
+
+                self.interpolate_gap(class_id, start, end, start_result, end_result)
+
+        for class_id, start, end in drifted_gaps:
+            self.propagate_gap(class_id, start, end)
+
+    def load_result(self, class_id: int, frame_idx: int) -> dict[str, Any]:
+        with np.load(self.class_folders[class_id] / f"{frame_idx}.npz") as file:
+            return {"mask": file["mask"], "box": tuple(int(v) for v in file["box"])}
+
+    @staticmethod
+    def full_mask(inference_state: dict[str, Any], result: dict[str, Any]) -> np.ndarray:
+        """Paste a stored box-cropped mask back into a frame-sized mask."""
+        x1, y1, _, _ = result["box"]
+        height, width = result["mask"].shape
+
+        full_mask = np.zeros(
+            (inference_state["video_height"], inference_state["video_width"]), dtype=bool
+        )
+        full_mask[y1 : y1 + height, x1 : x1 + width] = result["mask"].astype(bool)
+        return full_mask
+
+    def interpolate_gap(
+        self,
+        class_id: int,
+        start: int,
+        end: int,
+        start_result: dict[str, Any],
+        end_result: dict[str, Any],
+    ) -> None:
+        start_box = np.array(start_result["box"], dtype=np.float32)
+        end_box = np.array(end_result["box"], dtype=np.float32)
+
+        for frame_idx in range(start + 1, end):
+            t = (frame_idx - start) / (end - start)
+            x1, y1, x2, y2 = np.rint((1 - t) * start_box + t * end_box).astype(np.int32)
+            if x2 <= x1 or y2 <= y1:
+                continue
+
+            mask = image_utils.interpolate_mask(
+                start_result["mask"], end_result["mask"], (x2 - x1, y2 - y1), t
+            )
+            frame = get_frame_from_dir(frame_idx, self.frames_path)
+            self.save_result(
+                class_id, frame_idx, mask, (x1, y1, x2, y2), frame[y1:y2, x1:x2]
+            )
+
+    def propagate_gap(self, class_id: int, start: int, end: int) -> None:
+        """Re-seed SAM2 with the keyframe mask at start and propagate up to end."""
+        if self._full_inference_state is None:
+            self._full_inference_state = self.new_inference_state(
+                self.video_path, self.frames_path
+            )
+        else:
+            self.video_predictor.reset_state(self._full_inference_state)
+
+        inference_state = self._full_inference_state
+        self.video_predictor.add_new_mask(
+            inference_state=inference_state,
+            frame_idx=start,
+            obj_id=class_id,
+            mask=self.full_mask(inference_state, self.load_result(class_id, start)),
+        )
+        for _ in self.track_until_loss(
+            inference_state, start, max_frame_num_to_track=end - start
+        ):
+            pass
 
-                        np.savez(file_path,
-                            mask=final_mask,
-                            box=np.array([x1,y1,x2,y2],dtype=np.int32),
-                            roi=frame_roi,
-                            class_id=obj_id,
-                            frame_idx=out_frame_idx
-                        )
-                    if not valid_mask_found:
-                        tracking_loss += 1
-                    else:
-                        tracking_loss = 0
-                    if tracking_loss >= self.GRACE_PERIOD:
-                        break
-                    self.tracked_frames += 1
-                    self.update_progress()
-                    yield out_frame_idx
     def update_progress(self):
-        if self.tracked_frames == 0:
+        # Frames done before a resume do not count towards the current speed
+        frames_this_run = self.tracked_frames - self.resumed_frames
+        if frames_this_run <= 0:
             return
 
-        self.progress = self.tracked_frames / self.total_frames_to_track
+        # The backward pass of a span may revisit a few frames after a loss
+        self.progress = min(self.tracked_frames / self.total_frames_to_track, 1.0)
 
         elapsed = time.time() - self.start_time
-        seconds_per_frame = elapsed / self.tracked_frames
+        seconds_per_frame = elapsed / frames_this_run
 
-        remaining_frames = self.total_frames_to_track - self.tracked_frames
+        remaining_frames = max(self.total_frames_to_track - self.tracked_frames, 0)
 
         self.eta_seconds = int(seconds_per_frame * remaining_frames)
 
+        if self.progress_callback is not None:
+            self.progress_callback(self.progress, self.eta_seconds)
+
+
+def run_tracking_job(payload: dict[str, Any], context: JobContext) -> dict[str, Any]:
+    """Job handler: track the annotations of a labeling session in a worker process."""
+    frames_path = Path(payload["frames_path"])
+    extracted_frames_path = None
+    if not frames_path.exists():
+        # The labeler that queued the job is gone, e.g. after a restart
+        extracted_frames_path = Path(tempfile.mkdtemp())
+        extract_frames_to_dir(
+            video_path=Path(payload["video_path"]), frames_path=extracted_frames_path
+        )
+        frames_path = extracted_frames_path
+
+    def publish_segments(
+        span: TrackingSpan, tracks: dict[int, list[tuple[int, int]]]
+    ) -> None:
+        first, last = span.owned_frames
+        context.publish(
+            JobEventType.SEGMENTS,
+            {
+                "start_frame": first,
+                "end_frame": last,
+                "tracks": {str(class_id): t for class_id, t in tracks.items()},
+            },
+        )
+
+    tracking_job = TrackingJob(
+        annotations=[
+            SAMAnnotationDTO.model_validate(annotation)
+            for annotation in payload["annotations"]
+        ],
+        video_path=Path(payload["video_path"]),
+        frames_path=frames_path,
+        results_path=Path(payload["results_path"]),
+        frame_count=payload["frame_count"],
+        remove_previous_results=False,
+        incremental=payload["incremental"],
+        progress_callback=context.report_progress,
+        should_cancel=context.is_cancelled,
+        segments_callback=publish_segments,
+        checkpoint_path=context.work_path / "checkpoint.json",
+    )
+
+    try:
+        tracked_frames = tracking_job.run()
+    finally:
+        if extracted_frames_path is not None:
+            shutil.rmtree(extracted_frames_path, ignore_errors=True)
+
+    return {
+        "tracked_frames": tracked_frames,
+        "termination_stats": {
+            str(class_id): stats
+            for class_id, stats in tracking_job.termination_stats.items()
+        },
+    }
+
 
 class Labeler:
-    _tracking_job: TrackingJob | None = None
+    _tracking_job_id: str | None = None
+    _tracking_class_ids: set[int] = set()
     _selected_class_id: int = -1
     _show_inactive_classes: bool = True
 
@@ -270,27 +1112,22 @@ class Labeler:
     def image_predictor(self) -> SAM2ImagePredictor:
         return self._image_predictor
 
-    @property
-    def tracking_progress(self) -> float | None:
-        if self._tracking_job is None:
+    def get_tracking_job(self, db: Session) -> JobDTO | None:
+        """
+        The queued or running tracking job of this session, if any. Read once
+        per request, every read is a query.
+        """
+        if self._tracking_job_id is None:
             return None
-        return self._tracking_job.progress
 
-    @property
-    def is_tracking_current_class(self) -> bool:
-        return (
-            self._tracking_job is not None
-            and self._tracking_job.class_id == self._selected_class_id
-        )
-    @property
-    def tracking_eta(self) -> float | None:
-        if self._tracking_job is None:
+        job = jobs_service.get(db, self._tracking_job_id)
+        if not jobs_service.is_active(job):
             return None
-        return self._tracking_job.eta_seconds
+        return job
 
-    @property
-    def is_tracking(self) -> bool:
-        return self._tracking_job is not None
+    def is_tracking_class(self, class_id: int) -> bool:
+        """Whether the session's last tracking job includes this class."""
+        return class_id in self._tracking_class_ids
 
     def seek(self, frame_idx: int) -> None:
         if self.current_frame_idx == frame_idx:
@@ -388,20 +1225,78 @@ class Labeler:
 
         return frame
 
-    def start_tracking(self, annotations: list[AnnotationDTO]) -> None:
-        def job_runner() -> None:
-            self._tracking_job = TrackingJob(
-                annotations=annotations,
-                frames_path=self.frames_path,
-                results_path=self.current_class_results_path,
-                frame_count=self.frame_count,
-                class_id=self.selected_class_id,
-            )
+    def cancel_tracking(self, db: Session) -> JobDTO:
+        """Stop the tracking job, its checkpoint is kept so it can be resumed."""
+        if self._tracking_job_id is None:
+            raise NotFoundError("No tracking job to cancel")
+        return jobs_service.cancel(db, self._tracking_job_id)
+
+    def resume_tracking(self, db: Session) -> JobDTO:
+        """Queue the last cancelled or failed tracking job again."""
+        if self._tracking_job_id is None:
+            raise NotFoundError("No tracking job to resume")
+        return jobs_service.resume(db, self._tracking_job_id)
+
+    def start_tracking(
+        self,
+        db: Session,
+        annotations: list[AnnotationDTO],
+        full_retrack: bool = False,
+        all_classes: bool = False,
+    ) -> None:
+        """
+        Track the given annotations in a single job. With all_classes, the
+        annotations of every class are registered in one inference state so
+        the video is decoded and every frame encoded only once for all of them.
+        """
+        # Classes without annotations have nothing left to propagate from,
+        # so their previous results are stale
+        tracked_folders = {str(a.simroom_class_id) for a in annotations}
+        if all_classes and self.results_path.exists():
+            class_paths = [path for path in self.results_path.iterdir() if path.is_dir()]
+        else:
+            class_paths = [self.current_class_results_path]
+
+        for class_path in class_paths:
+            if class_path.name not in tracked_folders:
+                shutil.rmtree(class_path, ignore_errors=True)
 
-            self._tracking_job.run()
-            self._tracking_job = None
+        if not annotations:
+            return
+
+        # Results of other classes live next to the tracked class folders, so
+        # they are never wiped. Unless a full retrack is requested, only the
+        # spans around edited annotations are propagated again.
+        job = jobs_service.submit(
+            db=db,
+            kind=JobKind.TRACKING,
+            payload={
+                "annotations": [
+                    SAMAnnotationDTO(
+                        id=str(a.id),
+                        simroom_class_id=a.simroom_class_id,
+                        frame_idx=a.frame_idx,
+                        point_labels=[
+                            SAMPointDTO(x=pl.x, y=pl.y, label=pl.label)
+                            for pl in a.point_labels
+                        ],
+                    ).model_dump(mode="json")
+                    for a in annotations
+                ],
+                "video_path": str(self._cal_rec.video_path),
+                "frames_path": str(self.frames_path),
+                "results_path": str(self.results_path),
+                "frame_count": self.frame_count,
+                "incremental": not full_retrack,
+            },
+            # Someone is waiting for these results while labeling
+            priority=JobPriority.INTERACTIVE,
+        )
+        # The worker only picks the job up once it is committed
+        db.commit()
 
-        threading.Thread(target=job_runner).start()
+        self._tracking_job_id = job.id
+        self._tracking_class_ids = {a.simroom_class_id for a in annotations}
 
 
 def get_class_tracking_results(calibration_id: int, class_id: int) -> list[Path]:
@@ -410,6 +1305,6 @@ def get_class_tracking_results(calibration_id: int, class_id: int) -> list[Path]
         if tracking_results.stem == str(calibration_id):
             for class_results in tracking_results.iterdir():
                 if class_results.stem == str(class_id):
-                    for annotation in class_results.iterdir():
+                    for annotation in class_results.glob("*.npz"):
                         tracking_paths.append(annotation)
     return tracking_paths
@@ -1,5 +1,7 @@
+from collections import OrderedDict
 from pathlib import Path
 
+import cv2
 import numpy as np
 import torch
 from sam2.build_sam import build_sam2, build_sam2_video_predictor
@@ -9,6 +11,7 @@ from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
 
 from src.aliases import Int32Array, UInt8Array
 from src.api.exceptions import PredictionFailedError
+from src.api.models.tracking import StatePlacement
 from src.config import MAX_INFERENCE_STATE_FRAMES
 # At the top of sam2_service.py, after imports
 import sam2.utils.misc as _sam2_misc
@@ -71,6 +74,126 @@ def load_video_predictor(checkpoint_path: Path, max_inference_state_frames: int
     return predictor
 
 
+def estimate_state_bytes(
+    predictor, num_frames: int, num_objects: int
+) -> tuple[int, int]:
+    """
+    Rough size of a video inference state, as (frames, per-frame outputs) bytes.
+    Frames are stored as normalized float32 images at the model resolution, each
+    tracked frame keeps a bfloat16 memory, low-res mask logits and an object pointer.
+    """
+    image_size = predictor.image_size
+    frame_bytes = 3 * image_size**2 * 4
+
+    feature_size = image_size // 16
+    output_bytes = num_objects * (
+        predictor.mem_dim * feature_size**2 * 2
+        + (image_size // 4) ** 2 * 4
+        + predictor.hidden_dim * 4
+    )
+    return num_frames * frame_bytes, num_frames * output_bytes
+
+
+class MemmapVideoFrames:
+    """
+    Preprocessed video frames spilled to a memory-mapped file, so a long
+    recording does not have to fit in memory. Indexing returns a float32
+    tensor like the frames SAM2 loads itself.
+    """
+
+    IMG_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)[:, None, None]
+    IMG_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)[:, None, None]
+
+    def __init__(self, frames_path: Path, spill_path: Path, image_size: int) -> None:
+        frame_paths = sorted(frames_path.glob("*.jpg"), key=lambda p: int(p.stem))
+        if len(frame_paths) == 0:
+            raise FileNotFoundError(f"No frames found in {frames_path}")
+
+        self.frames = np.lib.format.open_memmap(
+            spill_path,
+            mode="w+",
+            dtype=np.float16,
+            shape=(len(frame_paths), 3, image_size, image_size),
+        )
+        for frame_idx, frame_path in enumerate(frame_paths):
+            frame_bgr = cv2.imread(str(frame_path))
+            if frame_idx == 0:
+                self.video_height, self.video_width = frame_bgr.shape[:2]
+
+            frame_rgb = cv2.cvtColor(
+                cv2.resize(frame_bgr, (image_size, image_size)), cv2.COLOR_BGR2RGB
+            )
+            frame = frame_rgb.transpose(2, 0, 1).astype(np.float32) / 255.0
+            self.frames[frame_idx] = (frame - self.IMG_MEAN) / self.IMG_STD
+        self.frames.flush()
+
+    def __getitem__(self, frame_idx: int) -> torch.Tensor:
+        return torch.from_numpy(self.frames[frame_idx].astype(np.float32))
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+
+@torch.inference_mode()
+def init_memmap_state(predictor, frames: MemmapVideoFrames) -> dict:
+    """
+    The inference state SAM2VideoPredictor.init_state builds, over memory-mapped
+    frames instead of frames it loads itself. Frames are read to the CPU on
+    access and per-frame outputs are offloaded to the CPU.
+    """
+    compute_device = predictor.device
+    inference_state = {
+        "images": frames,
+        "num_frames": len(frames),
+        "offload_video_to_cpu": True,
+        "offload_state_to_cpu": True,
+        "video_height": frames.video_height,
+        "video_width": frames.video_width,
+        "device": compute_device,
+        "storage_device": torch.device("cpu"),
+        "point_inputs_per_obj": {},
+        "mask_inputs_per_obj": {},
+        "cached_features": {},
+        "constants": {},
+        "obj_id_to_idx": OrderedDict(),
+        "obj_idx_to_id": OrderedDict(),
+        "obj_ids": [],
+        "output_dict_per_obj": {},
+        "temp_output_dict_per_obj": {},
+        "frames_tracked_per_obj": {},
+    }
+    # Warm up the backbone on the first frame, as init_state does
+    predictor._get_image_feature(inference_state, frame_idx=0, batch_size=1)
+    return inference_state
+
+
+def init_state(
+    predictor,
+    video_path: Path,
+    placement: str = StatePlacement.DEVICE,
+    frames_path: Path | None = None,
+    spill_path: Path | None = None,
+) -> dict:
+    """
+    Initialize a video inference state with frames and per-frame outputs either on
+    the compute device, offloaded to the CPU, or with the frames spilled to a
+    memory-mapped file (read from the JPEGs in frames_path) and outputs on the CPU.
+    """
+    if placement == StatePlacement.MMAP:
+        frames = MemmapVideoFrames(frames_path, spill_path, predictor.image_size)
+        return init_memmap_state(predictor, frames)
+
+    offload = placement == StatePlacement.CPU
+    inference_state = predictor.init_state(
+        video_path=str(video_path),
+        offload_video_to_cpu=offload,
+        offload_state_to_cpu=offload,
+    )
+    if placement == StatePlacement.DEVICE:
+        inference_state["images"] = inference_state["images"].to(predictor.device)
+    return inference_state
+
+
 def predict(
     predictor: SAM2ImagePredictor,
     points: list[tuple[int, int]],
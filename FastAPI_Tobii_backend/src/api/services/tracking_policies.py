@@ -0,0 +1,165 @@
+import threading
+
+from src.api.models.tracking import ClassTerminationStats, MaskObservation
+from src.config import (
+    TRACKING_EXIT_OBJECT_SCORE,
+    TRACKING_EXIT_PATIENCE,
+    TRACKING_MIN_MASK_AREA_RATIO,
+    TRACKING_MIN_MASK_IOU,
+    TRACKING_MIN_OBJECT_SCORE,
+)
+from ..utils import image_utils
+
+
+class TerminationPolicy:
+    """
+    Decides which propagated masks are kept and when a propagation pass stops.
+    The base policy accepts every non-empty mask and stops a pass after
+    `patience` consecutive frames without one, which is the original
+    GRACE_PERIOD rule. Subclasses override reject_reason and has_left.
+    """
+
+    exit_patience: int | None = None
+
+    def __init__(self) -> None:
+        self.class_stats: dict[int, ClassTerminationStats] = {}
+        self._lock = threading.Lock()
+
+    def new_pass(self, patience: int) -> "TerminationPass":
+        return TerminationPass(self, patience)
+
+    def reject_reason(
+        self, observation: MaskObservation, previous: MaskObservation | None
+    ) -> str | None:
+        """Return why a mask should be discarded, or None to keep it."""
+        if observation.area == 0:
+            return "empty"
+        return None
+
+    def has_left(self, observations: list[MaskObservation]) -> bool:
+        """Whether every object has clearly left the frame."""
+        return False
+
+    def record(self, observation: MaskObservation, reason: str | None) -> None:
+        with self._lock:
+            stats = self.class_stats.setdefault(
+                observation.class_id, ClassTerminationStats()
+            )
+            stats.frames_observed += 1
+            stats.area_ratio_sum += observation.area / max(observation.frame_area, 1)
+            if observation.object_score is not None:
+                stats.object_score_sum += observation.object_score
+                stats.object_score_count += 1
+
+            if reason is None:
+                stats.frames_accepted += 1
+            else:
+                stats.rejections[reason] = stats.rejections.get(reason, 0) + 1
+
+    def log_summary(self) -> None:
+        for class_id, stats in sorted(self.class_stats.items()):
+            print(f"Tracking stats for class {class_id}: {stats.summary()}", flush=True)
+
+
+class ConfidenceTerminationPolicy(TerminationPolicy):
+    """
+    Rejects tiny masks, masks with a low SAM2 object score and masks that
+    jump away from the previous one, and stops a pass early once every
+    object's score shows it has clearly left the frame.
+    """
+
+    def __init__(
+        self,
+        min_area_ratio: float = TRACKING_MIN_MASK_AREA_RATIO,
+        min_object_score: float = TRACKING_MIN_OBJECT_SCORE,
+        min_iou: float = TRACKING_MIN_MASK_IOU,
+        exit_object_score: float = TRACKING_EXIT_OBJECT_SCORE,
+        exit_patience: int = TRACKING_EXIT_PATIENCE,
+    ) -> None:
+        super().__init__()
+        self.min_area_ratio = min_area_ratio
+        self.min_object_score = min_object_score
+        self.min_iou = min_iou
+        self.exit_object_score = exit_object_score
+        self.exit_patience = exit_patience
+
+    def reject_reason(
+        self, observation: MaskObservation, previous: MaskObservation | None
+    ) -> str | None:
+        if observation.area == 0:
+            return "empty"
+
+        if observation.area < self.min_area_ratio * observation.frame_area:
+            return "area"
+
+        if (
+            observation.object_score is not None
+            and observation.object_score < self.min_object_score
+        ):
+            return "object_score"
+
+        if previous is not None and self.min_iou > 0:
+            iou = image_utils.box_mask_iou(
+                observation.mask, observation.box, previous.mask, previous.box
+            )
+            if iou < self.min_iou:
+                return "iou"
+
+        return None
+
+    def has_left(self, observations: list[MaskObservation]) -> bool:
+        return bool(observations) and all(
+            observation.object_score is not None
+            and observation.object_score < self.exit_object_score
+            for observation in observations
+        )
+
+
+class TerminationPass:
+    """The per-pass state of a termination policy: counters and previous masks."""
+
+    def __init__(self, policy: TerminationPolicy, patience: int) -> None:
+        self.policy = policy
+        self.patience = patience
+        self.missed_frames = 0
+        self.exited_frames = 0
+        self.previous: dict[int, MaskObservation] = {}
+
+    def observe(
+        self, frame_idx: int, observations: list[MaskObservation]
+    ) -> tuple[list[MaskObservation], str | None]:
+        """
+        Returns the masks to keep for this frame and, when the
+        pass should stop here, the reason for stopping.
+        """
+        accepted = []
+        for observation in observations:
+            reason = self.policy.reject_reason(
+                observation, self.previous.get(observation.class_id)
+            )
+            self.policy.record(observation, reason)
+            # Rejections are counted per reason in the policy's class stats.
+            # Compare against the last accepted mask, so a jump to another
+            # object stays rejected and the track is kept once it jumps back
+            if reason is None:
+                accepted.append(observation)
+                self.previous[observation.class_id] = observation
+
+        self.missed_frames = 0 if accepted else self.missed_frames + 1
+        self.exited_frames = (
+            self.exited_frames + 1 if self.policy.has_left(observations) else 0
+        )
+
+        stop_reason = None
+        if self.missed_frames >= self.patience:
+            stop_reason = f"no accepted mask for {self.missed_frames} frames"
+        elif (
+            self.policy.exit_patience is not None
+            and self.exited_frames >= self.policy.exit_patience
+        ):
+            stop_reason = f"all objects left the frame for {self.exited_frames} frames"
+
+        if stop_reason is not None:
+            print(f"Tracking pass stopped at frame {frame_idx}: {stop_reason}", flush=True)
+
+        return accepted, stop_reason
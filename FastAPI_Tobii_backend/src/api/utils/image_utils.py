@@ -81,3 +81,39 @@ def decode_from_base64(base64_str: str) -> UInt8Array:
         raise ImageEncodingError(f"Failed to decode image: {e}") from e
 
     return img
+
+
+def box_mask_iou(
+    mask_a: UInt8Array,
+    box_a: tuple[int, int, int, int],
+    mask_b: UInt8Array,
+    box_b: tuple[int, int, int, int],
+) -> float:
+    """IoU of two masks that are cropped to their boxes, in frame coordinates."""
+    x1, y1 = min(box_a[0], box_b[0]), min(box_a[1], box_b[1])
+    x2, y2 = max(box_a[2], box_b[2]), max(box_a[3], box_b[3])
+
+    canvases = []
+    for mask, box in ((mask_a, box_a), (mask_b, box_b)):
+        canvas = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+        top, left = box[1] - y1, box[0] - x1
+        canvas[top : top + mask.shape[0], left : left + mask.shape[1]] = mask.astype(bool)
+        canvases.append(canvas)
+
+    union = np.logical_or(*canvases).sum()
+    if union == 0:
+        return 0.0
+    return float(np.logical_and(*canvases).sum() / union)
+
+
+def interpolate_mask(
+    mask_a: UInt8Array, mask_b: UInt8Array, size: tuple[int, int], t: float
+) -> UInt8Array:
+    """
+    Warp two box-cropped masks to the given (width, height)
+    and blend them, with t = 0 returning mask_a.
+    """
+    warped_a = cv2.resize(mask_a.astype(np.float32), size, interpolation=cv2.INTER_LINEAR)
+    warped_b = cv2.resize(mask_b.astype(np.float32), size, interpolation=cv2.INTER_LINEAR)
+    blended = (1 - t) * warped_a + t * warped_b
+    return (blended >= 0.5).astype(np.uint8)
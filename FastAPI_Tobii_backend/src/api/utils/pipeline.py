@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+_DONE = object()  # Marks the end of a stage's input
+_PUT_TIMEOUT = 0.1  # How often a blocked worker checks whether the pipeline was aborted
+
+
+@dataclass
+class StageMetrics:
+    """How much of the pipeline's runtime a stage's workers spent working."""
+
+    workers: int
+    items: int = 0
+    busy_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def utilization(self) -> float:
+        """1.0 means the stage was busy the whole time, it is the bottleneck."""
+        if self.wall_seconds == 0:
+            return 0.0
+        return self.busy_seconds / (self.wall_seconds * self.workers)
+
+    def merge(self, other: "StageMetrics") -> None:
+        self.items += other.items
+        self.busy_seconds += other.busy_seconds
+        self.wall_seconds += other.wall_seconds
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_seconds": self.busy_seconds,
+            "utilization": self.utilization,
+        }
+
+
+@dataclass(frozen=True)
+class PipelineStage:
+    name: str
+    fn: Callable[[Any], Any]  # Returning None drops the item
+    workers: int = 1
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, every stage in its own worker threads
+    with bounded queues in between. Stages overlap, so the total time approaches
+    that of the slowest stage instead of the sum of all of them, while the
+    bounded queues keep a fast stage from running far ahead of a slow one.
+    The first exception in any stage aborts the run and is raised by run().
+    """
+
+    def __init__(self, stages: list[PipelineStage], queue_size: int = 4) -> None:
+        self.stages = stages
+        self.queue_size = queue_size
+        self.metrics = {stage.name: StageMetrics(stage.workers) for stage in stages}
+        self._error: BaseException | None = None
+        self._aborted = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, items: Iterable[Any]) -> list[Any]:
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        results: queue.Queue = queue.Queue()
+        outputs = queues[1:] + [results]
+
+        threads = []
+        for stage, inputs, output in zip(self.stages, queues, outputs):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(stage, inputs, output, remaining),
+                        daemon=True,
+                    )
+                )
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        for item in items:
+            if not self._put(queues[0], item):
+                break
+        self._put(queues[0], _DONE)
+
+        for thread in threads:
+            thread.join()
+
+        wall_seconds = time.perf_counter() - start
+        for metrics in self.metrics.values():
+            metrics.wall_seconds = wall_seconds
+
+        if self._error is not None:
+            raise self._error
+
+        return [item for item in iter(results.get_nowait, _DONE)]
+
+    def _work(
+        self,
+        stage: PipelineStage,
+        inputs: queue.Queue,
+        output: queue.Queue,
+        remaining: list[int],
+    ) -> None:
+        metrics = self.metrics[stage.name]
+        while not self._aborted.is_set():
+            try:
+                item = inputs.get(timeout=_PUT_TIMEOUT)
+            except queue.Empty:
+                continue
+
+            if item is _DONE:
+                # Let the other workers of this stage see the end as well
+                inputs.put(_DONE)
+                break
+
+            start = time.perf_counter()
+            try:
+                result = stage.fn(item)
+            except BaseException as e:
+                self._abort(e)
+                return
+            busy = time.perf_counter() - start
+
+            with self._lock:
+                metrics.items += 1
+                metrics.busy_seconds += busy
+
+            if result is not None and not self._put(output, result):
+                return
+
+        # The last worker of a stage passes the end on to the next stage
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            self._put(output, _DONE)
+
+    def _put(self, target: queue.Queue, item: Any) -> bool:
+        while not self._aborted.is_set():
+            try:
+                target.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _abort(self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._aborted.set()
@@ -16,6 +16,10 @@ TRACKING_RESULTS_PATH = Path(
     os.environ.get("TRACKING_RESULTS_PATH", DATA_PATH / "labeling_results")
 )
 TRACKING_RESULTS_PATH.mkdir(exist_ok=True)
+JOBS_PATH = DATA_PATH / "jobs"  # Working directories of queued jobs, kept until they finish
+JOBS_PATH.mkdir(exist_ok=True)
+CLASSIFIER_HEADS_PATH = DATA_PATH / "classifier_heads"
+CLASSIFIER_HEADS_PATH.mkdir(exist_ok=True)
 STATIC_FILES_PATH = SRC_PATH / "static"
 TEMPLATES_PATH = SRC_PATH / "templates"
 DEFAULT_GLASSES_HOSTNAME = "192.168.75.51"
@@ -27,12 +31,82 @@ if not FAST_SAM_CHECKPOINT.exists():
 
 # The amount of frames kept in memory for SAM2 video inference
 MAX_INFERENCE_STATE_FRAMES = 100
+# The amount of tracking spans propagated in parallel, each with its own inference state
+MAX_CONCURRENT_TRACKING_SPANS = int(os.environ.get("MAX_CONCURRENT_TRACKING_SPANS", 1))
+# Every k-th frame is propagated by SAM2 during analysis, the others are interpolated
+ANALYSIS_TRACKING_FRAME_STRIDE = int(os.environ.get("ANALYSIS_TRACKING_FRAME_STRIDE", 1))
+# Frames decoded ahead of SAM2 and segmented frames waiting for matching during analysis
+ANALYSIS_PIPELINE_QUEUE_SIZE = int(os.environ.get("ANALYSIS_PIPELINE_QUEUE_SIZE", 4))
+# Threads embedding and matching the masks of segmented frames
+ANALYSIS_MATCH_WORKERS = int(os.environ.get("ANALYSIS_MATCH_WORKERS", 2))
+# Candidate crops embedded by DINOv2 per forward pass
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 64))
+# Keyframe masks overlapping less than this are propagated in full instead of interpolated
+TRACKING_STRIDE_DRIFT_IOU = 0.5
+# Memory a single tracking job may keep resident for its frames and per-frame outputs
+TRACKING_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("TRACKING_MEMORY_BUDGET_BYTES", 4 * 1024**3)
+)
+# Memory all tracking jobs on this node may reserve together, jobs wait for their share
+TRACKING_NODE_MEMORY_BYTES = int(
+    os.environ.get("TRACKING_NODE_MEMORY_BYTES", 16 * 1024**3)
+)
+
+# Tracking termination thresholds, see tracking_policies.ConfidenceTerminationPolicy
+TRACKING_MIN_MASK_AREA_RATIO = 1e-4  # Masks smaller than this part of the frame are noise
+TRACKING_MIN_OBJECT_SCORE = 0.0  # SAM2 object score logit, below 0 the object is absent
+TRACKING_MIN_MASK_IOU = 0.1  # Overlap with the previous mask, lower is a jump to another object
+TRACKING_EXIT_OBJECT_SCORE = -4.0  # Object score logit at which an object has clearly left
+TRACKING_EXIT_PATIENCE = 5  # Frames every object must have left before the pass stops
+
+# Worker processes per resource class of the persistent job queue
+JOB_WORKERS = {
+    "gpu": int(os.environ.get("JOB_GPU_WORKERS", 1)),
+    "cpu": int(os.environ.get("JOB_CPU_WORKERS", 1)),
+}
+JOB_POLL_INTERVAL_SECONDS = 1.0  # How often idle workers look for queued jobs
+JOB_WATCHDOG_INTERVAL_SECONDS = 2.0  # How often the API process checks that its workers live
+JOB_PROGRESS_INTERVAL_SECONDS = 1.0  # Minimum time between progress writes of a job
+JOB_CANCEL_CHECK_INTERVAL_SECONDS = 1.0  # Minimum time between cancellation checks of a job
+JOB_EVENT_PROGRESS_INTERVAL_SECONDS = 0.25  # Minimum time between pushed progress events of a job
+JOB_EVENT_HEARTBEAT_SECONDS = 15.0  # Keeps idle event streams open through proxies
+TRACKING_CHECKPOINT_INTERVAL_FRAMES = 100  # Propagated frames between two tracking checkpoints
 
 # Gaze Segmentation parameters:
 TOBII_FOV_X = 95
 GAZE_FOV = 1 + 0.6  # 1 degree fovea + 0.6 degree eyetracker accuracy
 TOBII_GLASSES_RESOLUTION = (1080, 1920)
 VIEWED_RADIUS = int(GAZE_FOV / TOBII_FOV_X * TOBII_GLASSES_RESOLUTION[1] / 2)
+
+
+@dataclass(frozen=True)
+class GazeAggregate:
+    """How the gaze samples that fall within a frame become its gaze position."""
+
+    FIRST: str = "first"
+    MEAN: str = "mean"
+    MEDIAN: str = "median"
+    NEAREST_CENTRE: str = "nearest_centre"  # sample closest to the middle of the frame's display time
+
+
+GAZE_FRAME_AGGREGATE = os.environ.get("GAZE_FRAME_AGGREGATE", GazeAggregate.NEAREST_CENTRE)
+
+
+@dataclass(frozen=True)
+class FixationAlgorithm:
+    IVT: str = "ivt"  # Velocity threshold
+    IDT: str = "idt"  # Dispersion threshold
+
+
+FIXATION_ALGORITHM = os.environ.get("FIXATION_ALGORITHM", FixationAlgorithm.IVT)
+FIXATION_VELOCITY_THRESHOLD = 30.0  # degrees per second, the Tobii I-VT default
+FIXATION_DISPERSION_THRESHOLD = 1.0  # degrees, horizontal plus vertical spread
+FIXATION_MIN_DURATION = 0.06  # seconds, shorter fixations are discarded
+# Gaze heatmap levels as (rows, cols), each twice as fine as the one before
+HEATMAP_SHAPES = [(27, 48), (54, 96), (108, 192)]
+HEATMAP_BUCKET_SECONDS = 10.0  # Time span of every precomputed heatmap tile
+# Score views and sample keyframes per fixation instead of per gaze sample
+ANALYSIS_USE_FIXATIONS = os.environ.get("ANALYSIS_USE_FIXATIONS", "true").lower() == "true"
 TOBII_GLASSES_FPS = 24.95
 
 @dataclass(frozen=True)
@@ -49,6 +123,54 @@ for checkpoint in Sam2Checkpoints.__dict__.values():
             f"Checkpoint not found at {checkpoint}. Please download the model."
         )
 
+
+@dataclass(frozen=True)
+class EmbeddingMode:
+    CROP: str = "crop"  # CLS token of every mask's box crop
+    MASK_POOLED: str = "mask_pooled"  # Patch tokens of the whole frame pooled under every mask
+
+
+# How candidate masks and annotations are embedded, prototypes and matches must use the same
+EMBEDDING_MODE = os.environ.get("EMBEDDING_MODE", EmbeddingMode.CROP)
+MASK_POOLING_SHORT_SIDE = 448  # Frames are resized to this for a mask-pooled forward pass
+MASK_POOLING_CHUNK_SIZE = 16  # Masks downsampled to the patch grid at once
+# Tag of the stored annotation embeddings, bump it when the model or its preprocessing changes
+EMBEDDING_MODEL_VERSION = "dinov2-base-1"
+
+
+@dataclass(frozen=True)
+class VectorIndexType:
+    FLAT: str = "flat"  # Exact search, fine up to a few hundred thousand vectors
+    IVF_FLAT: str = "ivf_flat"  # Inverted lists, only nprobe lists are scanned
+    IVF_PQ: str = "ivf_pq"  # Inverted lists with product-quantized codes, for millions of vectors
+    HNSW: str = "hnsw"  # Graph search, fast but removed vectors are only hidden
+
+
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", VectorIndexType.FLAT)
+VECTOR_INDEX_IVF_LISTS = 1024  # Upper bound, small indexes get fewer lists
+VECTOR_INDEX_IVF_PROBES = 16
+VECTOR_INDEX_PQ_SUBQUANTIZERS = 64  # Must divide the embedding dimension
+VECTOR_INDEX_PQ_BITS = 8
+VECTOR_INDEX_HNSW_NEIGHBORS = 32
+VECTOR_INDEX_HNSW_EF_SEARCH = 64
+VECTOR_INDEX_TRAIN_SIZE = 100_000  # Vectors sampled to train IVF and PQ indexes
+
+
+@dataclass(frozen=True)
+class MatchingStrategy:
+    PROTOTYPE: str = "prototype"  # Nearest mean embedding of each class
+    KNN: str = "knn"  # Similarity-weighted vote of the nearest annotation embeddings
+    HEAD: str = "head"  # Trained classification head, falls back to prototypes without one
+
+
+MATCHING_STRATEGY = os.environ.get("MATCHING_STRATEGY", MatchingStrategy.PROTOTYPE)
+KNN_NEIGHBORS = 10
+# Hidden units of the classification head on the embeddings, 0 trains a linear head
+CLASSIFIER_HEAD_HIDDEN = int(os.environ.get("CLASSIFIER_HEAD_HIDDEN", 0))
+CLASSIFIER_HEAD_EPOCHS = 300
+CLASSIFIER_HEAD_HOLDOUT = 0.2  # Share of the embeddings kept apart to measure accuracy
+CLASSIFIER_HEAD_KEEP_VERSIONS = 3  # Older versions of a class set's head are deleted
+
 SAM_2_MODEL_CONFIGS = {
     Sam2Checkpoints.BASE_PLUS: "sam2.1_hiera_b+.yaml",
     Sam2Checkpoints.LARGE: "sam2.1_hiera_l.yaml",
@@ -1,3 +1,4 @@
+import asyncio
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 
@@ -8,8 +9,8 @@ from sqlalchemy.orm import Session
 from src.api.db import Base, engine
 from src.api.models import App
 from src.api.models.context import GlassesConnectionContext
-from src.api.routes import labeling_route, recordings_route, analysis_route, classes_route,calibration_recordings_route
-from src.api.services import glasses_service, recordings_service
+from src.api.routes import labeling_route, recordings_route, analysis_route, classes_route,calibration_recordings_route, jobs_route
+from src.api.services import glasses_service, jobs_service, recordings_service
 from src.config import Template, templates
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,8 +23,16 @@ async def lifespan(_app: App) -> AsyncGenerator[None, None]:
     with Session(engine) as session:
         recordings_service.clean_recordings(session)
 
+    with Session(engine) as session:
+        jobs_service.requeue_interrupted_jobs(session)
+        session.commit()
+
+    jobs_service.start_workers(asyncio.get_running_loop())
+
     yield
 
+    jobs_service.stop_workers()
+
 
 app = App(lifespan=lifespan)
 origins = [
@@ -44,6 +53,7 @@ app.include_router(classes_route.router)
 app.include_router(labeling_route.router)
 app.include_router(analysis_route.router)
 app.include_router(calibration_recordings_route.router)
+app.include_router(jobs_route.router)
 
 
 @app.get("/", response_class=HTMLResponse)
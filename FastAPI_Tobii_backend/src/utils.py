@@ -3,7 +3,7 @@ import json
 import random
 import shutil
 import subprocess
-from collections.abc import Generator
+from collections.abc import Callable, Generator
 from pathlib import Path
 
 import aiohttp
@@ -14,13 +14,17 @@ from fastapi import Request
 from src.aliases import UInt8Array
 
 
-async def download_file(url: str, target_path: Path) -> None:
+async def download_file(
+    url: str, target_path: Path, on_chunk: Callable[[bytes], None] | None = None
+) -> None:
     """
     Downloads a file from a URL and saves it to a local path asynchronously.
 
     Args:
         url (str): The URL of the file to download.
         local_path (str): The local path where the file will be saved.
+        on_chunk (Callable[[bytes], None] | None): Called with every chunk as it
+            is received, e.g. to parse the file while it downloads.
 
     Returns:
         None
@@ -33,6 +37,8 @@ async def download_file(url: str, target_path: Path) -> None:
         async with aiohttp.ClientSession() as session, session.get(url) as resp:
             async for chunk in resp.content.iter_chunked(1024 * 64):
                 fd.write(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
 
 
 def save_json(data: dict[str, str], target_path: Path) -> None:
@@ -144,6 +150,38 @@ def extract_frames_to_dir(
     )
 
 
+def probe_frame_timestamps(video_path: Path) -> np.ndarray | None:
+    """
+    Presentation timestamps in seconds of every video frame, read from the
+    container's packets so nothing is decoded. None without ffprobe.
+    """
+    ffprobe_path = shutil.which("ffprobe.exe")
+    if ffprobe_path is None or Path(ffprobe_path).name != "ffprobe.exe":
+        return None
+
+    result = subprocess.run(  # noqa: S603
+        [
+            ffprobe_path,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time",
+            "-of",
+            "csv=p=0",
+            str(video_path),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        shell=False,
+    )
+    timestamps = [float(line) for line in result.stdout.split() if line != "N/A"]
+    # Packets are in decoding order, B-frames make that differ from presentation order
+    return np.sort(np.array(timestamps, dtype=np.float64))
+
+
 def get_frame_from_dir(frame_idx: int, frames_path: Path) -> UInt8Array:
     frame_path = frames_path / f"{frame_idx:05}.jpg"
     if not frame_path.exists():
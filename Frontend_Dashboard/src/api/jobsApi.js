@@ -0,0 +1,44 @@
+import axios from 'axios';
+
+const BASE_URL = 'http://localhost:8000/jobs';
+
+const api = axios.create({
+  baseURL: BASE_URL,
+});
+
+export const JobsAPI = {
+  getJob: async (jobId) => {
+    const response = await api.get(`/${jobId}`);
+    return response.data;
+  },
+
+  cancelJob: async (jobId) => {
+    const response = await api.post(`/${jobId}/cancel`);
+    return response.data;
+  },
+
+  resumeJob: async (jobId) => {
+    const response = await api.post(`/${jobId}/resume`);
+    return response.data;
+  },
+
+  // Follow the server-sent events of a job, returns a function that closes the stream
+  subscribe: (jobId, handlers) => {
+    const source = new EventSource(`${BASE_URL}/${jobId}/events`);
+    const listen = (type, handler, terminal = false) => {
+      source.addEventListener(type, (event) => {
+        if (terminal) source.close();
+        handler?.(JSON.parse(event.data));
+      });
+    };
+
+    listen('status', handlers.onStatus);
+    listen('progress', handlers.onProgress);
+    listen('segments', handlers.onSegments);
+    listen('finished', handlers.onFinished, true);
+    listen('failed', handlers.onFailed, true);
+    listen('cancelled', handlers.onCancelled, true);
+
+    return () => source.close();
+  },
+};
@@ -59,8 +59,20 @@ export const LabelingAPI = {
     return response.data;
   },
 
-  startTracking: async () => {
-    const response = await api.post('/tracking');
+  startTracking: async (allClasses = false) => {
+    const response = await api.post('/tracking', null, {
+      params: { all_classes: allClasses },
+    });
+    return response.data;
+  },
+
+  cancelTracking: async () => {
+    const response = await api.post('/tracking/cancel');
+    return response.data;
+  },
+
+  resumeTracking: async () => {
+    const response = await api.post('/tracking/resume');
     return response.data;
   },
 
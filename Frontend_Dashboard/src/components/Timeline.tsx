@@ -4,7 +4,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "./ui/card"
 import type { FrameState } from "./../types/labeling"
 import { useRef, useState } from "react"
 
-export function Timeline({ frameIdx, setFrameIdx, timeline, onSeek }: FrameState) {
+export function Timeline({ frameIdx, setFrameIdx, timeline, onSeek, onTrackingStarted }: FrameState) {
   const timelineRef = useRef<HTMLDivElement>(null)
   const [isSeeking, setIsSeeking] = useState(false)
 
@@ -51,7 +51,7 @@ export function Timeline({ frameIdx, setFrameIdx, timeline, onSeek }: FrameState
 
         {/* Tracking Button */}
         <Button
-          onClick={() => LabelingAPI.startTracking()}
+          onClick={async () => onTrackingStarted?.(await LabelingAPI.startTracking())}
           disabled={timeline.is_tracking || isSeeking}
         >
           {timeline.is_tracking ? "Tracking…" : "Start Tracking"}
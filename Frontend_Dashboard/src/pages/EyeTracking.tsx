@@ -10,6 +10,7 @@ import { Loader2 } from "lucide-react"
 
 import { AnalysisAPI, AnalysisResponse } from "@/api/analysisApi"
 import { RecordingsAPI } from "@/api/recordingsApi"
+import { JobsAPI } from "@/api/jobsApi"
 import { CalibrationRecording, SimRoomClass } from "../types/simrooms"
 import { Recording } from "../types/recording"
 import {
@@ -79,17 +80,19 @@ export default function EyeTracking() {
         selectedClasses
       );
 
-      let progress = 0;
-      while (progress < 1) {
-        await new Promise((res) => setTimeout(res, 1000)); 
-        const data = await AnalysisAPI.getProgress(job_id);
-        progress = data.progress;
-        setProgress(progress);
-        setEta(data.eta_seconds);
-      }
-
-      const finalResult = await AnalysisAPI.getResult(job_id);
-      setResult(finalResult);
+      // Progress and the result are pushed by the server
+      const finalResult = await new Promise((resolve, reject) => {
+        JobsAPI.subscribe(job_id, {
+          onProgress: (data: any) => {
+            setProgress(data.progress);
+            setEta(data.eta_seconds);
+          },
+          onFinished: resolve,
+          onFailed: (data: any) => reject(new Error(data.error)),
+          onCancelled: () => reject(new Error("Analysis cancelled")),
+        });
+      });
+      setResult(finalResult as any);
     } finally {
       setLoading(false);
     }
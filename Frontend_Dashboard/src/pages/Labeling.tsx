@@ -1,5 +1,6 @@
 import { useEffect, useState } from "react"
 import { LabelingAPI } from "../api/labelingApi"
+import { JobsAPI } from "../api/jobsApi"
 import {
   Card,
   CardContent,
@@ -32,6 +33,33 @@ export default function Labeler() {
     init()
   }, [])
 
+  // Progress and finished tracks are pushed while a tracking job runs
+  const trackingJobId = timeline?.tracking_job_id
+  useEffect(() => {
+    if (!trackingJobId) return
+
+    return JobsAPI.subscribe(trackingJobId, {
+      onProgress: ({ progress }: any) =>
+        setTimeline((prev: any) => prev && { ...prev, tracking_progress: progress }),
+      onSegments: ({ start_frame, end_frame, tracks }: any) =>
+        setTimeline((prev: any) => {
+          const classTracks = prev && tracks[String(prev.selected_class_id)]
+          if (!classTracks) return prev
+          // Replace the tracks within the finished span
+          const kept = prev.tracks.filter(
+            ([start, end]: [number, number]) => end < start_frame || start > end_frame
+          )
+          return {
+            ...prev,
+            tracks: [...kept, ...classTracks].sort((a, b) => a[0] - b[0]),
+          }
+        }),
+      onFinished: () => refreshFrameData(),
+      onFailed: () => refreshFrameData(),
+      onCancelled: () => refreshFrameData(),
+    })
+  }, [trackingJobId])
+
   const init = async () => {
     try {
       setLoading(true)
@@ -131,6 +159,7 @@ const handleSeek = async (newFrame: number) => {
               setFrameIdx={setFrameIdx}
               timeline={timeline}
               onSeek={handleSeek}
+              onTrackingStarted={setTimeline}
             />
 
             {/* Annotations */}
@@ -3,6 +3,7 @@ export type FrameState = {
   setFrameIdx: React.Dispatch<React.SetStateAction<number>>;
   timeline: any;
   onSeek: (frame: number) => Promise<void>;
+  onTrackingStarted?: (timeline: any) => void;
 };
 
 interface LabelerProps {